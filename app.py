@@ -52,7 +52,7 @@ db.init_app(app)
 # Đảm bảo có một app context khi truy vấn DB
 with app.app_context():
     # Import WebConfig model trước khi tạo bảng để đảm bảo nó được đăng ký với SQLAlchemy
-    from models.web_config import WebConfig, APIKey
+    from models.web_config import WebConfig, APIKey, ConfigVersion
     from models.transaction import Transaction
     try:
     # Kiểm tra xem bảng đã tồn tại chưa trước khi tạo
@@ -60,7 +60,7 @@ with app.app_context():
         tables_to_create = False
         
         # Danh sách các bảng cần kiểm tra
-        tables_needed = ['role', 'user', 'web_config', 'transactions', 'api_key']
+        tables_needed = ['role', 'user', 'web_config', 'transactions', 'api_key', 'config_version']
         
         for table in tables_needed:
             if not inspector.has_table(table):
@@ -77,6 +77,14 @@ with app.app_context():
             Role.insert_roles()
         else:
             print('Các bảng đã tồn tại, bỏ qua việc tạo bảng.')
+            # Cột thêm sau khi bảng api_key đã được tạo
+            api_key_columns = {column['name'] for column in inspector.get_columns('api_key')}
+            if 'rpm_limit' not in api_key_columns:
+                with db.engine.begin() as connection:
+                    connection.execute(db.text('ALTER TABLE api_key ADD COLUMN rpm_limit INTEGER'))
+                print('Đã thêm cột api_key.rpm_limit.')
+        # Dòng phiên bản của các cache cấu hình có sẵn trước request đầu tiên
+        ConfigVersion.ensure(WebConfig.CACHE_SCOPE, APIKey.CACHE_SCOPE)
     except Exception as e:
         print(f"Lỗi khi kiểm tra hoặc tạo bảng: {e}")
 # Cấu hình Flask-Login
@@ -125,7 +133,18 @@ def inject_config():
 # Đăng ký các route
 register_routes(app)
 
+
+@app.before_request
+def start_background_jobs():
+    """Khởi động luồng kiểm tra API key và warm-up của worker hiện tại (một lần sau khi fork)"""
+    from utils.key_validator import start_key_validator
+    from utils.warmup import start_warmup
+    start_key_validator(app)
+    start_warmup(app)
+
 def run_app():
+    from utils.warmup import start_warmup
+    start_warmup(app)
     app.run(host="0.0.0.0", port=55003)
 
 if __name__ == '__main__':
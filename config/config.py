@@ -12,6 +12,7 @@ DB_PATH = os.path.join(BASE_DIR, "form_data.json")
 FORM_HISTORY_PATH = os.path.join(BASE_DIR, "form_history.json")
 UPLOADS_DIR = os.path.join(BASE_DIR, "uploads")
 TEMPLATE_FORMS_PATH = os.path.join(BASE_DIR, "data", "template_forms.json")
+FEEDBACK_LOG_PATH = os.path.join(BASE_DIR, "feedback_log.jsonl")
 
 # Đảm bảo thư mục uploads tồn tại
 if not os.path.exists(UPLOADS_DIR):
@@ -20,6 +21,16 @@ if not os.path.exists(UPLOADS_DIR):
 # Cấu hình OpenAI
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
+# Ngân sách token cho nội dung biểu mẫu trong prompt LLM
+PROMPT_TOKEN_BUDGET = int(os.environ.get('PROMPT_TOKEN_BUDGET', '1200'))
+STRUCTURE_PROMPT_TOKEN_BUDGET = int(os.environ.get('STRUCTURE_PROMPT_TOKEN_BUDGET', '900'))
+# Số giây không gọi lại LLM cho biểu mẫu vừa phân tích lỗi
+FORM_ANALYSIS_FAILURE_TTL = float(os.environ.get('FORM_ANALYSIS_FAILURE_TTL', '30'))
+
+# Mô hình Gemini: phân tích biểu mẫu/ngữ cảnh và viết lại nội dung
+GEMINI_MODEL = os.environ.get('GEMINI_MODEL', 'gemini-2.0-flash')
+GEMINI_REWRITE_MODEL = os.environ.get('GEMINI_REWRITE_MODEL', 'gemini-1.5-pro')
+
 # Cấu hình Google OAuth
 GOOGLE_CLIENT_ID = os.environ.get('GOOGLE_CLIENT_ID')
 GOOGLE_CLIENT_SECRET = os.environ.get('GOOGLE_CLIENT_SECRET')
@@ -8,4 +8,5 @@ set -e
 python /app/create_admin.py
 
 # Chạy ứng dụng với Gunicorn
-exec gunicorn --bind 0.0.0.0:55003 --workers 4 --timeout 120 --access-logfile - --error-logfile - app:app
\ No newline at end of file
+# (cấu hình worker, preload mô hình: xem gunicorn.conf.py)
+exec gunicorn -c /app/gunicorn.conf.py app:app
\ No newline at end of file
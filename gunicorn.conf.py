@@ -0,0 +1,48 @@
+# Cấu hình Gunicorn cho môi trường production
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '55003')}"
+workers = int(os.environ.get('GUNICORN_WORKERS', '4'))
+# utils/rate_limiter chia hạn mức request/phút của mỗi key cho số worker này
+os.environ['GUNICORN_WORKERS'] = str(workers)
+timeout = 120
+accesslog = '-'
+errorlog = '-'
+
+# Nạp ứng dụng (và các mô hình ML) một lần trong master rồi fork worker,
+# nhằm cho các worker dùng chung trọng số mô hình theo cơ chế copy-on-write
+# (mức tiết kiệm chưa đo: xem measure_rss.py và README).
+# Đặt GUNICORN_PRELOAD=0 để quay về chế độ mỗi worker tự nạp mô hình.
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') != '0'
+
+
+def when_ready(server):
+    """Chạy trong master ngay trước khi fork các worker đầu tiên"""
+    if preload_app:
+        # Nạp mô hình một lần trong master để mọi worker thừa hưởng; các bước suy
+        # luận (khởi tạo thread pool OpenMP, không an toàn khi fork) chạy trong worker
+        from app import app
+        from utils.warmup import start_warmup
+        from utils.model_registry import freeze_shared_state
+        start_warmup(app, background=False, master=True)
+        freeze_shared_state()
+
+
+def post_fork(server, worker):
+    """Không dùng lại kết nối DB đã mở trong master sau khi fork; chia hạn mức key theo số worker"""
+    # Số worker thật (có thể bị -w ghi đè) để chia hạn mức request/phút của key
+    os.environ['GUNICORN_WORKERS'] = str(server.cfg.workers)
+    if preload_app:
+        from utils.rate_limiter import get_rate_limiter
+        get_rate_limiter().set_workers(server.cfg.workers)
+        from app import app
+        from models.user import db
+        with app.app_context():
+            db.engine.dispose(close=False)
+
+
+def post_worker_init(worker):
+    """Worker đã nạp ứng dụng: chạy nốt các bước warm-up của tiến trình này trong nền"""
+    from app import app
+    from utils.warmup import start_warmup
+    start_warmup(app)
@@ -0,0 +1,82 @@
+"""
+So sánh dung lượng và recall của kho embedding trường theo kiểu lượng tử hóa.
+
+Với mỗi kiểu (float32, float16, int8) in ra số byte của EmbeddingStore, số
+byte của cách lưu cũ (dict tên trường -> mảng float64), recall@k và sai số
+cosine so với float32 đầy đủ.
+
+    python measure_embeddings.py                      # ảnh chụp mô hình mới nhất
+    python measure_embeddings.py --synthetic 300000   # dữ liệu giả, 300k trường
+"""
+import os
+import sys
+import time
+import json
+import argparse
+
+import numpy as np
+
+from utils.embedding_store import DTYPES, EmbeddingStore, evaluate_recall
+
+
+def synthetic_vectors(rows, dim, seed=0):
+    """Vector giả có cấu trúc cụm (giống tên trường gần nghĩa) thay vì nhiễu đều"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(1, rows // 100), dim)).astype(np.float32)
+    return centers[rng.integers(0, len(centers), rows)] + 0.6 * rng.normal(size=(rows, dim)).astype(np.float32)
+
+
+def snapshot_vectors():
+    """Embedding trung bình float32 của ảnh chụp mô hình mới nhất, tính lại từ Word2Vec"""
+    from gensim.models import KeyedVectors
+    from utils.model_snapshot import MODEL_SNAPSHOT_DIR, _field_embeddings
+    entries = [entry for entry in os.scandir(MODEL_SNAPSHOT_DIR)
+               if entry.is_dir() and os.path.exists(os.path.join(entry.path, 'manifest.json'))]
+    if not entries:
+        return None
+    latest = max(entries, key=lambda entry: entry.stat().st_mtime).path
+    with open(os.path.join(latest, 'manifest.json'), 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    if not manifest.get('has_word_vectors'):
+        return None
+    word_vectors = KeyedVectors.load(os.path.join(latest, 'word_vectors.kv'), mmap='r')
+    vectors = _field_embeddings(word_vectors, manifest['field_names'], manifest['processed_fields'])
+    return np.stack(list(vectors.values())) if vectors else None
+
+
+def dict_bytes(vectors):
+    """Dung lượng cách lưu cũ: dict với mỗi trường một mảng float64 riêng"""
+    as_dict = {i: vector.astype(np.float64) for i, vector in enumerate(vectors)}
+    return sys.getsizeof(as_dict) + sum(sys.getsizeof(vector) for vector in as_dict.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--synthetic', type=int, default=0, help='số trường giả (0: dùng ảnh chụp)')
+    parser.add_argument('--dim', type=int, default=100)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--queries', type=int, default=500)
+    args = parser.parse_args()
+
+    vectors = synthetic_vectors(args.synthetic, args.dim) if args.synthetic else snapshot_vectors()
+    if vectors is None:
+        print("Không có ảnh chụp mô hình có Word2Vec; dùng --synthetic N")
+        return 1
+
+    keys = range(len(vectors))
+    print(f"{len(vectors)} trường x {vectors.shape[1]} chiều; dict float64 cũ: {dict_bytes(vectors) / 2**20:.1f} MB")
+    print(f"{'kiểu':>8} {'dung lượng':>12} {'recall@' + str(args.k):>10} {'sai số max':>11} "
+          f"{'sai số tb':>10} {'truy vấn':>10}")
+    for dtype in DTYPES:
+        store = EmbeddingStore.from_vectors(keys, vectors, dtype)
+        started = time.perf_counter()
+        store.similarities(vectors[0])
+        elapsed = time.perf_counter() - started
+        quality = evaluate_recall(vectors, store, k=args.k, sample=args.queries)
+        print(f"{dtype:>8} {store.nbytes / 2**20:>9.1f} MB {quality['recall_at_k']:>10.4f} "
+              f"{quality['max_abs_error']:>11.6f} {quality['mean_abs_error']:>10.6f} {elapsed * 1000:>7.1f} ms")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,100 @@
+"""
+Báo cáo bộ nhớ của master và các worker Gunicorn.
+
+Đọc /proc/<pid>/smaps_rollup để lấy RSS, PSS và phần bộ nhớ dùng chung.
+PSS chia đều trang dùng chung cho các tiến trình, nên tổng PSS là mức bộ nhớ
+thực tế của cả nhóm. USS (Private_Clean + Private_Dirty) là phần riêng của
+từng tiến trình: bộ nhớ được giải phóng khi worker đó thoát.
+
+So sánh trước/sau khi bật preload:
+    GUNICORN_PRELOAD=0 ./docker-entrypoint.sh   # rồi: python measure_rss.py --markdown
+    GUNICORN_PRELOAD=1 ./docker-entrypoint.sh   # rồi: python measure_rss.py --markdown
+"""
+import argparse
+import os
+import sys
+
+FIELDS = ('Rss', 'Pss', 'Shared_Clean', 'Shared_Dirty', 'Private_Clean', 'Private_Dirty')
+COLUMNS = FIELDS + ('Uss',)
+
+
+def read_rollup(pid):
+    """Đọc các chỉ số bộ nhớ (kB) của một tiến trình"""
+    stats = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if parts and parts[0].rstrip(':') in FIELDS:
+                stats[parts[0].rstrip(':')] = int(parts[1])
+    stats['Uss'] = stats.get('Private_Clean', 0) + stats.get('Private_Dirty', 0)
+    return stats
+
+
+def find_gunicorn_master():
+    """Tìm PID master Gunicorn (tiến trình gunicorn có cha không phải gunicorn)"""
+    pids = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/cmdline', 'rb') as f:
+                cmdline = f.read().replace(b'\0', b' ').decode(errors='ignore')
+            with open(f'/proc/{entry}/stat') as f:
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if 'gunicorn' in cmdline:
+            pids[int(entry)] = ppid
+    masters = [pid for pid, ppid in pids.items() if ppid not in pids]
+    return (masters[0] if masters else None), pids
+
+
+def _mb(kb) -> str:
+    return f"{kb / 1024:.1f}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('master', nargs='?', type=int, help='PID master (mặc định: tự tìm)')
+    parser.add_argument('--markdown', action='store_true',
+                        help='in thêm một dòng bảng Markdown (PSS/USS trung bình mỗi worker) để dán vào README')
+    args = parser.parse_args()
+
+    master, pids = find_gunicorn_master()
+    if args.master:
+        master = args.master
+    if master is None:
+        print("Không tìm thấy tiến trình gunicorn")
+        return 1
+
+    preload = os.environ.get('GUNICORN_PRELOAD', '1') != '0'
+    workers = sorted(pid for pid, ppid in pids.items() if ppid == master)
+    print(f"preload: {preload}")
+    print(f"{'pid':>8} {'role':>7} " + " ".join(f"{name:>14}" for name in COLUMNS))
+
+    totals = dict.fromkeys(COLUMNS, 0)
+    worker_totals = dict.fromkeys(COLUMNS, 0)
+    for pid in [master] + workers:
+        stats = read_rollup(pid)
+        for name in COLUMNS:
+            totals[name] += stats.get(name, 0)
+            if pid != master:
+                worker_totals[name] += stats.get(name, 0)
+        role = 'master' if pid == master else 'worker'
+        print(f"{pid:>8} {role:>7} " + " ".join(f"{stats.get(name, 0) / 1024:>11.1f} MB" for name in COLUMNS))
+
+    print(f"{'tổng':>16} " + " ".join(f"{totals[name] / 1024:>11.1f} MB" for name in COLUMNS))
+
+    if args.markdown and workers:
+        count = len(workers)
+        print()
+        print("| preload | worker | PSS/worker (MB) | USS/worker (MB) | RSS/worker (MB) | tổng PSS (MB) |")
+        print("|---|---|---|---|---|---|")
+        print(f"| {'bật' if preload else 'tắt'} | {count} | {_mb(worker_totals['Pss'] / count)} "
+              f"| {_mb(worker_totals['Uss'] / count)} | {_mb(worker_totals['Rss'] / count)} "
+              f"| {_mb(totals['Pss'])} |")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
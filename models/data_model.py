@@ -1,6 +1,7 @@
 import json
 import os
 from config.config import DB_PATH, FORM_HISTORY_PATH
+from utils.json_store import write_json, update_json
 
 def load_db():
     """
@@ -13,10 +14,9 @@ def load_db():
 
 def save_db(data):
     """
-    Lưu dữ liệu vào file JSON
+    Lưu dữ liệu vào file JSON (ghi nguyên tử)
     """
-    with open(DB_PATH, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=4)
+    write_json(DB_PATH, data)
 
 def load_form_history():
     """
@@ -37,7 +37,15 @@ def load_form_history():
 
 def save_form_history(data):
     """
-    Lưu lịch sử biểu mẫu vào file JSON
+    Lưu lịch sử biểu mẫu vào file JSON (ghi nguyên tử, ghi đè toàn bộ)
     """
-    with open(FORM_HISTORY_PATH, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=4)
\ No newline at end of file
+    write_json(FORM_HISTORY_PATH, data)
+
+def update_form_history(mutate):
+    """
+    Sửa lịch sử biểu mẫu an toàn khi nhiều worker cùng ghi.
+
+    mutate nhận danh sách lịch sử mới nhất, sửa tại chỗ và trả về kết quả cho
+    người gọi; có thể bị gọi lại nếu worker khác ghi xen vào.
+    """
+    return update_json(FORM_HISTORY_PATH, mutate, default=list)
\ No newline at end of file
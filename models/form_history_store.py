@@ -0,0 +1,334 @@
+"""
+Lịch sử biểu mẫu trong bộ nhớ kèm chỉ mục.
+
+form_history.json vẫn là nơi lưu trữ chính. Store giữ bản đã parse trong bộ
+nhớ và chỉ đọc lại file khi phiên bản (inode, mtime, kích thước) thay đổi, nên mọi
+worker thấy thay đổi của worker khác ở lượt đọc kế tiếp.
+
+Chỉ mục được dựng lại mỗi lần nạp:
+    - thứ tự theo thời gian: danh sách khóa (timestamp, form_id, vị trí) tăng
+      dần, đọc ngược để lấy bản ghi mới nhất trước;
+    - theo người dùng: cùng dạng danh sách trên, tách theo user_id;
+    - khóa chính form_id và khóa phụ mã file upload (phần trước '_' trong tên
+      file) -> vị trí, để xem/xóa một biểu mẫu không phải quét lịch sử.
+
+Chỉ mục toàn văn (tên tài liệu, loại biểu mẫu, tên và giá trị trường) được
+cập nhật tăng dần khi nạp lại: so với bản trước, phần đầu và phần cuối giống
+nhau được giữ nguyên, chỉ đoạn ở giữa bị thay (bản ghi thêm, sửa, xóa) được
+gỡ và đánh chỉ mục lại; bản ghi phía sau đoạn đó chỉ được đổi khóa theo vị trí
+mới. Lưu thêm biểu mẫu vào cuối file chỉ đánh chỉ mục các bản ghi mới.
+
+Bản ghi trả về là dict dùng chung giữa các request: chỉ đọc, muốn thêm
+trường hiển thị thì sao chép trước (dict(record)).
+"""
+import os
+import json
+import logging
+import heapq
+import threading
+from bisect import bisect_left
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from config.config import FORM_HISTORY_PATH
+from utils.json_store import file_version, update_json
+from utils.text_index import TextIndex
+
+logger = logging.getLogger(__name__)
+
+ANY_USER = object()
+
+
+def _user_key(user_id) -> Optional[str]:
+    return str(user_id) if user_id is not None else None
+
+
+def _timestamp_key(record: Dict) -> str:
+    """Chuẩn hóa timestamp ISO để so sánh đúng thứ tự thời gian"""
+    value = record.get('timestamp') or ''
+    try:
+        return datetime.fromisoformat(value).isoformat(timespec='microseconds')
+    except (TypeError, ValueError):
+        return ''
+
+
+def file_id_from_path(path) -> str:
+    """Mã file upload: phần trước '_' của tên file (hoặc tên file bỏ đuôi)"""
+    file_name = os.path.basename(str(path or ''))
+    return file_name.split('_')[0] if '_' in file_name else file_name.split('.')[0]
+
+
+def _record_key(record, position: int) -> Optional[Tuple[str, str, int]]:
+    """Khóa (timestamp, form_id, vị trí) của bản ghi; None với phần tử không phải dict"""
+    if not isinstance(record, dict):
+        return None
+    return (_timestamp_key(record), str(record.get('form_id') or ''), position)
+
+
+def _changed_range(old: List, new: List) -> Tuple[int, int, int]:
+    """
+    Đoạn khác nhau giữa hai bản lịch sử: (start, old_end, new_end) sao cho
+    old[start:old_end] được thay bằng new[start:new_end], phần còn lại giống nhau.
+    """
+    if new[:len(old)] == old:
+        # Chỉ thêm vào cuối (so sánh trong C, không duyệt từng bản ghi)
+        return len(old), len(old), len(new)
+    limit = min(len(old), len(new))
+    start = 0
+    while start < limit and old[start] == new[start]:
+        start += 1
+    tail = 0
+    while tail < limit - start and old[-1 - tail] == new[-1 - tail]:
+        tail += 1
+    return start, len(old) - tail, len(new) - tail
+
+
+def _indexed_texts(record: Dict):
+    """Các phần văn bản được đánh chỉ mục của một bản ghi, kèm trọng số"""
+    form_data = record.get('form_data') if isinstance(record.get('form_data'), dict) else {}
+    texts = [
+        (record.get('name'), 3.0),
+        (form_data.get('document_name'), 3.0),
+        (form_data.get('form_type'), 2.0),
+        (record.get('form_id'), 1.0),
+    ]
+    for field_name, value in form_data.items():
+        if field_name in ('form_id', 'document_name', 'form_type'):
+            continue
+        texts.append((field_name, 1.5))
+        if isinstance(value, str):
+            texts.append((value, 1.0))
+    return texts
+
+
+class FormHistoryStore:
+    """Đọc lịch sử biểu mẫu qua chỉ mục thay vì quét toàn bộ file"""
+
+    def __init__(self, path: str = FORM_HISTORY_PATH):
+        self.path = path
+        self._lock = threading.RLock()
+        self._signature = None
+        # (bản ghi, chỉ mục thời gian, chỉ mục theo người dùng, khóa -> vị trí,
+        #  form_id -> vị trí, mã file -> vị trí) thay thế cùng lúc
+        self._state = ([], [], {}, {}, {}, {})
+        self._text_index = TextIndex()
+
+    def _file_signature(self):
+        return file_version(self.path)
+
+    def _snapshot(self):
+        """Nạp lại nếu file đã đổi, trả về trạng thái nhất quán hiện tại"""
+        signature = self._file_signature()
+        if signature != self._signature:
+            with self._lock:
+                if signature != self._signature:
+                    records = []
+                    if signature is not None:
+                        try:
+                            with open(self.path, 'r', encoding='utf-8') as f:
+                                data = json.load(f)
+                            records = data if isinstance(data, list) else []
+                        except (OSError, ValueError) as e:
+                            logger.error(f"Không đọc được lịch sử biểu mẫu: {e}")
+                            return self._state
+                    state = self._build_state(records)
+                    self._sync_text_index(self._state[0], records)
+                    self._state = state
+                    self._signature = signature
+        return self._state
+
+    @staticmethod
+    def _build_state(records: List[Dict]):
+        timeline = []
+        by_user: Dict[Optional[str], List[Tuple[str, str, int]]] = {}
+        by_key: Dict[Tuple[str, str, int], int] = {}
+        by_form_id: Dict[str, int] = {}
+        by_file_id: Dict[str, int] = {}
+        for position, record in enumerate(records):
+            if not isinstance(record, dict):
+                continue
+            key = _record_key(record, position)
+            timeline.append(key)
+            by_user.setdefault(_user_key(record.get('user_id')), []).append(key)
+            by_key[key] = position
+            # Trùng mã thì giữ bản ghi đầu tiên, như vòng lặp tìm kiếm trước đây
+            if key[1]:
+                by_form_id.setdefault(key[1], position)
+            if record.get('path'):
+                by_file_id.setdefault(file_id_from_path(record['path']), position)
+        timeline.sort()
+        for keys in by_user.values():
+            keys.sort()
+        return records, timeline, by_user, by_key, by_form_id, by_file_id
+
+    def _sync_text_index(self, old: List, new: List):
+        """Cập nhật chỉ mục toàn văn theo đoạn bản ghi đã đổi giữa hai lần nạp"""
+        start, old_end, new_end = _changed_range(old, new)
+        index = self._text_index
+        for position in range(start, old_end):
+            key = _record_key(old[position], position)
+            if key is not None:
+                index.remove(key)
+        # Bản ghi phía sau đoạn đã đổi dịch vị trí: chỉ đổi khóa, không tách từ lại.
+        # Thứ tự duyệt tránh đè lên khóa chưa kịp đổi
+        shift = new_end - old_end
+        if shift:
+            tail = range(old_end, len(old))
+            for position in (reversed(tail) if shift > 0 else tail):
+                key = _record_key(old[position], position)
+                if key is not None:
+                    index.rename(key, key[:2] + (position + shift,))
+        for position in range(start, new_end):
+            key = _record_key(new[position], position)
+            if key is not None:
+                index.update(key, _indexed_texts(new[position]))
+        if old_end > start or new_end > start:
+            logger.debug(f"Đã cập nhật chỉ mục toàn văn: gỡ {old_end - start}, thêm {new_end - start}, "
+                         f"dời {len(old) - old_end if shift else 0} biểu mẫu")
+
+    @staticmethod
+    def _index(state, user_id) -> List[Tuple[str, str, int]]:
+        _, timeline, by_user = state[:3]
+        if user_id is ANY_USER:
+            return timeline
+        return by_user.get(_user_key(user_id), [])
+
+    def records(self) -> List[Dict]:
+        """Toàn bộ bản ghi theo thứ tự trong file"""
+        return self._snapshot()[0]
+
+    def user_ids(self) -> List[str]:
+        """Các user_id (dạng chuỗi) có trong lịch sử"""
+        return [user_id for user_id in self._snapshot()[2] if user_id is not None]
+
+    def count(self, user_id=ANY_USER) -> int:
+        return len(self._index(self._snapshot(), user_id))
+
+    def newest(self, user_id=ANY_USER, offset: int = 0, limit: int = 20) -> List[Dict]:
+        """Trang bản ghi mới nhất trước, tùy chọn lọc theo người dùng"""
+        state = self._snapshot()
+        index = self._index(state, user_id)
+        end = max(0, len(index) - offset)
+        start = max(0, end - limit)
+        return [state[0][position] for _, _, position in reversed(index[start:end])]
+
+    def iter_newest(self, user_id=ANY_USER):
+        """Duyệt bản ghi từ mới tới cũ (dùng khi cần lọc thêm)"""
+        for _, record in self.scan(user_id):
+            yield record
+
+    def scan(self, user_ids=ANY_USER, before: Optional[Tuple] = None):
+        """
+        Duyệt (khóa, bản ghi) từ mới tới cũ của một hoặc nhiều người dùng.
+
+        Args:
+            user_ids: một user_id, danh sách user_id (gộp theo thời gian) hoặc ANY_USER
+            before: khóa (timestamp, form_id, vị trí) của con trỏ; chỉ trả các bản ghi đứng trước
+
+        Khóa trả về là (timestamp, form_id, vị trí trong file) và dùng làm con
+        trỏ cho trang tiếp theo: có vị trí nên các bản ghi trùng (timestamp,
+        form_id) không bị bỏ qua khi nằm ở ranh giới trang. Vị trí bắt đầu được
+        tìm bằng bisect nên chi phí không phụ thuộc số trang đã đọc.
+        """
+        state = self._snapshot()
+        records = state[0]
+        if not isinstance(user_ids, (list, tuple, set)):
+            user_ids = [user_ids]
+
+        def descending(index):
+            end = bisect_left(index, tuple(before)) if before else len(index)
+            for i in range(end - 1, -1, -1):
+                yield index[i]
+
+        for key in heapq.merge(*(descending(self._index(state, uid)) for uid in user_ids), reverse=True):
+            yield key, records[key[2]]
+
+
+    def search(self, query: str, user_id=ANY_USER, limit: Optional[int] = None) -> List[Tuple[Dict, float]]:
+        """
+        Tìm biểu mẫu theo tên tài liệu, loại biểu mẫu, tên và giá trị trường.
+
+        Không phân biệt dấu, mỗi từ được khớp theo tiền tố. Trả về danh sách
+        (bản ghi, điểm) điểm cao nhất trước, tùy chọn lọc theo người dùng.
+        """
+        state = self._snapshot()
+        records, by_key = state[0], state[3]
+        allowed = None
+        if user_id is not ANY_USER:
+            user_ids = user_id if isinstance(user_id, (list, tuple, set)) else [user_id]
+            allowed = {_user_key(uid) for uid in user_ids}
+        results = []
+        for key, score in self._text_index.search(query):
+            position = by_key.get(key)
+            if position is None:
+                continue
+            record = records[position]
+            if allowed is not None and _user_key(record.get('user_id')) not in allowed:
+                continue
+            results.append((record, score))
+            if limit is not None and len(results) >= limit:
+                break
+        return results
+
+    def matching_keys(self, query: str) -> Optional[set]:
+        """Tập khóa (timestamp, form_id, vị trí) khớp query; None nếu query rỗng"""
+        self._snapshot()
+        return self._text_index.matching(query)
+
+
+    def find(self, form_id: str) -> Optional[Dict]:
+        """Tra bản ghi theo form_id, nếu không có thì theo mã file upload"""
+        state = self._snapshot()
+        form_id = str(form_id or '')
+        position = state[4].get(form_id)
+        if position is None:
+            position = state[5].get(form_id.split('_')[0])
+        return state[0][position] if position is not None else None
+
+    def delete(self, record: Dict) -> bool:
+        """
+        Xóa một bản ghi (lấy từ find/newest) khỏi lịch sử.
+
+        Vị trí bản ghi lấy từ chỉ mục, chỉ phải tìm lại khi worker khác đã sửa
+        file trong lúc đó; file JSON vẫn được ghi lại toàn bộ (ghi nguyên tử)
+        vì đây là một mảng JSON duy nhất.
+        """
+        state = self._snapshot()
+        records, timeline = state[0], state[1]
+        prefix = (_timestamp_key(record), str(record.get('form_id') or ''))
+        # Các bản ghi trùng (timestamp, form_id) nằm liền nhau trong timeline:
+        # chọn đúng bản ghi theo vị trí
+        hint = None
+        for i in range(bisect_left(timeline, prefix), len(timeline)):
+            if timeline[i][:2] != prefix:
+                break
+            if records[timeline[i][2]] is record:
+                hint = timeline[i][2]
+                break
+        if hint is None:
+            return False
+
+        def remove(history):
+            if hint < len(history) and history[hint] == record:
+                position = hint
+            else:
+                position = next((i for i, item in enumerate(history) if item == record), None)
+            if position is None:
+                return False
+            del history[position]
+            return True
+
+        removed = update_json(self.path, remove)
+        self._snapshot()
+        return removed
+
+
+_store = None
+
+
+def get_form_history_store() -> FormHistoryStore:
+    """FormHistoryStore dùng chung trong tiến trình"""
+    global _store
+    if _store is None:
+        _store = FormHistoryStore()
+    return _store
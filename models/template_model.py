@@ -1,6 +1,14 @@
 import json
 import os
+import threading
 from config.config import TEMPLATE_FORMS_PATH
+from utils.json_store import write_json, update_json, file_version
+from utils.text_index import TextIndex
+
+# Chỉ mục toàn văn của biểu mẫu tham khảo, đồng bộ lại khi file thay đổi
+_template_index = TextIndex()
+_template_index_signature = None
+_template_index_lock = threading.Lock()
 
 def load_template_forms():
     """
@@ -21,12 +29,9 @@ def load_template_forms():
 
 def save_template_forms(data):
     """
-    Lưu danh sách biểu mẫu tham khảo vào file JSON
+    Lưu danh sách biểu mẫu tham khảo vào file JSON (ghi nguyên tử)
     """
-    # Đảm bảo thư mục tồn tại
-    os.makedirs(os.path.dirname(TEMPLATE_FORMS_PATH), exist_ok=True)
-    with open(TEMPLATE_FORMS_PATH, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=4)
+    write_json(TEMPLATE_FORMS_PATH, data)
 
 def get_template_form_by_id(template_id):
     """
@@ -39,42 +44,56 @@ def add_template_form(template_data):
     """
     Thêm biểu mẫu tham khảo mới
     """
-    templates = load_template_forms()
-    templates.append(template_data)
-    save_template_forms(templates)
+    update_json(TEMPLATE_FORMS_PATH, lambda templates: templates.append(template_data))
     return template_data
 
 def update_template_form(template_id, updated_data):
     """
     Cập nhật biểu mẫu tham khảo
     """
-    templates = load_template_forms()
-    for i, template in enumerate(templates):
-        if template.get('template_id') == template_id:
-            templates[i].update(updated_data)
-            save_template_forms(templates)
-            return templates[i]
-    return None
+    def apply(templates):
+        for template in templates:
+            if template.get('template_id') == template_id:
+                template.update(updated_data)
+                return template
+        return None
+    return update_json(TEMPLATE_FORMS_PATH, apply)
 
 def delete_template_form(template_id):
     """
     Xóa biểu mẫu tham khảo
     """
-    templates = load_template_forms()
-    templates = [t for t in templates if t.get('template_id') != template_id]
-    save_template_forms(templates)
+    def apply(templates):
+        templates[:] = [t for t in templates if t.get('template_id') != template_id]
+    update_json(TEMPLATE_FORMS_PATH, apply)
     return True
 
+def _sync_template_index(templates):
+    """Cập nhật chỉ mục cho các biểu mẫu mới/đã sửa khi file đổi chữ ký"""
+    global _template_index_signature
+    signature = file_version(TEMPLATE_FORMS_PATH)
+    with _template_index_lock:
+        if signature == _template_index_signature:
+            return
+        _template_index.sync({
+            position: [
+                (t.get('name'), 3.0),
+                (t.get('category'), 2.0),
+                (t.get('description'), 1.0),
+            ]
+            for position, t in enumerate(templates) if isinstance(t, dict)
+        })
+        _template_index_signature = signature
+
 def search_template_forms(query):
     """
-    Tìm kiếm biểu mẫu tham khảo theo từ khóa
+    Tìm kiếm biểu mẫu tham khảo theo từ khóa (không phân biệt dấu, khớp tiền tố),
+    kết quả phù hợp nhất trước
     """
     templates = load_template_forms()
     if not query:
         return templates
     
-    query = query.lower()
-    return [t for t in templates if 
-            query in t.get('name', '').lower() or 
-            query in t.get('description', '').lower() or
-            query in t.get('category', '').lower()]
\ No newline at end of file
+    _sync_template_index(templates)
+    return [templates[position] for position, _ in _template_index.search(query)
+            if position < len(templates)]
\ No newline at end of file
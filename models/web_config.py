@@ -1,5 +1,115 @@
 from models.user import db
 from datetime import datetime
+import time
+import logging
+import threading
+
+from sqlalchemy.exc import IntegrityError
+
+logger = logging.getLogger(__name__)
+
+
+class ConfigVersion(db.Model):
+    """Số phiên bản của từng nhóm cấu hình, tăng mỗi khi dữ liệu nhóm đó thay đổi"""
+    __tablename__ = 'config_version'
+    scope = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    @classmethod
+    def get_version(cls, scope):
+        """Đọc số phiên bản hiện tại (một SELECT theo khóa chính)"""
+        row = db.session.query(cls.version).filter_by(scope=scope).first()
+        return row[0] if row else 0
+
+    @classmethod
+    def ensure(cls, *scopes):
+        """Tạo sẵn dòng phiên bản cho các scope (gọi lúc khởi động) để bump chỉ còn UPDATE"""
+        existing = {scope for scope, in db.session.query(cls.scope).filter(cls.scope.in_(scopes)).all()}
+        missing = [scope for scope in scopes if scope not in existing]
+        if not missing:
+            return
+        db.session.add_all([cls(scope=scope, version=0) for scope in missing])
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Worker khác vừa tạo cùng lúc
+            db.session.rollback()
+
+    @classmethod
+    def bump(cls, scope, commit=True):
+        """Tăng số phiên bản; commit=False để gộp vào transaction đang mở"""
+        updated = cls.query.filter_by(scope=scope).update(
+            {cls.version: cls.version + 1, cls.updated_at: datetime.utcnow()},
+            synchronize_session=False
+        )
+        if not updated:
+            db.session.add(cls(scope=scope, version=1))
+        if commit:
+            try:
+                db.session.commit()
+            except IntegrityError:
+                # Worker khác vừa tạo dòng này: tăng lại trên dòng đã có
+                db.session.rollback()
+                cls.query.filter_by(scope=scope).update(
+                    {cls.version: cls.version + 1, cls.updated_at: datetime.utcnow()},
+                    synchronize_session=False
+                )
+                db.session.commit()
+
+
+class VersionedCache:
+    """
+    Cache trong tiến trình cho dữ liệu cấu hình ít thay đổi.
+
+    Giá trị được nạp bằng loader() và giữ trong bộ nhớ. Sau mỗi
+    check_interval giây, cache đọc số phiên bản của scope trong ConfigVersion;
+    nếu worker khác đã thay đổi dữ liệu (phiên bản khác) thì nạp lại. Dù phiên
+    bản không đổi, giá trị cũng được nạp lại sau max_age giây.
+    """
+
+    def __init__(self, scope, loader, check_interval=5.0, max_age=300.0):
+        self.scope = scope
+        self.loader = loader
+        self.check_interval = check_interval
+        self.max_age = max_age
+        self._value = None
+        self._version = None
+        self._loaded_at = 0.0
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        now = time.monotonic()
+        if self._value is not None and now - self._checked_at < self.check_interval:
+            return self._value
+
+        with self._lock:
+            if self._value is not None and now - self._checked_at < self.check_interval:
+                return self._value
+            try:
+                version = ConfigVersion.get_version(self.scope)
+            except Exception as e:
+                if self._value is None:
+                    raise
+                logger.warning(f"Không đọc được phiên bản cấu hình '{self.scope}', dùng cache cũ: {e}")
+                self._checked_at = now
+                return self._value
+
+            if self._value is None or version != self._version or now - self._loaded_at >= self.max_age:
+                self._value = self.loader()
+                self._version = version
+                self._loaded_at = now
+            self._checked_at = now
+            return self._value
+
+    def invalidate(self, broadcast=True, commit=True):
+        """Xóa cache của tiến trình này; broadcast=True để báo cho các worker khác"""
+        with self._lock:
+            self._value = None
+        if broadcast:
+            ConfigVersion.bump(self.scope, commit=commit)
+
 
 class WebConfig(db.Model):
     """Model for storing website configuration settings"""
@@ -9,24 +119,62 @@ class WebConfig(db.Model):
     category = db.Column(db.String(50), nullable=False, default='general')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    CACHE_SCOPE = 'web_config'
+
     @classmethod
     def get_value(cls, key, default=None):
-        """Get a configuration value by key"""
-        config = cls.query.filter_by(key=key).first()
-        return config.value if config else default
+        """Get a configuration value by key (served from the in-process cache)"""
+        return _web_config_cache.get().get(key, default)
     
     @classmethod
     def set_value(cls, key, value, category='general'):
         """Set a configuration value"""
-        config = cls.query.filter_by(key=key).first()
-        if config:
-            config.value = value
-            config.updated_at = datetime.utcnow()
-        else:
-            config = cls(key=key, value=value, category=category)
-            db.session.add(config)
-        db.session.commit()
-        return config
+        return cls.set_many([(key, value, category)])[0]
+
+    @classmethod
+    def set_many(cls, items):
+        """
+        Set many configuration values in a single transaction.
+
+        Args:
+            items: iterable of (key, value, category); category is only used
+                when the key does not exist yet
+
+        Returns:
+            list of WebConfig rows in the same order as items
+        """
+        items = list(items)
+        if not items:
+            return []
+
+        for attempt in range(2):
+            existing = {config.key: config for config in cls.query.filter(cls.key.in_({key for key, _, _ in items})).all()}
+            now = datetime.utcnow()
+            configs = []
+            try:
+                for key, value, category in items:
+                    config = existing.get(key)
+                    if config:
+                        config.value = value
+                        config.updated_at = now
+                    else:
+                        config = existing[key] = cls(key=key, value=value, category=category)
+                        db.session.add(config)
+                    configs.append(config)
+                ConfigVersion.bump(cls.CACHE_SCOPE, commit=False)
+                db.session.commit()
+                break
+            except IntegrityError:
+                # Worker khác vừa tạo cùng một dòng (cấu hình hoặc phiên bản):
+                # làm lại một lần trên các dòng đã có
+                db.session.rollback()
+                if attempt:
+                    raise
+            except Exception:
+                db.session.rollback()
+                raise
+        _web_config_cache.invalidate(broadcast=False)
+        return configs
     
     @classmethod
     def get_all_by_category(cls, category):
@@ -37,6 +185,15 @@ class WebConfig(db.Model):
     def get_all(cls):
         """Get all configuration values"""
         return cls.query.all() 
+
+
+def _load_web_config():
+    """Nạp toàn bộ cấu hình web thành dict key -> value (một SELECT)"""
+    return {key: value for key, value in db.session.query(WebConfig.key, WebConfig.value).all()}
+
+
+# Mọi lượt đọc cấu hình (context processor, trang quản trị...) dùng chung cache này
+_web_config_cache = VersionedCache(WebConfig.CACHE_SCOPE, _load_web_config, check_interval=5.0)
     
 # Thêm trường expiration_date vào model APIKey
 class APIKey(db.Model):
@@ -58,9 +215,11 @@ class APIKey(db.Model):
     successful_requests = db.Column(db.Integer, default=0)
     usage_limit = db.Column(db.Integer, nullable=True)
     usage_reset_at = db.Column(db.DateTime, nullable=True)
+    rpm_limit = db.Column(db.Integer, nullable=True)  # Số request/phút provider cho phép (header x-ratelimit-limit-requests)
     description = db.Column(db.Text, nullable=True)  # Thêm trường description
     expiration_date = db.Column(db.DateTime, nullable=True)
     plan_info = db.Column(db.Text, nullable=True)
+    CACHE_SCOPE = 'api_key'
     
 
    
@@ -126,7 +285,7 @@ class APIKey(db.Model):
         return cls.query.order_by(cls.provider, cls.is_active.desc(), cls.updated_at.desc()).all()
     
     @classmethod
-    def update_key_status(cls, key_id, is_valid, status_message, response_time=None, available_models=None, error_details=None, expiration_date=None, plan_info=None):
+    def update_key_status(cls, key_id, is_valid, status_message, response_time=None, available_models=None, error_details=None, expiration_date=None, plan_info=None, rpm_limit=None):
         """Cập nhật trạng thái của API key"""
         try:
             api_key = cls.query.get(key_id)
@@ -151,6 +310,9 @@ class APIKey(db.Model):
                 
             if plan_info is not None:
                 api_key.plan_info = plan_info
+
+            if rpm_limit is not None:
+                api_key.rpm_limit = rpm_limit
                 
             db.session.commit()
             return api_key
@@ -160,11 +322,10 @@ class APIKey(db.Model):
     
     @classmethod
     def set_active_key(cls, key_id, provider='openai'):
-        """Đặt một API key làm key hoạt động chính và vô hiệu hóa các key khác"""
-        # Vô hiệu hóa tất cả các key hiện tại của provider
-        cls.query.filter_by(provider=provider).update({cls.is_active: False})
-        
-        # Đặt key được chọn làm key hoạt động
+        """
+        Bật một API key. Các key khác của provider giữ nguyên trạng thái: mọi key
+        đang bật đều nằm trong nhóm key được cân bằng tải.
+        """
         api_key = cls.query.get(key_id)
         if api_key and api_key.provider == provider:
             api_key.is_active = True
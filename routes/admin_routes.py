@@ -1,7 +1,7 @@
 from flask import  render_template, request, redirect, url_for, flash, jsonify
 from flask_login import login_required, current_user
 from models.user import db, User, Role
-from models.data_model import load_db, save_db, load_form_history, save_form_history
+from models.data_model import load_db, save_db, load_form_history
 from functools import wraps
 import os
 from datetime import datetime
@@ -53,8 +53,10 @@ def register_admin_routes(app):
         if request.method == 'POST':
             # Process metadata settings
             if 'metadata_form' in request.form:
-                WebConfig.set_value('site_title', request.form.get('site_title'), 'metadata')
-                WebConfig.set_value('site_description', request.form.get('site_description'), 'metadata')
+                updates = [
+                    ('site_title', request.form.get('site_title'), 'metadata'),
+                    ('site_description', request.form.get('site_description'), 'metadata'),
+                ]
                 # Handle logo upload if provided
                 if 'site_logo' in request.files and request.files['site_logo'].filename:
                     logo_file = request.files['site_logo']
@@ -62,36 +64,44 @@ def register_admin_routes(app):
                     filename = secure_filename(logo_file.filename)
                     logo_path = os.path.join('static', 'images', filename)
                     logo_file.save(os.path.join(BASE_DIR, logo_path))
-                    WebConfig.set_value('site_logo', logo_path, 'metadata')
+                    updates.append(('site_logo', logo_path, 'metadata'))
+                WebConfig.set_many(updates)
                 flash('Cập nhật metadata thành công', 'success')
             
             # Process SEO settings
             elif 'seo_form' in request.form:
-                WebConfig.set_value('meta_title', request.form.get('meta_title'), 'seo')
-                WebConfig.set_value('meta_description', request.form.get('meta_description'), 'seo')
+                updates = [
+                    ('meta_title', request.form.get('meta_title'), 'seo'),
+                    ('meta_description', request.form.get('meta_description'), 'seo'),
+                ]
                 # Handle OG image upload if provided
                 if 'og_image' in request.files and request.files['og_image'].filename:
                     og_file = request.files['og_image']
                     filename = secure_filename(og_file.filename)
                     og_path = os.path.join('static', 'images', filename)
                     og_file.save(os.path.join(BASE_DIR, og_path))
-                    WebConfig.set_value('og_image', og_path, 'seo')
-                WebConfig.set_value('robots_txt', request.form.get('robots_txt'), 'seo')
+                    updates.append(('og_image', og_path, 'seo'))
+                updates.append(('robots_txt', request.form.get('robots_txt'), 'seo'))
+                WebConfig.set_many(updates)
                 flash('Cập nhật SEO thành công', 'success')
             
             # Process UI settings
             elif 'ui_form' in request.form:
-                WebConfig.set_value('primary_color', request.form.get('primary_color'), 'ui')
-                WebConfig.set_value('font_family', request.form.get('font_family'), 'ui')
-                WebConfig.set_value('layout_type', request.form.get('layout_type'), 'ui')
-                WebConfig.set_value('display_mode', request.form.get('display_mode'), 'ui')
+                WebConfig.set_many([
+                    ('primary_color', request.form.get('primary_color'), 'ui'),
+                    ('font_family', request.form.get('font_family'), 'ui'),
+                    ('layout_type', request.form.get('layout_type'), 'ui'),
+                    ('display_mode', request.form.get('display_mode'), 'ui'),
+                ])
                 flash('Cập nhật giao diện thành công', 'success')
                 
             # Process contact information settings
             elif 'contact_form' in request.form:
-                WebConfig.set_value('contact_phone', request.form.get('contact_phone'), 'contact')
-                WebConfig.set_value('contact_email', request.form.get('contact_email'), 'contact')
-                WebConfig.set_value('contact_address', request.form.get('contact_address'), 'contact')
+                WebConfig.set_many([
+                    ('contact_phone', request.form.get('contact_phone'), 'contact'),
+                    ('contact_email', request.form.get('contact_email'), 'contact'),
+                    ('contact_address', request.form.get('contact_address'), 'contact'),
+                ])
                 flash('Cập nhật thông tin liên hệ thành công', 'success')
             
             return redirect(url_for('web_config'))
@@ -238,27 +248,31 @@ def register_admin_routes(app):
     @admin_required
     def admin_edit_form(form_id):
         """Chỉnh sửa biểu mẫu"""
-        forms_data = load_form_history()
-        form_index = next((i for i, f in enumerate(forms_data) if f.get('form_id') == form_id), None)
-        
-        if form_index is None:
-            flash('Không tìm thấy biểu mẫu', 'error')
-            return redirect(url_for('admin_forms'))
-        
-        # Cập nhật thông tin biểu mẫu
+        from models.data_model import update_form_history
+
         new_document_name = request.form.get('document_name')
-        if new_document_name:
-            forms_data[form_index]['form_data']['document_name'] = new_document_name
-        
-        # Cập nhật các trường dữ liệu
         field_names = request.form.getlist('field_name[]')
         field_values = request.form.getlist('field_value[]')
+
+        def apply(forms_data):
+            form = next((f for f in forms_data if f.get('form_id') == form_id), None)
+            if form is None:
+                return False
+            
+            # Cập nhật thông tin biểu mẫu
+            if new_document_name:
+                form['form_data']['document_name'] = new_document_name
+            
+            # Cập nhật các trường dữ liệu
+            for name, value in zip(field_names, field_values):
+                if name in form['form_data']:
+                    form['form_data'][name] = value
+            return True
+
+        if not update_form_history(apply):
+            flash('Không tìm thấy biểu mẫu', 'error')
+            return redirect(url_for('admin_forms'))
         
-        for name, value in zip(field_names, field_values):
-            if name in forms_data[form_index]['form_data']:
-                forms_data[form_index]['form_data'][name] = value
-        
-        save_form_history(forms_data)
         flash('Cập nhật biểu mẫu thành công', 'success')
         return redirect(url_for('admin_view_form', form_id=form_id))
     
@@ -267,9 +281,11 @@ def register_admin_routes(app):
     @admin_required
     def admin_delete_form(form_id):
         """Xóa biểu mẫu"""
-        forms_data = load_form_history()
-        forms_data = [f for f in forms_data if f.get('form_id') != form_id]
-        save_form_history(forms_data)
+        from models.data_model import update_form_history
+
+        def apply(forms_data):
+            forms_data[:] = [f for f in forms_data if f.get('form_id') != form_id]
+        update_form_history(apply)
         
         flash('Xóa biểu mẫu thành công', 'success')
         return redirect(url_for('admin_forms'))
@@ -279,49 +295,101 @@ def register_admin_routes(app):
     @admin_required
     def admin_form_history():
         """Xem lịch sử biểu mẫu"""
-        search_query = request.args.get('search_query', '')
+        from models.form_history_store import get_form_history_store, ANY_USER
+
+        search_query = request.args.get('search_query', '').strip()
         user_filter = request.args.get('user_filter', '')
-        
-        history_data = load_form_history()
-        filtered_data = []
-        
-        # Thêm thông tin user_name vào mỗi bản ghi và lọc dữ liệu
-        for record in history_data:
-            user = User.query.get(record.get('user_id'))
-            record['user_name'] = user.fullname if user else 'Unknown'
-            
-            # Lọc theo người dùng nếu có
-            if user_filter and str(record.get('user_id')) != user_filter:
-                continue
-                
-            # Lọc theo từ khóa tìm kiếm nếu có
-            if search_query:
-                # Tìm trong tên người dùng
-                if search_query.lower() in record['user_name'].lower():
-                    filtered_data.append(record)
-                    continue
-                    
-                # Tìm trong tên biểu mẫu
-                if record.get('form_data') and record['form_data'].get('document_name') and search_query.lower() in record['form_data'].get('document_name', '').lower():
-                    filtered_data.append(record)
-                    continue
-                    
-                # Tìm trong ID biểu mẫu
-                if search_query.lower() in str(record.get('form_id', '')).lower():
-                    filtered_data.append(record)
-                    continue
-                    
-                # Không tìm thấy từ khóa trong bản ghi này
-                continue
-            else:
-                # Nếu không có từ khóa tìm kiếm, thêm vào danh sách lọc
-                filtered_data.append(record)
-        
-        # Lấy danh sách người dùng để hiển thị trong dropdown
-        users = User.query.all()
-        
-        return render_template('admin/form_history.html', history=filtered_data, users=users)
+        page = max(1, request.args.get('page', 1, type=int))
+        per_page = min(100, max(1, request.args.get('per_page', 20, type=int)))
+        offset = (page - 1) * per_page
+
+        store = get_form_history_store()
+        user_id = user_filter if user_filter else ANY_USER
+
+        if search_query:
+            # Kết quả từ chỉ mục toàn văn (xếp theo điểm), sau đó là biểu mẫu của
+            # người dùng có tên khớp (tên nằm trong DB nên tìm bằng một truy vấn)
+            matches = [record for record, _ in store.search(search_query, user_id=user_id)]
+            seen = {id(record) for record in matches}
+            matching_users = {
+                str(uid) for (uid,) in db.session.query(User.id).filter(User.fullname.ilike(f'%{search_query}%'))
+            }
+            if matching_users:
+                matches.extend(
+                    record for record in store.iter_newest(user_id)
+                    if str(record.get('user_id')) in matching_users and id(record) not in seen
+                )
+            total = len(matches)
+            page_records = matches[offset:offset + per_page]
+        else:
+            total = store.count(user_id)
+            page_records = store.newest(user_id, offset=offset, limit=per_page)
+
+        # Tên người dùng cho các bản ghi của trang hiện tại: một truy vấn IN
+        page_user_ids = {record.get('user_id') for record in page_records if record.get('user_id') is not None}
+        user_names = dict(
+            db.session.query(User.id, User.fullname).filter(User.id.in_(page_user_ids)).all()
+        ) if page_user_ids else {}
+        filtered_data = [
+            dict(record, user_name=user_names.get(record.get('user_id'), 'Unknown'))
+            for record in page_records
+        ]
+
+        # Dropdown chỉ gồm người dùng có lịch sử, chỉ lấy id và tên
+        history_user_ids = [int(uid) for uid in store.user_ids() if uid.isdigit()]
+        users = db.session.query(User.id, User.fullname).filter(
+            User.id.in_(history_user_ids)
+        ).order_by(User.fullname).all() if history_user_ids else []
+
+        total_pages = max(1, (total + per_page - 1) // per_page)
+        return render_template('admin/form_history.html', history=filtered_data, users=users,
+                               page=page, per_page=per_page, total=total, total_pages=total_pages)
     
+    @app.route('/admin/forms/analytics')
+    @login_required
+    @admin_required
+    def admin_forms_analytics():
+        """Thống kê lịch sử biểu mẫu từ ảnh chụp dạng cột (không parse lại JSON)"""
+        from utils.history_snapshot import get_history_snapshot
+        snapshot = get_history_snapshot()
+        limit = min(100, max(1, request.args.get('limit', 20, type=int)))
+        fill_counts = sorted(snapshot.field_fill_counts().items(), key=lambda item: item[1], reverse=True)
+        result = {
+            'stats': snapshot.stats(),
+            'top_fields': [{'field': name, 'forms': count} for name, count in fill_counts[:limit]],
+        }
+        field_name = request.args.get('field')
+        if field_name:
+            result['top_values'] = [
+                {'value': value, 'count': count} for value, count in snapshot.top_values(field_name, limit)
+            ]
+        return jsonify(result)
+
+    @app.route('/admin/ai-cache-stats')
+    @login_required
+    @admin_required
+    def admin_ai_cache_stats():
+        """
+        Thống kê cache ngữ nghĩa của tính năng viết lại AI.
+
+        Cache nằm trong từng worker: số liệu chỉ của worker trả lời request này
+        (scope='worker', pid), khoảng 1/số worker lưu lượng; gọi lại nhiều lần
+        để xem các worker khác.
+        """
+        from utils.semantic_cache import get_rewrite_cache
+        from utils.rate_limiter import worker_count
+        stats = get_rewrite_cache().stats()
+        stats['workers'] = worker_count()
+        return jsonify(stats)
+
+    @app.route('/admin/ai-provider-health')
+    @login_required
+    @admin_required
+    def admin_ai_provider_health():
+        """Trạng thái circuit breaker và độ trễ của từng API key (theo từng worker)"""
+        from utils.api_key_manager import get_api_key_manager
+        return jsonify({'pid': os.getpid(), 'keys': get_api_key_manager().get_health_snapshot()})
+
     @app.route('/admin/api-settings', methods=['GET', 'POST'])
     @login_required
     @admin_required
@@ -362,7 +430,9 @@ def register_admin_routes(app):
                     )
                     
                     if api_key:
-                        if api_key.is_valid:
+                        if not api_key.last_checked:
+                            flash(f'Thêm API key "{key_name}" thành công, key đang được kiểm tra trong nền', 'success')
+                        elif api_key.is_valid:
                             flash(f'Thêm API key "{key_name}" thành công và key đang hoạt động tốt', 'success')
                         else:
                             flash(f'Đã thêm API key "{key_name}" nhưng có vấn đề: {api_key.status_message}', 'warning')
@@ -383,6 +453,10 @@ def register_admin_routes(app):
                         api_key.name = key_name
                         api_key.description = description
                         db.session.commit()
+                        usage_limit = request.form.get('usage_limit', '').strip()
+                        usage_limit = int(usage_limit) if usage_limit.isdigit() and int(usage_limit) > 0 else None
+                        if usage_limit != api_key.usage_limit:
+                            api_key_manager.set_usage_limit(key_id, usage_limit)
                         flash('Cập nhật thông tin API key thành công', 'success')
                     else:
                         flash('Không thể cập nhật thông tin API key', 'error')
@@ -462,14 +536,10 @@ def register_admin_routes(app):
             
             return redirect(url_for('admin_api_settings'))
         
-        # Lấy thông tin chi tiết về API key đang hoạt động
+        # Lấy thông tin chi tiết về API key đang hoạt động (key đã cũ được kiểm tra lại trong nền)
         active_key_details = None
         if active_key:
             active_key_details = api_key_manager.get_key_details(active_key.id)
-            # Nếu không có chi tiết hoặc chưa được kiểm tra gần đây, refresh lại
-            if not active_key_details or (datetime.now() - active_key.last_checked).total_seconds() > 3600:
-                api_key_manager.refresh_api_key_status(active_key.id)
-                active_key_details = api_key_manager.get_key_details(active_key.id)
         
         return render_template('admin/api_settings.html', 
                             api_keys=api_keys,
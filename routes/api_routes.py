@@ -132,8 +132,10 @@ def register_api_routes(app):
         """API cập nhật cấu hình web"""
         data = request.get_json()
         
-        for category, configs in data.items():
-            for key, value in configs.items():
-                WebConfig.set_value(key, value, category)
+        WebConfig.set_many(
+            (key, value, category)
+            for category, configs in data.items()
+            for key, value in configs.items()
+        )
         
         return jsonify({'message': 'Cập nhật cấu hình thành công'})
\ No newline at end of file
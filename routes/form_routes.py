@@ -1,7 +1,7 @@
 from flask import render_template, request, jsonify
 from utils.document_utils import load_document, extract_all_fields, get_doc_path, set_doc_path
 from utils.field_matcher import EnhancedFieldMatcher
-from models.data_model import load_db, save_db, load_form_history, save_form_history
+from models.data_model import load_db, save_db
 import os
 import uuid
 import datetime
@@ -85,14 +85,15 @@ def register_form_routes(app):
             normalized_field = matcher._normalize_field_name(field_name)
             if normalized_field in matcher.field_index:
                 for record_idx, matched_field in matcher.field_index[normalized_field][:5]:  # Giới hạn 5 bản ghi gần nhất
-                    if record_idx < len(matcher.form_history):
-                        form_data = matcher.form_history[record_idx].get('form_data', {})
+                    record = matcher.history_record(record_idx)
+                    if record is not None:
+                        form_data = record.get('form_data', {})
                         value = form_data.get(matched_field)
                         if value and value not in seen_values:
                             history.append({
                                 'value': value,
-                                'timestamp': matcher.form_history[record_idx].get('timestamp', ''),
-                                'form_id': matcher.form_history[record_idx].get('form_id', '')
+                                'timestamp': record.get('timestamp', ''),
+                                'form_id': record.get('form_id', '')
                             })
                             seen_values.add(value)
 
@@ -155,11 +156,7 @@ def register_form_routes(app):
             # Lưu vào form history
             try:
                 from flask_login import current_user
-                form_history = load_form_history()
-                
-                # Đảm bảo form_history là một list
-                if form_history is None or not isinstance(form_history, list):
-                    form_history = []
+                from models.data_model import update_form_history
                 
                 # Thêm tên tài liệu vào form_entry nếu có
                 document_name = form_data.get('document_name', '')
@@ -176,8 +173,8 @@ def register_form_routes(app):
                     "user_name": current_user.fullname if current_user.is_authenticated else None
                 }
                 
-                form_history.append(form_entry)
-                save_form_history(form_history)
+                # Nối vào bản mới nhất trên đĩa, không ghi đè bản ghi của worker khác
+                update_form_history(lambda form_history: form_history.append(form_entry))
                 print(f"Form history saved successfully: {form_id}")
             except Exception as e:
                 print(f"Error saving form history: {str(e)}")
@@ -226,22 +223,13 @@ def register_form_routes(app):
     @app.route('/form/<form_id>')
     def view_form(form_id):
         try:
-            form_history = load_form_history()
+            from models.form_history_store import get_form_history_store
             clean_form_id = form_id.replace('_test', '').split('_')[0]
-            print("clean_form_id",clean_form_id)
-            # Tìm form theo form_id
-            form_data = None
-            form_path = None
             
-            for form in form_history:
-                file_name = os.path.basename(form['path'])
-                file_id = file_name.split('_')[0]
-                print("file_id",file_id)
-                if file_id == clean_form_id:
-                    form_data = form.get('form_data')
-                    form_path = form['path']
-                    break
-
+            # Tra theo form_id hoặc mã file upload qua chỉ mục của store
+            form = get_form_history_store().find(clean_form_id)
+            form_data = form.get('form_data') if form else None
+            form_path = form.get('path') if form else None
             
             if not form_data or not form_path:
                 return jsonify({'error': 'Không tìm thấy biểu mẫu'}), 404
@@ -275,28 +263,14 @@ def register_form_routes(app):
     @app.route('/delete-form/<form_id>', methods=['DELETE'])
     def delete_form(form_id):
         try:
-            # Load form history
-            form_history = load_form_history()
+            from models.form_history_store import get_form_history_store
+            store = get_form_history_store()
             
-            # Find the form with the matching ID
-            form_index = None
-            for i, form in enumerate(form_history):
-                # Lấy ID từ đường dẫn file
-                file_name = os.path.basename(form['path'])
-                file_id = file_name.split('_')[0] if '_' in file_name else file_name.split('.')[0]
-                
-                # So sánh với form_id được truyền vào
-                if file_id == form_id or file_name.startswith(form_id):
-                    form_index = i
-                    break
-            
-            if form_index is None:
+            # Tra theo form_id hoặc mã file upload qua chỉ mục của store
+            deleted_form = store.find(form_id)
+            if deleted_form is None or not store.delete(deleted_form):
                 return jsonify({'error': 'Form not found'}), 404
             
-            # Xóa form khỏi lịch sử
-            deleted_form = form_history.pop(form_index)
-            save_form_history(form_history)
-            
             # Xóa file nếu cần
             try:
                 if os.path.exists(deleted_form['path']) and os.path.isfile(deleted_form['path']):
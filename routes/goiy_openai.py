@@ -1,4 +1,4 @@
-from flask import request, jsonify, session
+from flask import request, jsonify, session, Response, stream_with_context
 from typing import Dict, Any, Optional
 from utils.ai_matcher import AIFieldMatcher
 import json
@@ -8,6 +8,18 @@ from flask_login import current_user
 from utils.document_utils import get_doc_path, load_document, extract_all_fields, extract_fields
 logger = logging.getLogger(__name__)
 
+def _sse_event(event: str, payload: Dict[str, Any]) -> str:
+    """Định dạng một sự kiện Server-Sent Events"""
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+def _sse_response(events) -> Response:
+    """Trả về response SSE, tắt buffer của proxy để token đến client ngay"""
+    return Response(
+        stream_with_context(events),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 def GOI_Y_AI(app):
     """
     Đăng ký các route cho tính năng gợi ý AI nâng cao
@@ -179,6 +191,52 @@ def GOI_Y_AI(app):
             form_context = ""
             field_name = field_code  # Default to field_code
             
+            if data.get("stream"):
+                form_text = None
+                if doc_path:
+                    try:
+                        form_text = load_document(doc_path)
+                        form_context = ai_matcher.get_cached_context(form_text)
+                    except Exception as e:
+                        logger.warning(f"Failed to load document context: {str(e)}")
+
+                def generate():
+                    nonlocal form_context
+                    if form_text is not None and form_context is None:
+                        # Lượt viết lại đầu tiên của biểu mẫu: phân tích ngữ cảnh như chế
+                        # độ thường (kết quả được cache cho các lượt sau); dòng chú thích
+                        # SSE gửi header cho client ngay trong lúc chờ
+                        yield ": analyzing form context\n\n"
+                        try:
+                            form_context = ai_matcher.extract_context_from_form_text(form_text)
+                        except Exception as e:
+                            logger.warning(f"Failed to extract form context: {str(e)}")
+                    error = None
+                    for event, value in ai_matcher.rewrite_user_input_stream(
+                        field_name=field_name,
+                        user_input=user_input,
+                        context=form_context or "",
+                        form_type=data.get("form_type")
+                    ):
+                        if event == 'token':
+                            yield _sse_event('token', {"text": value})
+                        elif event == 'error':
+                            error = value
+                            yield _sse_event('error', {"error": value})
+                        else:
+                            done = {
+                                "original": user_input,
+                                "improved": value,
+                                "field_code": field_code,
+                                "field_name": field_name
+                            }
+                            # Client chỉ đọc sự kiện done: mang lỗi theo để không báo thành công
+                            if error:
+                                done["error"] = error
+                            yield _sse_event('done', done)
+
+                return _sse_response(generate())
+
             if doc_path:
                 try:
                     text = load_document(doc_path)
@@ -218,16 +276,31 @@ def GOI_Y_AI(app):
             text = load_document(doc_path)
             fields = extract_all_fields(doc_path)
             
+            data = request.get_json(silent=True) or {}
+            if data.get("stream"):
+                def generate():
+                    for event, value in ai_matcher.extract_context_stream(text):
+                        if event == 'token':
+                            yield _sse_event('token', {"text": value})
+                        elif event == 'error':
+                            yield _sse_event('error', {"error": value})
+                        else:
+                            yield _sse_event('done', {"form_context": value, "field_count": len(fields)})
+
+                return _sse_response(generate())
+
             # Extract context from form text
             form_context = ai_matcher.extract_context_from_form_text(text)
             
-            # Lấy thông tin phân tích ngữ cảnh biểu mẫu
-            form_analysis = ai_matcher.form_context_analysis.get(hash(text), {})
+            # Lấy thông tin phân tích ngữ cảnh biểu mẫu (cùng lượt gọi với form_context)
+            form_analysis = ai_matcher.get_form_analysis(text)
+            field_importance = form_analysis.get("field_importance") or {}
             
             return jsonify({
                 "form_context": form_context,
                 "form_type": form_analysis.get("form_type", ""),
-                "important_fields": form_analysis.get("important_fields", []),
+                "sections": form_analysis.get("sections", []),
+                "important_fields": [name for name, level in field_importance.items() if str(level).lower() == "cao"],
                 "field_relationships": form_analysis.get("field_relationships", {}),
                 "user_characteristics": form_analysis.get("user_characteristics", ""),
                 "field_count": len(fields)
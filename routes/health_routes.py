@@ -0,0 +1,23 @@
+from flask import jsonify
+import os
+
+def register_health_routes(app):
+    """
+    Đăng ký các route kiểm tra sức khỏe cho load balancer
+    """
+    @app.route('/healthz')
+    def healthz():
+        """
+        Liveness: tiến trình còn sống và trả lời được request
+        """
+        return jsonify({'status': 'ok', 'pid': os.getpid()})
+
+    @app.route('/readyz')
+    def readyz():
+        """
+        Readiness: chỉ trả 200 khi warm-up của worker này đã xong (mô hình đã nóng)
+        """
+        from utils.warmup import start_warmup, warmup_status
+        start_warmup(app)
+        status = warmup_status()
+        return jsonify(status), 200 if status['ready'] else 503
@@ -2,6 +2,29 @@ from flask import render_template, request, jsonify
 from utils.document_utils import upload_document
 from flask import redirect, url_for
 from flask_login import current_user
+import base64
+import json
+
+
+def _encode_cursor(key):
+    """Con trỏ phân trang: khóa (timestamp, form_id, vị trí) của biểu mẫu cuối trang"""
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode('utf-8')).decode('ascii')
+
+
+def _decode_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        if len(key) == 2:
+            # Con trỏ cũ không có vị trí
+            return str(key[0]), str(key[1])
+        timestamp, form_id, position = key
+        return str(timestamp), str(form_id), int(position)
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
 def register_home_routes(app):
     """
     Đăng ký các route cho trang chủ và tải lên tài liệu
@@ -29,58 +52,79 @@ def register_home_routes(app):
     
     @app.route('/get-recent-forms')
     def get_recent_forms():
-        from models.data_model import load_form_history
+        """
+        Biểu mẫu gần đây, mới nhất trước, phân trang bằng con trỏ.
+
+        Query params:
+            query: tìm theo tên tài liệu, tên và giá trị trường (không phân biệt dấu)
+            status: all | filled | unfilled
+            limit: số biểu mẫu mỗi trang (tối đa 100)
+            cursor: next_cursor của trang trước
+            include: 'form_data' để trả kèm toàn bộ dữ liệu đã điền
+        """
+        from models.form_history_store import get_form_history_store, ANY_USER
         import datetime
         import os
         from flask_login import current_user
         
         try:
-            form_history = load_form_history()
-            # Đảm bảo form_history là một list
-            if form_history is None or not isinstance(form_history, list):
-                form_history = []
-            query = request.args.get('query', '')
+            query = request.args.get('query', '').strip()
+            status = request.args.get('status', 'all')
+            limit = min(100, max(1, request.args.get('limit', 20, type=int)))
+            include = set(filter(None, request.args.get('include', '').split(',')))
+            try:
+                cursor = _decode_cursor(request.args.get('cursor'))
+            except ValueError:
+                return jsonify({'error': 'Invalid cursor'}), 400
+
+            # Người dùng đăng nhập: biểu mẫu của họ và biểu mẫu cũ không có user_id
+            user_ids = [current_user.id, None] if current_user.is_authenticated else ANY_USER
+            
+            store = get_form_history_store()
+            matching = store.matching_keys(query) if query else None
             
-            # Format the forms for display
             formatted_forms = []
-            for form in form_history:
-                # Chỉ hiển thị biểu mẫu của người dùng hiện tại
-                # Nếu form không có user_id hoặc user_id khác với current_user.id thì bỏ qua
-                if current_user.is_authenticated:
-                    # Kiểm tra nếu form có user_id và khác với current_user.id thì bỏ qua
-                    if 'user_id' in form and form['user_id'] is not None and form['user_id'] != current_user.id:
-                        continue
-                    # Nếu không có user_id, vẫn hiển thị (có thể là biểu mẫu cũ)
-                
-                # Format the date for display
+            next_cursor = None
+            last_key = None
+            for key, form in store.scan(user_ids, before=cursor):
+                if matching is not None and key not in matching:
+                    continue
+                form_name = form.get('name', os.path.basename(form['path']))
+
+                form_data = form.get('form_data')
+                filled_fields = sum(
+                    1 for value in (form_data or {}).values() if isinstance(value, str) and value.strip()
+                )
+                if status == 'filled' and not filled_fields:
+                    continue
+                if status == 'unfilled' and filled_fields:
+                    continue
+
+                if len(formatted_forms) == limit:
+                    next_cursor = _encode_cursor(last_key)
+                    break
+
                 timestamp = datetime.datetime.fromisoformat(form['timestamp'])
-                formatted_date = timestamp.strftime('%d/%m/%Y %H:%M')
-                
-                # Create a formatted form object
                 formatted_form = {
                     'id': os.path.basename(form['path']).split('.')[0],
-                    'name': form.get('name', os.path.basename(form['path'])),
-                    'date': formatted_date,
-                    'path': form['path']
+                    'name': form_name,
+                    'date': timestamp.strftime('%d/%m/%Y %H:%M'),
+                    'timestamp': form['timestamp'],
+                    'path': form['path'],
+                    'has_form_data': form_data is not None,
+                    'form_type': (form_data or {}).get('form_type'),
+                    'filled_fields': filled_fields,
+                    'total_fields': len(form_data or {}),
                 }
-                
-                # Add form data if available
-                if 'form_data' in form:
-                    formatted_form['form_data'] = form['form_data']
-                
-                # Add user info if available
-                if 'user_name' in form and form['user_name']:
+                if 'form_data' in include and form_data is not None:
+                    formatted_form['form_data'] = form_data
+                if form.get('user_name'):
                     formatted_form['user_name'] = form['user_name']
-                
-                # Filter by search query if provided
-                form_name = form.get('name', os.path.basename(form['path']))
-                if not query or query.lower() in form_name.lower():
-                    formatted_forms.append(formatted_form)
-            
-            # Sort by date (newest first)
-            formatted_forms.sort(key=lambda x: x['date'], reverse=True)
+
+                formatted_forms.append(formatted_form)
+                last_key = key
             
-            return jsonify({'forms': formatted_forms})
+            return jsonify({'forms': formatted_forms, 'next_cursor': next_cursor})
         except Exception as e:
             print(f"Error loading recent forms: {str(e)}")
             return jsonify({'error': 'Failed to load recent forms'}), 500
\ No newline at end of file
@@ -131,6 +131,75 @@ const AISuggestions = {
         form.insertBefore(buttonContainer, form.firstChild);
     },
     
+    /**
+     * Viết lại nội dung trường bằng AI ở chế độ stream (Server-Sent Events)
+     * @param {Object} payload - Dữ liệu gửi lên /AI_REWRITE (field_code, user_input, form_type)
+     * @param {Function} onToken - Gọi với toàn bộ văn bản đã nhận mỗi khi có token mới
+     * @returns {Promise} - Promise chứa kết quả cuối cùng (original, improved, field_name...)
+     */
+    rewriteStream: async function(payload, onToken) {
+        const response = await fetch('/AI_REWRITE', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'Accept': 'text/event-stream'
+            },
+            body: JSON.stringify(Object.assign({}, payload, { stream: true }))
+        });
+
+        if (!response.ok) {
+            const error = await response.json().catch(() => ({}));
+            throw new Error(error.error || `Lỗi HTTP: ${response.status}`);
+        }
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder('utf-8');
+        let buffer = '';
+        let partial = '';
+        let result = null;
+        let streamError = null;
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+
+            // Mỗi sự kiện SSE kết thúc bằng một dòng trống
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const rawEvent = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+
+                let eventName = 'message';
+                let data = '';
+                rawEvent.split('\n').forEach(line => {
+                    if (line.startsWith('event:')) eventName = line.slice(6).trim();
+                    else if (line.startsWith('data:')) data += line.slice(5).trim();
+                });
+                if (!data) continue;
+
+                const parsed = JSON.parse(data);
+                if (eventName === 'token') {
+                    partial += parsed.text;
+                    if (onToken) onToken(partial);
+                } else if (eventName === 'error') {
+                    console.warn('Lỗi khi stream nội dung AI:', parsed.error);
+                    streamError = parsed.error;
+                } else if (eventName === 'done') {
+                    result = parsed;
+                }
+            }
+        }
+
+        if (!result) {
+            throw new Error(streamError || 'Kết nối bị ngắt trước khi nhận đủ nội dung');
+        }
+        if (streamError && !result.error) {
+            result.error = streamError;
+        }
+        return result;
+    },
+
     /**
      * Hiển thị thông báo
      * @param {string} message - Nội dung thông báo
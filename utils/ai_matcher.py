@@ -1,17 +1,21 @@
 # utils/ai_matcher.py
 from openai import OpenAI
-from config.config import FORM_HISTORY_PATH
+from config.config import (
+    FORM_HISTORY_PATH, STRUCTURE_PROMPT_TOKEN_BUDGET, FORM_ANALYSIS_FAILURE_TTL, GEMINI_REWRITE_MODEL
+)
 from utils.api_key_manager import get_api_key_manager
 from collections import defaultdict, Counter
 import re
 import json
 import logging
-import datetime
 from typing import Dict, List, Optional, Any
 from .field_matcher import EnhancedFieldMatcher
+from utils.field_ontology import get_field_ontology
 import hashlib
-from sentence_transformers import SentenceTransformer
-import numpy as np
+import time
+from utils.local_llm import get_local_backend, LocalRoutingPolicy
+from utils.prompt_builder import compress_form_text
+from utils.semantic_cache import get_rewrite_cache
 
 logger = logging.getLogger(__name__)
 
@@ -22,11 +26,16 @@ class AIFieldMatcher:
         self.suggestion_cache = {}
         self._client = None
         self._current_provider = None  # Thêm thuộc tính này
+        self._current_key_id = None
         self.form_context_analysis = {}
+        # khóa biểu mẫu -> thời điểm (monotonic) được thử phân tích lại sau lỗi
+        self.form_analysis_failures = {}
         self.field_relationships = defaultdict(list)
         self.field_name_mapping = {}
         self.similar_fields_cache = {}
-        self.sbert_model = SentenceTransformer('all-MiniLM-L6-v2')
+        self.local_backend = get_local_backend()
+        self.local_router = LocalRoutingPolicy(self.local_backend)
+        self.rewrite_cache = get_rewrite_cache()
         self._initialize()
 
     def _initialize(self):
@@ -37,35 +46,53 @@ class AIFieldMatcher:
     @property
     def client(self):
         if self._client is None:
-            api_key_manager = get_api_key_manager()
-            
-            # Ưu tiên sử dụng OpenAI nếu có
-            preferred_provider = 'openai'
-            
-            # Kiểm tra provider nào khả dụng
-            available_provider = api_key_manager.get_available_provider(preferred_provider)
-            
-            if available_provider:
-                self._client = api_key_manager.get_client(available_provider)
-                self._current_provider = available_provider
-                logger.info(f"Using {available_provider} client for suggestions")
-            else:
-                # Kiểm tra cụ thể Gemini nếu OpenAI không khả dụng
-                available_provider = api_key_manager.get_available_provider('gemini')
-                if available_provider:
-                    self._client = api_key_manager.get_client(available_provider)
-                    self._current_provider = available_provider
-                    logger.info(f"Using {available_provider} client for suggestions (fallback)")
-                else:
-                    # More detailed error message
-                    openai_status = "available" if api_key_manager._get_active_api_key('openai') else "unavailable"
-                    gemini_status = "available" if api_key_manager._get_active_api_key('gemini') else "unavailable"
-                    raise RuntimeError(
-                        f"No available AI provider. Status - OpenAI: {openai_status}, Gemini: {gemini_status}. "
-                        "Please check API key configuration."
-                    )
-                    
+            self._select_provider()
         return self._client
+
+    def _select_provider(self, preferred_provider: str = 'openai', exclude=()):
+        """
+        Chọn provider và API key khỏe nhất cho lượt gọi sắp tới.
+
+        Việc chọn diễn ra trước mỗi lượt gọi nên key/provider đang lỗi (circuit
+        mở) bị bỏ qua ngay, không cần chờ request thất bại rồi mới chuyển.
+        """
+        api_key_manager = get_api_key_manager()
+        provider, key_id, client = api_key_manager.acquire_client(preferred_provider, exclude=exclude)
+        if provider is not None:
+            self._client = client
+            self._current_provider = provider
+            self._current_key_id = key_id
+        elif self.local_backend.available:
+            # Không có key nào khả dụng: dùng mô hình cục bộ
+            self._client = self.local_backend
+            self._current_provider = 'local'
+            self._current_key_id = None
+            logger.info("Using local model for suggestions (no healthy provider available)")
+        else:
+            self._client = None
+            self._current_provider = None
+            self._current_key_id = None
+            raise RuntimeError(
+                "No available AI provider (no active key or all circuits open). "
+                "Please check API key configuration."
+            )
+
+    def _report_call(self, started: Optional[float], error: Optional[Exception] = None, aborted: bool = False):
+        """Báo kết quả lượt gọi provider hiện tại cho bộ định tuyến theo sức khỏe"""
+        if started is None or self._current_provider in (None, 'local'):
+            return
+        api_key_manager = get_api_key_manager()
+        if aborted:
+            api_key_manager.release_key(self._current_provider, self._current_key_id)
+            return
+        api_key_manager.report_result(
+            self._current_provider,
+            self._current_key_id,
+            error is None,
+            time.perf_counter() - started,
+            str(error) if error is not None else None
+        )
+
     def _build_openai_context_prompt(self, form_text: str, key_fields: str) -> str:
         """Build context extraction prompt for OpenAI"""
         prompt = f"""Phân tích ngữ cảnh của biểu mẫu sau và xác định:
@@ -75,7 +102,7 @@ class AIFieldMatcher:
 4. Ngữ cảnh tổng thể của biểu mẫu
 
 Nội dung biểu mẫu:
-{form_text[:3000]}
+{compress_form_text(form_text)}
 
 Các trường đã xác định:
 {key_fields}
@@ -138,7 +165,7 @@ Hãy tóm tắt ngữ cảnh trong 3-5 câu, tập trung vào mục đích và c
     4. Ngữ cảnh tổng thể và mục đích sử dụng biểu mẫu
 
     Biểu mẫu:
-    {form_text[:3000]}
+    {compress_form_text(form_text)}
 
     Các trường dữ liệu đã được phát hiện:
     {key_fields}
@@ -147,102 +174,72 @@ Hãy tóm tắt ngữ cảnh trong 3-5 câu, tập trung vào mục đích và c
     """
         return prompt
 
-    def extract_context_from_form_text(self, form_text: str) -> str:
-        """Extract context from form text with provider fallback"""
-        cache_key = self._generate_cache_key(form_text)
-        if cache_key in self.context_cache:
-            return self.context_cache[cache_key]
-
-        # Ensure client is initialized
-        if self._client is None:
-            _ = self.client  # This will initialize the provider
+    def _build_local_context_prompt(self, form_text: str, key_fields: str) -> str:
+        """Build short context prompt for the local model"""
+        return (
+            "Tóm tắt mục đích và cấu trúc của biểu mẫu sau trong 2-3 câu.\n"
+            f"Biểu mẫu: {compress_form_text(form_text, 400)}\n"
+            f"Các trường: {key_fields}"
+        )
 
-        key_fields = self._extract_key_fields(form_text)
+    def _build_local_rewrite_prompt(
+    self,
+    field_name: str,
+    similar_fields: List[str],
+    user_input: str,
+    context: Optional[str],
+    is_selected_value: bool = False,
+    form_type: Optional[str] = None
+) -> str:
+        """Build short rewrite prompt for the local model"""
+        prompt = f"Viết lại ngắn gọn, đúng chính tả tiếng Việt cho trường '{field_name}': {user_input}"
+        if form_type:
+            prompt += f" (biểu mẫu: {form_type})"
+        return prompt
 
+    def _generate_locally(self, prompt: str, max_tokens: int, temperature: float = 0.3) -> str:
+        """Sinh văn bản bằng mô hình cục bộ, trả về chuỗi rỗng nếu lỗi"""
         try:
-            if self._current_provider == 'openai':
-                prompt = self._build_openai_context_prompt(form_text, key_fields)
-                model_name = "gpt-4-1106-preview"
-
-                response = self.client.chat.completions.create(
-                    model=model_name,
-                    messages=[
-                        {"role": "system", "content": "Bạn là trợ lý phân tích biểu mẫu."},
-                        {"role": "user", "content": prompt}
-                    ],
-                    temperature=0.6,
-                    max_tokens=300
-                )
-                context = response.choices[0].message.content.strip()
-
-            elif self._current_provider == 'gemini':
-                prompt = self._build_gemini_context_prompt(form_text, key_fields)
-
-                # Tạo lại model Gemini nếu chưa có
-                from google.generativeai import GenerativeModel
-
-                if not isinstance(self.client, GenerativeModel):
-                    self._client = GenerativeModel("gemini-2.0-flash")
-
-                response = self.client.generate_content(
-                    contents=[{"role": "user", "parts": [{"text": prompt}]}],
-                    generation_config={
-                        "temperature": 0.6,
-                        "max_output_tokens": 300,
-                    }
-                )
-                context = response.candidates[0].content.parts[0].text.strip()
+            return self.local_backend.generate(prompt, max_new_tokens=max_tokens, temperature=temperature)
+        except Exception as e:
+            logger.error(f"Local model generation failed: {e}")
+            return ""
 
-            else:
-                raise ValueError(f"Unknown provider: {self._current_provider}")
+    def _build_form_analysis_prompt(self, form_text: str, key_fields: str) -> str:
+        """Build a single prompt returning both the context summary and the form structure"""
+        return f"""Phân tích biểu mẫu sau và phản hồi bằng JSON.
 
-            self.context_cache[cache_key] = context
-            self._enhance_context_analysis(form_text, context)
-            return context
+Nội dung biểu mẫu:
+{compress_form_text(form_text, STRUCTURE_PROMPT_TOKEN_BUDGET)}
 
-        except Exception as e:
-            logger.error(f"Error extracting context with {self._current_provider}: {str(e)}")
-            # Attempt provider fallback
-            if self._current_provider == 'openai':
-                try:
-                    self._client = None  # Reset client to force reinitialization
-                    _ = self.client  # Reinitialize
-                    if self._current_provider == 'gemini':
-                        return self.extract_context_from_form_text(form_text)
-                except Exception as e2:
-                    logger.error(f"Fallback to Gemini failed: {str(e2)}")
-            return ""
+Các trường đã xác định:
+{key_fields}
 
+Yêu cầu phản hồi JSON với định dạng:
+{{
+"summary": "Tóm tắt ngữ cảnh trong 3-5 câu, tập trung vào mục đích và cấu trúc của biểu mẫu.",
+"form_type": "Đơn xin việc",
+"sections": ["Thông tin cá nhân", "Kinh nghiệm làm việc", "Học vấn"],
+"field_relationships": "‘Vị trí’ nằm trong phần Kinh nghiệm, liên quan đến công ty và thời gian làm việc.",
+"field_importance": {{
+    "Họ tên": "Cao",
+    "Vị trí": "Cao",
+    "Công ty": "Trung bình",
+    "Thời gian": "Trung bình"
+}},
+"field_extraction": {{
+    "Công ty": "Công ty một thành viên Hữu Phước",
+    "Vị trí": "Văn phòng",
+    "Địa điểm": "Thương mại",
+    "Thời gian bắt đầu": "27/09/2003"
+}}
+}}
+
+Phản hồi JSON này phải đầy đủ và đúng định dạng.
+"""
 
-    def _enhance_context_analysis(self, form_text: str, context: str,tried_fallback: bool = False) -> Dict:
-        """Phân tích ngữ cảnh nâng cao với kiểm tra provider hiện tại"""
-        context_lower = context.lower()
-        today = datetime.datetime.now()
-        
-        # Cải tiến phát hiện trường ngày tháng năm trong ngữ cảnh
-        date_patterns = {
-            "ngày": {"value": today.strftime("%d"), "format": "DD"},
-            "tháng": {"value": today.strftime("%m"), "format": "MM"},
-            "năm": {"value": today.strftime("%Y"), "format": "YYYY"},
-            "date": {"value": today.strftime("%d/%m/%Y"), "format": "DD/MM/YYYY"},
-            "day": {"value": today.strftime("%d"), "format": "DD"},
-            "month": {"value": today.strftime("%m"), "format": "MM"},
-            "year": {"value": today.strftime("%Y"), "format": "YYYY"},
-            "thời gian": {"value": today.strftime("%H:%M"), "format": "HH:MM"},
-            "time": {"value": today.strftime("%H:%M"), "format": "HH:MM"}
-        }
-        
-        # Kiểm tra từng mẫu ngày tháng trong ngữ cảnh
-        for pattern, data in date_patterns.items():
-            if pattern in context_lower and "sinh" not in context_lower and "birth" not in context_lower:
-                return {
-                    "contains_date_fields": True,
-                    "suggested_value": data["value"],
-                    "suggested_format": data["format"],
-                    "date_type": pattern
-                }
-        
-        # Thêm phân tích ngữ nghĩa biểu mẫu để xác định loại biểu mẫu chính xác hơn
+    def _detect_form_type_keyword(self, text: str) -> Optional[str]:
+        """Phát hiện loại biểu mẫu theo từ khóa"""
         form_keywords = {
             "đơn xin việc": "job_application",
             "sơ yếu lý lịch": "resume",
@@ -255,100 +252,125 @@ Hãy tóm tắt ngữ cảnh trong 3-5 câu, tập trung vào mục đích và c
             "khai báo": "declaration",
             "giấy phép": "license"
         }
-        
-        form_type = None
+        text_lower = text.lower()
         for keyword, form_code in form_keywords.items():
-            if keyword in context_lower or keyword in form_text.lower():
-                form_type = form_code
-                break
-        
-        cache_key = hashlib.sha256(form_text.encode()).hexdigest()
+            if keyword in text_lower:
+                return form_code
+        return None
+
+    def extract_context_from_form_text(self, form_text: str) -> str:
+        """Extract context from form text with provider fallback"""
+        cache_key = self._generate_cache_key(form_text)
         if cache_key in self.context_cache:
-            cached_analysis = self.context_cache[cache_key]
-            if form_type and 'form_type' not in cached_analysis:
-                cached_analysis['form_type'] = form_type
-            return cached_analysis
-        
-        # Sử dụng embedding để phân tích ngữ cảnh
-        embeddings = self.sbert_model.encode([form_text, context])
-        form_embedding, context_embedding = embeddings[0], embeddings[1]
-        
-        structure_prompt = f"""Phân tích cấu trúc form sau và phản hồi bằng JSON:
-    {form_text[:2000]}
-
-    Yêu cầu phản hồi JSON với định dạng:
-    {{
-    "form_type": "Đơn xin việc",
-    "sections": ["Thông tin cá nhân", "Kinh nghiệm làm việc", "Học vấn"],
-    "field_relationships": "‘Vị trí’ nằm trong phần Kinh nghiệm, liên quan đến công ty và thời gian làm việc.",
-    "field_importance": {{
-        "Họ tên": "Cao",
-        "Vị trí": "Cao",
-        "Công ty": "Trung bình",
-        "Thời gian": "Trung bình"
-    }},
-    "field_extraction": {{
-        "Công ty": "Công ty một thành viên Hữu Phước",
-        "Vị trí": "Văn phòng",
-        "Địa điểm": "Thương mại",
-        "Thời gian bắt đầu": "27/09/2003"
-    }}
-    }}
-
-    Phản hồi JSON này phải đầy đủ và đúng định dạng.
-    """
+            return self.context_cache[cache_key]
+
+        context = self.get_form_analysis(form_text).get("summary", "")
+        if context:
+            self.context_cache[cache_key] = context
+        return context
+
+    def get_form_analysis(self, form_text: str, tried_fallback: bool = False) -> Dict:
+        """
+        Phân tích biểu mẫu bằng một lượt gọi LLM duy nhất.
+
+        Returns:
+            dict gồm summary, form_type, sections, field_relationships,
+            field_importance, field_extraction và provider; {} nếu lỗi (kết quả
+            lỗi được nhớ trong FORM_ANALYSIS_FAILURE_TTL giây để không gọi lại
+            provider đang lỗi cho cùng biểu mẫu ở mỗi request)
+        """
+        cache_key = self._generate_cache_key(form_text)
+        if cache_key in self.form_context_analysis:
+            return self.form_context_analysis[cache_key]
+        retry_at = self.form_analysis_failures.get(cache_key)
+        if retry_at is not None and not tried_fallback:
+            if time.monotonic() < retry_at:
+                return {}
+            self.form_analysis_failures.pop(cache_key, None)
+
+        key_fields = self._extract_key_fields(form_text)
+        keyword_form_type = self._detect_form_type_keyword(form_text)
 
+        # Biểu mẫu ngắn: thử mô hình cục bộ trước
+        if self.local_router.prefer_local('context', form_text):
+            summary = self._generate_locally(self._build_local_context_prompt(form_text, key_fields), 300)
+            if summary:
+                analysis = {"summary": summary, "form_type": keyword_form_type, "provider": "local"}
+                self.form_context_analysis[cache_key] = analysis
+                return analysis
+
+        started = None
         try:
-            if self._current_provider == 'openai':
+            if not tried_fallback:
+                self._select_provider()
+            started = time.perf_counter()
+
+            if self._current_provider == 'local':
+                # Mô hình cục bộ không sinh JSON cấu trúc ổn định: chỉ tóm tắt
+                analysis = {
+                    "summary": self._client.generate(
+                        self._build_local_context_prompt(form_text, key_fields),
+                        max_new_tokens=300,
+                        temperature=0.6
+                    )
+                }
+
+            elif self._current_provider == 'openai':
                 response = self.client.chat.completions.create(
                     model="gpt-4-1106-preview",
                     messages=[
                         {"role": "system", "content": "Bạn là chuyên gia phân tích biểu mẫu."},
-                        {"role": "user", "content": structure_prompt}
+                        {"role": "user", "content": self._build_form_analysis_prompt(form_text, key_fields)}
                     ],
                     temperature=0.3,
+                    max_tokens=900,
                     response_format={"type": "json_object"}
                 )
                 analysis = json.loads(response.choices[0].message.content)
-            elif self._current_provider == 'gemini':
-                from google.generativeai import GenerativeModel
 
-                if not isinstance(self.client, GenerativeModel):
-                    self._client = GenerativeModel("gemini-2.0-flash")
+            elif self._current_provider == 'gemini':
                 response = self.client.generate_content(
-                    contents=[{"parts": [{"text": structure_prompt}]}],
-                    generation_config={"temperature": 0.3, "max_output_tokens": 512}
+                    contents=[{"role": "user", "parts": [{"text": self._build_form_analysis_prompt(form_text, key_fields)}]}],
+                    generation_config={
+                        "temperature": 0.3,
+                        "max_output_tokens": 900,
+                        "response_mime_type": "application/json",
+                    }
                 )
-                raw_text = response.candidates[0].content.parts[0].text
-                analysis = json.loads(raw_text)
+                analysis = json.loads(response.candidates[0].content.parts[0].text)
 
             else:
                 raise ValueError(f"Unknown provider: {self._current_provider}")
+            self._report_call(started)
+
+            if not isinstance(analysis, dict):
+                raise ValueError("Phản hồi phân tích biểu mẫu không phải JSON object")
+            analysis["summary"] = str(analysis.get("summary") or "").strip()
+            if not analysis.get("form_type") and keyword_form_type:
+                analysis["form_type"] = keyword_form_type
+            analysis["provider"] = self._current_provider
 
-            analysis.update({
-                "form_embedding": form_embedding.tolist(),
-                "context_embedding": context_embedding.tolist(),
-                "provider": self._current_provider
-            })
-            self.context_cache[cache_key] = analysis
+            self.form_context_analysis[cache_key] = analysis
             return analysis
 
         except Exception as e:
             logger.error(f"Lỗi phân tích ngữ cảnh với {self._current_provider}: {e}")
+            self._report_call(started, e)
 
-            if not tried_fallback and self._current_provider == 'openai':
+            # Thử lại một lần với key/provider khác key vừa lỗi
+            if not tried_fallback and started is not None and self._current_provider != 'local':
                 try:
-                    api_key_manager = get_api_key_manager()
-                    fallback_provider = api_key_manager.get_available_provider('gemini')
-                    if fallback_provider:
-                        self._current_provider = fallback_provider
-                        self._client = api_key_manager.get_client(fallback_provider)
-                        return self._enhance_context_analysis(form_text, context, tried_fallback=True)
+                    self._select_provider(exclude={(self._current_provider, self._current_key_id)})
+                    return self.get_form_analysis(form_text, tried_fallback=True)
                 except Exception as e2:
-                    logger.error(f"Failed to switch to Gemini: {e2}")
+                    logger.error(f"Failed to switch provider: {e2}")
 
+            self.form_analysis_failures[cache_key] = time.monotonic() + FORM_ANALYSIS_FAILURE_TTL
             return {}
 
+    def update_field_value(self, field_name: str, field_value: str, user_id: Optional[int] = None) -> None:
+        """Lưu phản hồi: người dùng đã chọn field_value cho field_name"""
+        self.field_matcher.record_feedback(field_name, field_value, user_id=user_id)
 
     def _extract_key_fields(self, form_text: str) -> str:
         """Extract key fields using field matcher"""
@@ -418,59 +440,27 @@ Hãy tóm tắt ngữ cảnh trong 3-5 câu, tập trung vào mục đích và c
         return "\n".join(prompt)
     def _analyze_personal_info(self, field_name: str, historical_values: List[str]) -> Dict[str, Any]:
             """Phân tích và nhận diện thông tin cá nhân nâng cao"""
-            name_lower = field_name.lower()
-            
-            # Danh sách các trường thông tin cá nhân phổ biến
-            personal_fields = {
-                "họ tên": ["họ và tên", "họ tên", "tên", "name", "full name"],
-                "địa chỉ": ["địa chỉ", "address", "nơi ở", "chỗ ở", "địa chỉ thường trú", "địa chỉ tạm trú"],
-                "email": ["email", "thư điện tử", "mail", "e-mail", "địa chỉ email"],
-                "số điện thoại": ["điện thoại", "phone", "số điện thoại", "di động", "mobile", "tel", "số di động"],
-                "cmnd": ["cmnd", "cccd", "căn cước", "chứng minh", "id card", "identity", "số cmnd", "số căn cước"],
-                "ngày sinh": ["ngày sinh", "sinh ngày", "birthday", "date of birth", "dob", "ngày tháng năm sinh"],
-                "giới tính": ["giới tính", "gender", "sex", "nam/nữ", "nam nữ"],
-                "quốc tịch": ["quốc tịch", "nationality", "quốc gia", "công dân"],
-                "nghề nghiệp": ["nghề nghiệp", "nghề", "công việc", "occupation", "job", "profession", "chức vụ", "vị trí"],
-                "học vấn": ["học vấn", "trình độ", "bằng cấp", "education", "degree", "trình độ học vấn"],
-                "tôn giáo": ["tôn giáo", "religion", "đạo"],
-                "dân tộc": ["dân tộc", "ethnicity", "ethnic"],
-                "mã số thuế": ["mã số thuế", "tax", "tax code", "tax id", "mst"],
-                "số tài khoản": ["số tài khoản", "tài khoản", "account", "account number", "stk", "bank account"],
-                "ngân hàng": ["ngân hàng", "bank", "tên ngân hàng", "chi nhánh"],
-                "hộ chiếu": ["hộ chiếu", "passport", "số hộ chiếu"],
-                "bảo hiểm": ["bảo hiểm", "bhyt", "bhxh", "insurance", "số bảo hiểm"]
-            }
-            
-            # Kiểm tra trường có phải là thông tin cá nhân không
-            for category, keywords in personal_fields.items():
-                if any(keyword in name_lower for keyword in keywords):
-                    # Phân tích giá trị lịch sử
-                    value_analysis = {}
-                    if historical_values:
-                        value_analysis = {
-                            "latest_value": historical_values[0],
-                            "consistent": len(set(historical_values)) == 1,  # Kiểm tra tính nhất quán
-                            "variations": list(set(historical_values)),
-                            "frequency": Counter(historical_values).most_common()
-                        }
-                    
-                    # Xác định mức độ nhạy cảm của thông tin
-                    sensitivity = "medium"  # Mặc định
-                    if category in ["cmnd", "số tài khoản", "email", "số điện thoại", "ngày sinh"]:
-                        sensitivity = "high"
-                    elif category in ["họ tên", "địa chỉ"]:
-                        sensitivity = "medium"
-                    else:
-                        sensitivity = "low"
-                    
-                    return {
-                        "is_personal": True,
-                        "category": category,
-                        "should_preserve": True,
-                        "sensitivity": sensitivity,
-                        "value_analysis": value_analysis,
-                        "latest_value": historical_values[0] if historical_values else ""
+            # Lớp trường tra trong ontology dùng chung (trie đã biên dịch, có nhớ đệm)
+            category = get_field_ontology().classify_personal(field_name)
+            if category is not None:
+                # Phân tích giá trị lịch sử
+                value_analysis = {}
+                if historical_values:
+                    value_analysis = {
+                        "latest_value": historical_values[0],
+                        "consistent": len(set(historical_values)) == 1,  # Kiểm tra tính nhất quán
+                        "variations": list(set(historical_values)),
+                        "frequency": Counter(historical_values).most_common()
                     }
+
+                return {
+                    "is_personal": True,
+                    "category": category,
+                    "should_preserve": True,
+                    "sensitivity": get_field_ontology().spec(category)['sensitivity'],
+                    "value_analysis": value_analysis,
+                    "latest_value": historical_values[0] if historical_values else ""
+                }
             
             # Nếu không phải thông tin cá nhân đã biết
             return {
@@ -479,6 +469,157 @@ Hãy tóm tắt ngữ cảnh trong 3-5 câu, tập trung vào mục đích và c
                 "should_preserve": False,
                 "latest_value": ""
             }
+    def _ensure_rewrite_provider(self):
+        """Chọn provider cho lượt viết lại nội dung"""
+        self._select_provider()
+
+    def _build_rewrite_prompt(
+    self,
+    field_name: str,
+    input_to_improve: str,
+    context: Optional[str],
+    form_type: Optional[str],
+    is_selected_value: bool
+) -> str:
+        """Build rewrite prompt for the current provider"""
+        similar_fields = self.find_similar_fields(field_name)
+        builders = {
+            'openai': self._build_openai_rewrite_prompt,
+            'gemini': self._build_gemini_rewrite_prompt,
+            'local': self._build_local_rewrite_prompt,
+        }
+        builder = builders.get(self._current_provider, self._build_gemini_rewrite_prompt)
+        return builder(
+            field_name,
+            similar_fields,
+            input_to_improve,
+            context,
+            is_selected_value=is_selected_value,
+            form_type=form_type
+        )
+
+    def _postprocess_rewrite(self, improved_text: str, personal_info: Dict[str, Any]) -> str:
+        """Post-process to ensure no metadata"""
+        improved_text = improved_text.strip().strip('"')
+        if personal_info.get("is_personal") and personal_info.get("category") == "học vấn":
+            # Special handling for education fields
+            improved_text = re.sub(r'^Bằng\s*', '', improved_text, flags=re.IGNORECASE).strip()
+            improved_text = improved_text.replace("ngành", "").strip()
+        return improved_text
+
+    def _stream_completion(self, prompt: str, system_prompt: str, temperature: float, max_tokens: int,
+                           gemini_model: Optional[str] = None):
+        """Gọi provider hiện tại ở chế độ stream, trả về từng đoạn văn bản khi nhận được"""
+        if self._current_provider == 'openai':
+            stream = self.client.chat.completions.create(
+                model="gpt-4-1106-preview",
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": prompt}
+                ],
+                temperature=temperature,
+                max_tokens=max_tokens,
+                stream=True
+            )
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+
+        elif self._current_provider == 'gemini':
+            response = self.client.generate_content(
+                contents=[{"role": "user", "parts": [{"text": prompt}]}],
+                generation_config={
+                    "temperature": temperature,
+                    "max_output_tokens": max_tokens,
+                },
+                stream=True,
+                model_name=gemini_model
+            )
+            for chunk in response:
+                if not chunk.candidates:
+                    continue
+                text = "".join(part.text for part in chunk.candidates[0].content.parts)
+                if text:
+                    yield text
+
+        elif self._current_provider == 'local':
+            yield from self._client.stream(prompt, max_new_tokens=max_tokens, temperature=temperature)
+
+        else:
+            raise ValueError(f"Unknown provider: {self._current_provider}")
+
+    def get_cached_context(self, form_text: str) -> Optional[str]:
+        """Trả về ngữ cảnh đã phân tích của biểu mẫu nếu có trong cache"""
+        context = self.context_cache.get(self._generate_cache_key(form_text))
+        return context if isinstance(context, str) else None
+
+    def extract_context_stream(self, form_text: str):
+        """
+        Phiên bản stream của extract_context_from_form_text.
+
+        Yields:
+            ('token', text) cho từng đoạn nhận được, sau cùng là ('done', context)
+        """
+        cached = self.get_cached_context(form_text)
+        if cached is not None:
+            yield 'done', cached
+            return
+
+        context_parts = []
+        started = None
+        completed = False
+        try:
+            self._select_provider()
+            started = time.perf_counter()
+
+            key_fields = self._extract_key_fields(form_text)
+            if self._current_provider == 'openai':
+                prompt = self._build_openai_context_prompt(form_text, key_fields)
+            elif self._current_provider == 'local':
+                prompt = self._build_local_context_prompt(form_text, key_fields)
+            else:
+                prompt = self._build_gemini_context_prompt(form_text, key_fields)
+
+            for text in self._stream_completion(prompt, "Bạn là trợ lý phân tích biểu mẫu.", 0.6, 300):
+                context_parts.append(text)
+                yield 'token', text
+            completed = True
+            self._report_call(started)
+        except Exception as e:
+            logger.error(f"Error streaming context with {self._current_provider}: {str(e)}")
+            completed = True
+            self._report_call(started, e)
+            yield 'error', str(e)
+            yield 'done', ""
+            return
+        finally:
+            if not completed:
+                self._report_call(started, aborted=True)
+
+        context = "".join(context_parts).strip()
+        self.context_cache[self._generate_cache_key(form_text)] = context
+        yield 'done', context
+
+    def _lookup_rewrite_cache(self, field_name: str, input_to_improve: str, form_type: Optional[str],
+                              context: Optional[str], personal_info: Dict[str, Any], selected_value: Optional[str]):
+        """
+        Tra cache ngữ nghĩa cho yêu cầu viết lại.
+
+        Thông tin cá nhân không bao giờ dùng cache: hai tên/số điện thoại gần
+        giống nhau vẫn là hai giá trị khác nhau.
+
+        Returns:
+            (cached_text, vector, use_cache)
+        """
+        if personal_info.get("is_personal") or selected_value is not None:
+            return None, None, False
+        try:
+            cached, vector = self.rewrite_cache.lookup(field_name, input_to_improve, form_type, context)
+            return cached, vector, True
+        except Exception as e:
+            logger.warning(f"Không tra được cache viết lại: {e}")
+            return None, None, False
+
     def rewrite_user_input(
     self, 
     field_name: str, 
@@ -497,27 +638,37 @@ Hãy tóm tắt ngữ cảnh trong 3-5 câu, tập trung vào mục đích và c
         # Analyze field for specific handling
         personal_info = self._analyze_personal_info(field_name, [input_to_improve])
         
+        cached, cache_vector, use_cache = self._lookup_rewrite_cache(
+            field_name, input_to_improve, form_type, context, personal_info, selected_value
+        )
+        if cached is not None:
+            return cached
+
+        started = None
         try:
-            similar_fields = self.find_similar_fields(field_name)
-            
-            # Initialize client if needed
-            if self._client is None or self._current_provider is None:
-                api_key_manager = get_api_key_manager()
-                self._current_provider = api_key_manager.get_available_provider('openai') or api_key_manager.get_available_provider('gemini')
-                if self._current_provider is None:
-                    raise RuntimeError("Không có nhà cung cấp AI nào khả dụng")
-                self._client = api_key_manager.get_client(self._current_provider)
-            
-            if self._current_provider == 'openai':
-                prompt = self._build_openai_rewrite_prompt(
-                    field_name, 
-                    similar_fields, 
-                    input_to_improve, 
-                    context,
-                    is_selected_value=(selected_value is not None),
-                    form_type=form_type
+            # Nội dung ngắn: thử mô hình cục bộ trước, không tốn độ trễ API
+            if self.local_router.prefer_local('rewrite', input_to_improve):
+                local_prompt = self._build_local_rewrite_prompt(
+                    field_name, [], input_to_improve, context,
+                    is_selected_value=(selected_value is not None), form_type=form_type
                 )
-                
+                improved_text = self._generate_locally(local_prompt, 200)
+                if improved_text:
+                    return self._postprocess_rewrite(improved_text, personal_info)
+
+            self._ensure_rewrite_provider()
+            started = time.perf_counter()
+            prompt = self._build_rewrite_prompt(
+                field_name,
+                input_to_improve,
+                context,
+                form_type,
+                is_selected_value=(selected_value is not None)
+            )
+
+            if self._current_provider == 'local':
+                improved_text = self._client.generate(prompt, max_new_tokens=200, temperature=0.3)
+            elif self._current_provider == 'openai':
                 response = self.client.chat.completions.create(
                     model="gpt-4-1106-preview",
                     messages=[
@@ -529,40 +680,110 @@ Hãy tóm tắt ngữ cảnh trong 3-5 câu, tập trung vào mục đích và c
                 )
                 improved_text = response.choices[0].message.content.strip()
             else:  # Gemini
-                prompt = self._build_gemini_rewrite_prompt(
-                    field_name, 
-                    similar_fields, 
-                    input_to_improve, 
-                    context,
-                    is_selected_value=(selected_value is not None),
-                    form_type=form_type
-                )
-                
-                if not hasattr(self._client, 'generate_content'):
-                    from google.generativeai import GenerativeModel
-                    self._client = GenerativeModel("gemini-1.5-pro")
-                
                 response = self.client.generate_content(
                     contents=[{"role": "user", "parts": [{"text": prompt}]}],
                     generation_config={
                         "temperature": 0.3,
                         "max_output_tokens": 200,
-                    }
+                    },
+                    model_name=GEMINI_REWRITE_MODEL
                 )
                 improved_text = response.candidates[0].content.parts[0].text.strip()
+            self._report_call(started)
             
-            # Post-process to ensure no metadata
-            improved_text = improved_text.strip('"')
-            if personal_info.get("is_personal") and personal_info.get("category") == "học vấn":
-                # Special handling for education fields
-                improved_text = re.sub(r'^Bằng\s*', '', improved_text, flags=re.IGNORECASE).strip()
-                improved_text = improved_text.replace("ngành", "").strip()
-            
+            improved_text = self._postprocess_rewrite(improved_text, personal_info)
+            if use_cache and self._current_provider != 'local':
+                self.rewrite_cache.record_llm_call(time.perf_counter() - started)
+                self.rewrite_cache.store(
+                    field_name, input_to_improve, form_type, improved_text, cache_vector, context=context
+                )
             return improved_text
         
         except Exception as e:
             logger.error(f"Lỗi khi viết lại nội dung: {e}")
+            self._report_call(started, e)
             return input_to_improve  # Return original if improvement fails
-    
-    
-    
\ No newline at end of file
+
+    def rewrite_user_input_stream(
+    self,
+    field_name: str,
+    user_input: str,
+    context: Optional[str] = None,
+    form_type: Optional[str] = None,
+    selected_value: Optional[str] = None
+):
+        """
+        Phiên bản stream của rewrite_user_input.
+
+        Yields:
+            ('token', text) cho từng đoạn provider trả về, ('error', message) nếu
+            lỗi, và luôn kết thúc bằng ('done', improved_text) đã hậu xử lý.
+        """
+        if not user_input and not selected_value:
+            yield 'done', ""
+            return
+
+        input_to_improve = selected_value if (selected_value and not user_input) else user_input
+        personal_info = self._analyze_personal_info(field_name, [input_to_improve])
+
+        cached, cache_vector, use_cache = self._lookup_rewrite_cache(
+            field_name, input_to_improve, form_type, context, personal_info, selected_value
+        )
+        if cached is not None:
+            yield 'token', cached
+            yield 'done', cached
+            return
+
+        parts = []
+        used_provider = False
+        started = None
+        completed = False
+        try:
+            if self.local_router.prefer_local('rewrite', input_to_improve):
+                local_prompt = self._build_local_rewrite_prompt(
+                    field_name, [], input_to_improve, context,
+                    is_selected_value=(selected_value is not None), form_type=form_type
+                )
+                # Nội dung ngắn: sinh trọn rồi gửi một lần, để khi mô hình cục bộ lỗi
+                # hoặc trả về rỗng thì chuyển sang provider như bản không stream
+                local_text = self._generate_locally(local_prompt, 200)
+                if local_text:
+                    parts.append(local_text)
+                    yield 'token', local_text
+            if not parts:
+                self._ensure_rewrite_provider()
+                started = time.perf_counter()
+                used_provider = self._current_provider != 'local'
+                prompt = self._build_rewrite_prompt(
+                    field_name,
+                    input_to_improve,
+                    context,
+                    form_type,
+                    is_selected_value=(selected_value is not None)
+                )
+                for text in self._stream_completion(
+                    prompt, "Trợ lý cải thiện nội dung biểu mẫu bằng tiếng Việt.", 0.3, 200,
+                    gemini_model=GEMINI_REWRITE_MODEL
+                ):
+                    parts.append(text)
+                    yield 'token', text
+            completed = True
+            self._report_call(started)
+        except Exception as e:
+            logger.error(f"Lỗi khi viết lại nội dung (stream): {e}")
+            completed = True
+            self._report_call(started, e)
+            yield 'error', str(e)
+            yield 'done', input_to_improve  # Return original if improvement fails
+            return
+        finally:
+            if not completed:
+                self._report_call(started, aborted=True)
+
+        improved_text = self._postprocess_rewrite("".join(parts), personal_info)
+        if use_cache and used_provider and improved_text:
+            self.rewrite_cache.record_llm_call(time.perf_counter() - started)
+            self.rewrite_cache.store(
+                field_name, input_to_improve, form_type, improved_text, cache_vector, context=context
+            )
+        yield 'done', improved_text
@@ -1,17 +1,88 @@
 from openai import OpenAI
-from models.web_config import WebConfig, APIKey
+from models.web_config import WebConfig, APIKey, VersionedCache
 from models.user import db
-from datetime import datetime
+from datetime import datetime, timedelta
 import time
 import logging
 import json
+import os
+import threading
+from collections import namedtuple
 from flask import current_app
-from typing import Optional
+from typing import Dict, List, Optional
+from sqlalchemy import func
 
-import google.generativeai as genai
+from config.config import GEMINI_MODEL
+from utils.provider_health import get_health_tracker
+from utils.key_validator import get_key_validator
+from utils.rate_limiter import get_rate_limiter, USAGE_WINDOW_SECONDS
 
 logger = logging.getLogger(__name__)
 
+SUPPORTED_PROVIDERS = ('openai', 'gemini')
+# Giới hạn thời gian chờ mỗi lượt gọi để độ trễ đuôi không kéo dài khi provider gặp sự cố
+PROVIDER_TIMEOUT = float(os.environ.get('AI_PROVIDER_TIMEOUT', '20'))
+
+
+class GeminiKeyClient:
+    """
+    Client Gemini gắn với một API key.
+
+    Dùng GenerativeServiceClient công khai của google-ai-generativelanguage với
+    key truyền qua client_options, không qua genai.configure (cấu hình toàn cục
+    của tiến trình), nên các luồng dùng key khác nhau không ảnh hưởng lẫn nhau.
+    generate_content nhận cùng tham số như GenerativeModel.generate_content và
+    trả về GenerateContentResponse (đọc qua response.candidates).
+    """
+
+    def __init__(self, key_value: str, model_name: str = GEMINI_MODEL):
+        from google.ai import generativelanguage as glm
+        self._glm = glm
+        self.model_name = model_name
+        self._client = glm.GenerativeServiceClient(client_options={'api_key': key_value})
+
+    def generate_content(self, contents, generation_config=None, stream: bool = False,
+                         model_name: Optional[str] = None):
+        """Gọi generateContent (hoặc streamGenerateContent khi stream=True)"""
+        if isinstance(contents, str):
+            contents = [{"role": "user", "parts": [{"text": contents}]}]
+        request = self._glm.GenerateContentRequest(
+            model=f"models/{model_name or self.model_name}",
+            contents=contents,
+            generation_config=generation_config or {},
+        )
+        if stream:
+            return self._client.stream_generate_content(request=request, timeout=PROVIDER_TIMEOUT)
+        return self._client.generate_content(request=request, timeout=PROVIDER_TIMEOUT)
+
+
+# Bản sao chỉ đọc của một dòng APIKey, an toàn khi dùng ngoài session SQLAlchemy
+KeyState = namedtuple(
+    'KeyState',
+    'id key name provider is_active is_valid created_at usage_limit total_requests usage_reset_at rpm_limit'
+)
+
+
+def _load_key_states() -> Dict[str, List[KeyState]]:
+    """Nạp các key đang bật, nhóm theo provider (key mới nhất trước)"""
+    keys = APIKey.query.filter_by(is_active=True).order_by(APIKey.created_at.desc()).all()
+    states = {provider: [] for provider in SUPPORTED_PROVIDERS}
+    for key in keys:
+        states.setdefault(key.provider, []).append(KeyState(
+            key.id, (key.key or '').strip(), key.name, key.provider,
+            key.is_active, key.is_valid, key.created_at,
+            key.usage_limit, key.total_requests or 0, key.usage_reset_at, key.rpm_limit
+        ))
+    return states
+
+
+# Trạng thái key được đọc từ bộ nhớ; DB chỉ được hỏi số phiên bản sau mỗi TTL
+_key_state_cache = VersionedCache(
+    APIKey.CACHE_SCOPE,
+    _load_key_states,
+    check_interval=float(os.environ.get('API_KEY_CACHE_TTL', '10')),
+)
+
 class APIKeyManager:
     """Quản lý API key OpenAI và Gemini từ cơ sở dữ liệu"""
     
@@ -20,6 +91,9 @@ class APIKeyManager:
     _gemini_client = None
     _current_openai_key = None
     _current_gemini_key = None
+    _key_clients = {}
+    _usage = {}  # key_id -> [số request, số thành công, tổng thời gian phản hồi (ms) của request thành công]
+    _usage_lock = threading.Lock()
     
     def __new__(cls):
         if cls._instance is None:
@@ -51,30 +125,30 @@ class APIKeyManager:
             self._get_gemini_client()
         return self._gemini_client
     def _validate_current_key(self, provider):
-        """Kiểm tra xem key hiện tại còn hợp lệ và active không"""
+        """Kiểm tra xem key hiện tại còn hợp lệ và active không (đọc từ cache trạng thái key)"""
         try:
-            if provider == 'openai' and self._current_openai_key:
-                key = APIKey.query.filter_by(
-                    key=self._current_openai_key,
-                    provider='openai',
-                    is_active=True,
-                    is_valid=True
-                ).first()
-                return key is not None
-                
-            elif provider == 'gemini' and self._current_gemini_key:
-                key = APIKey.query.filter_by(
-                    key=self._current_gemini_key,
-                    provider='gemini',
-                    is_active=True,
-                    is_valid=True
-                ).first()
-                return key is not None
-                
-            return False
+            current_key = self._current_openai_key if provider == 'openai' else self._current_gemini_key
+            if not current_key:
+                return False
+            return any(
+                state.key == current_key and state.is_valid
+                for state in self._get_key_states(provider)
+            )
         except Exception as e:
             logger.error(f"Error validating current {provider} key: {str(e)}")
             return False
+
+    def _get_key_states(self, provider) -> List[KeyState]:
+        """Các key đang bật của provider theo cache trong tiến trình"""
+        return _key_state_cache.get().get(provider, [])
+
+    def invalidate_key_cache(self):
+        """Bỏ cache trạng thái key ở mọi worker sau khi bảng APIKey thay đổi"""
+        try:
+            _key_state_cache.invalidate()
+        except Exception as e:
+            logger.error(f"Error invalidating API key cache: {str(e)}")
+
     def reset_client(self, provider='openai'):
             """Reset client cache cho provider cụ thể"""
             try:
@@ -84,6 +158,7 @@ class APIKeyManager:
                 elif provider == 'gemini':
                     self._gemini_client = None
                     self._current_gemini_key = None
+                self._key_clients = {k: v for k, v in self._key_clients.items() if k[0] != provider}
                 logger.info(f"Reset {provider} client cache")
             except Exception as e:
                 logger.error(f"Error resetting {provider} client: {str(e)}")
@@ -178,9 +253,7 @@ class APIKeyManager:
                 if active_key.key != self._current_gemini_key:
                     self._current_gemini_key = active_key.key
                     if self._current_gemini_key and self._current_gemini_key.strip() != "":
-                        genai.configure(api_key=self._current_gemini_key)
-                        # Cập nhật thành bản gemini-2.0-flash
-                        self._gemini_client = genai.GenerativeModel('gemini-2.0-flash')
+                        self._gemini_client = GeminiKeyClient(self._current_gemini_key)
                     else:
                         self._gemini_client = None
                         logger.warning("Empty Gemini API key provided")
@@ -190,26 +263,16 @@ class APIKeyManager:
             logger.error(f"Error getting Gemini client: {str(e)}")
             return None
     def get_available_provider(self, preferred_provider: str = None) -> Optional[str]:
-        """Kiểm tra và trả về provider khả dụng (ưu tiên provider được chỉ định)"""
+        """Trả về provider có ít nhất một key khỏe (ưu tiên provider được chỉ định)"""
         try:
-            # Kiểm tra preferred_provider trước
-            if preferred_provider:
-                key = self._get_active_api_key(preferred_provider)
-                if key and key.is_active:
-                    logger.info(f"Using preferred provider: {preferred_provider}")
-                    return preferred_provider
-
-            # Ưu tiên OpenAI nếu không có preferred_provider hoặc preferred_provider không khả dụng
-            openai_key = self._get_active_api_key('openai')
-            if openai_key and openai_key.is_active:
-                logger.info("Using OpenAI as provider")
-                return 'openai'
-
-            # Thử Gemini nếu OpenAI không có
-            gemini_key = self._get_active_api_key('gemini')
-            if gemini_key and gemini_key.is_active:
-                logger.info("Using Gemini as provider")
-                return 'gemini'
+            tracker = get_health_tracker()
+            providers = ([preferred_provider] if preferred_provider else []) + list(SUPPORTED_PROVIDERS)
+            for provider in dict.fromkeys(providers):
+                pool = self._get_key_pool(provider)
+                if any(tracker.is_available(provider, key.id) for key in pool):
+                    return provider
+                if pool:
+                    logger.warning(f"Tất cả key {provider} đang bị ngắt (circuit open)")
 
             logger.error("No available providers with active and valid API keys")
             return None
@@ -218,6 +281,219 @@ class APIKeyManager:
             logger.error(f"Error in get_available_provider: {str(e)}", exc_info=True)
             return None
 
+    def _get_key_pool(self, provider):
+        """Các key đang bật của provider; nếu có key hợp lệ thì chỉ dùng các key hợp lệ"""
+        try:
+            if provider not in SUPPORTED_PROVIDERS:
+                return []
+            keys = self._get_key_states(provider)
+            valid_keys = [key for key in keys if key.is_valid is not False]
+            return valid_keys or keys
+        except Exception as e:
+            logger.error(f"Error getting {provider} key pool: {str(e)}")
+            return []
+
+    def _client_for_key(self, provider, api_key):
+        """Client riêng cho từng key, tạo một lần và dùng lại"""
+        key_value = (api_key.key or '').strip()
+        if not key_value:
+            return None
+
+        cached = self._key_clients.get((provider, api_key.id))
+        if cached and cached[0] == key_value:
+            client = cached[1]
+        else:
+            if provider == 'openai':
+                client = OpenAI(api_key=key_value, timeout=PROVIDER_TIMEOUT, max_retries=1)
+            else:
+                client = GeminiKeyClient(key_value)
+            self._key_clients[(provider, api_key.id)] = (key_value, client)
+        return client
+
+    def acquire_client(self, preferred_provider: str = 'openai', exclude=()):
+        """
+        Chọn provider và key khỏe nhất trước khi gọi.
+
+        Key có circuit đang mở, hết token theo số request/phút hoặc đã dùng hết
+        hạn mức (usage_limit) bị bỏ qua; khi không còn key nào của provider ưu
+        tiên, provider tiếp theo được dùng ngay thay vì chờ lượt gọi thất bại.
+        Lượt gọi được chọn đã trừ một token của key.
+
+        Args:
+            preferred_provider: provider thử trước
+            exclude: các cặp (provider, key_id) không dùng (vd. key vừa lỗi)
+
+        Returns:
+            (provider, key_id, client) hoặc (None, None, None)
+        """
+        tracker = get_health_tracker()
+        limiter = get_rate_limiter()
+        providers = [preferred_provider] + [p for p in SUPPORTED_PROVIDERS if p != preferred_provider]
+        for provider in providers:
+            pool = {
+                key.id: key for key in self._get_key_pool(provider)
+                if limiter.within_quota(key.usage_limit, key.total_requests + self._pending_requests(key.id))
+            }
+            eligible = [key_id for key_id in pool if limiter.has_capacity(provider, key_id, pool[key_id].rpm_limit)]
+            if pool and not eligible:
+                logger.warning(f"Mọi key {provider} đã chạm giới hạn tốc độ, chuyển provider")
+            while eligible:
+                key_id = tracker.choose(provider, eligible, exclude=exclude)
+                if key_id is None:
+                    break
+                # Token có thể vừa bị luồng khác lấy mất: thử key khác
+                if not limiter.try_acquire(provider, key_id, pool[key_id].rpm_limit):
+                    tracker.release(provider, key_id)
+                    eligible.remove(key_id)
+                    continue
+                client = self._client_for_key(provider, pool[key_id])
+                if client is not None:
+                    return provider, key_id, client
+                tracker.release(provider, key_id)
+                eligible.remove(key_id)
+        return None, None, None
+
+    def _pending_requests(self, key_id) -> int:
+        """Số request của key trong tiến trình này chưa được ghi xuống DB"""
+        entry = self._usage.get(key_id)
+        return entry[0] if entry else 0
+
+    def report_result(self, provider, key_id, success: bool, latency: float, error: Optional[str] = None):
+        """Ghi nhận kết quả một lượt gọi để cập nhật sức khỏe và bộ đếm sử dụng của key"""
+        get_health_tracker().record(provider, key_id, success, latency, error)
+        with self._usage_lock:
+            entry = self._usage.setdefault(key_id, [0, 0, 0.0])
+            entry[0] += 1
+            if success:
+                entry[1] += 1
+                entry[2] += latency * 1000
+
+    def flush_usage(self):
+        """
+        Ghi bộ đếm sử dụng đã gom trong bộ nhớ vào bảng APIKey trong một commit.
+
+        Key có usage_reset_at đã qua được bắt đầu chu kỳ hạn mức mới: đặt lại
+        bộ đếm và dời usage_reset_at thêm một hoặc nhiều chu kỳ. Key có
+        usage_limit nhưng chưa có usage_reset_at (vd. được đặt thẳng trong DB)
+        bắt đầu chu kỳ đầu tiên từ lúc này.
+        """
+        with self._usage_lock:
+            pending, self._usage = self._usage, {}
+        try:
+            now = datetime.now()
+            unstarted = APIKey.query.filter(APIKey.usage_limit.isnot(None), APIKey.usage_reset_at.is_(None)).all()
+            for api_key in unstarted:
+                api_key.usage_reset_at = now + timedelta(seconds=USAGE_WINDOW_SECONDS)
+            expired = APIKey.query.filter(APIKey.usage_reset_at.isnot(None), APIKey.usage_reset_at <= now).all()
+            for api_key in expired:
+                periods = int((now - api_key.usage_reset_at).total_seconds() // USAGE_WINDOW_SECONDS) + 1
+                api_key.usage_reset_at += timedelta(seconds=periods * USAGE_WINDOW_SECONDS)
+                api_key.total_requests = 0
+                api_key.successful_requests = 0
+
+            for key_id, (requests, successes, latency_ms) in pending.items():
+                values = {
+                    APIKey.total_requests: func.coalesce(APIKey.total_requests, 0) + requests,
+                    APIKey.successful_requests: func.coalesce(APIKey.successful_requests, 0) + successes,
+                }
+                if successes:
+                    values[APIKey.response_time] = round(latency_ms / successes)
+                APIKey.query.filter_by(id=key_id).update(values, synchronize_session=False)
+
+            if not unstarted and not expired and not pending:
+                db.session.rollback()
+                return 0
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            # Giữ lại số liệu để ghi ở lần sau
+            with self._usage_lock:
+                for key_id, (requests, successes, latency_ms) in pending.items():
+                    entry = self._usage.setdefault(key_id, [0, 0, 0.0])
+                    entry[0] += requests
+                    entry[1] += successes
+                    entry[2] += latency_ms
+            raise
+
+        # Số request đã ghi xuống DB: nạp lại trạng thái key để kiểm tra hạn mức
+        _key_state_cache.invalidate(broadcast=bool(unstarted or expired))
+        return len(pending)
+
+    def set_usage_limit(self, key_id, usage_limit: Optional[int]) -> bool:
+        """
+        Đặt hạn mức request theo chu kỳ (API_KEY_USAGE_WINDOW) cho một key.
+
+        Đặt hạn mức cho key chưa có chu kỳ thì bắt đầu đếm từ lúc này (bộ đếm về
+        0, usage_reset_at sau một chu kỳ); None bỏ hạn mức.
+        """
+        try:
+            api_key = APIKey.query.get(key_id)
+            if not api_key:
+                return False
+            api_key.usage_limit = usage_limit
+            if usage_limit is None:
+                api_key.usage_reset_at = None
+            elif api_key.usage_reset_at is None:
+                api_key.usage_reset_at = datetime.now() + timedelta(seconds=USAGE_WINDOW_SECONDS)
+                api_key.total_requests = 0
+                api_key.successful_requests = 0
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error setting usage limit for API key {key_id}: {str(e)}")
+            return False
+        self.invalidate_key_cache()
+        return True
+
+    def apply_validation_results(self, results):
+        """
+        Lưu kết quả kiểm tra key trong một commit.
+
+        Args:
+            results: danh sách (key_id, kết quả check_api_key_validity)
+        """
+        if not results:
+            return
+        try:
+            keys = {key.id: key for key in APIKey.query.filter(APIKey.id.in_([key_id for key_id, _ in results])).all()}
+            now = datetime.now()
+            for key_id, result in results:
+                api_key = keys.get(key_id)
+                if api_key is None:
+                    continue
+                details = result.get('details') or {}
+                api_key.is_valid = result['valid']
+                api_key.status_message = result['message']
+                api_key.last_checked = now
+                if result['valid']:
+                    api_key.error_details = None
+                    models = details.get('available_models', details.get('gpt_models'))
+                    if models is not None:
+                        api_key.available_models = json.dumps(models)
+                    # Thời gian phản hồi thật được ghi từ bộ đếm sử dụng; chỉ dùng
+                    # thời gian của lượt kiểm tra khi key chưa có request nào
+                    if not api_key.total_requests and details.get('response_time_ms') is not None:
+                        api_key.response_time = details['response_time_ms']
+                    # Hạn mức request/phút provider báo cho key: dùng cho token bucket
+                    if details.get('rate_limit_requests'):
+                        api_key.rpm_limit = details['rate_limit_requests']
+                else:
+                    api_key.error_details = details.get('error')
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error saving API key validation results: {str(e)}")
+            return
+        self.invalidate_key_cache()
+
+    def release_key(self, provider, key_id):
+        """Bỏ qua lượt gọi bị hủy giữa chừng (không tính thành công hay lỗi)"""
+        get_health_tracker().release(provider, key_id)
+
+    def get_health_snapshot(self):
+        """Trạng thái circuit và độ trễ của từng key trong tiến trình hiện tại"""
+        return get_health_tracker().snapshot()
+
 
     def _get_active_api_key(self, provider='openai'):
         """
@@ -234,17 +510,12 @@ class APIKeyManager:
                 logger.error("No application context or APIKey model not properly initialized")
                 return None
 
-            # Sử dụng query.filter_by thay vì objects.filter
-            active_key = APIKey.query.filter_by(
-                provider=provider,
-                is_active=True
-            ).order_by(APIKey.created_at.desc()).first()
-            
-            if active_key:
-                logger.info(f"Found active {provider} key: {active_key.name}")
-                return active_key
+            states = self._get_key_states(provider)
+            if states:
+                logger.debug(f"Found active {provider} key: {states[0].name}")
+                return states[0]
 
-            logger.warning(f"No active API key found for provider {provider}")
+            logger.debug(f"No active API key found for provider {provider}")
             return None
 
         except Exception as e:
@@ -308,9 +579,12 @@ class APIKeyManager:
         
         try:
             start_time = time.time()
-            response = client.models.list()
+            raw_response = client.models.with_raw_response.list()
             end_time = time.time()
+            response = raw_response.parse()
             response_time = round((end_time - start_time) * 1000)
+            # Hạn mức request do OpenAI báo qua header (nếu có)
+            rate_limit = raw_response.headers.get('x-ratelimit-limit-requests')
             
             all_models = [model.id for model in response.data]
             gpt_models = [m for m in all_models if 'gpt' in m]
@@ -326,6 +600,7 @@ class APIKeyManager:
                     "gpt_models": gpt_models,
                     "embedding_models": embedding_models,
                     "other_models": other_models,
+                    "rate_limit_requests": int(rate_limit) if rate_limit and rate_limit.isdigit() else None,
                     "checked_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
                 }
             }
@@ -340,8 +615,8 @@ class APIKeyManager:
             if api_key is None:
                 client = self._get_gemini_client()
             else:
-                genai.configure(api_key=api_key)
-                client = genai.GenerativeModel('gemini-2.0-flash')
+                # Client riêng cho key được kiểm tra
+                client = GeminiKeyClient(api_key)
             
             if not client:
                 return {
@@ -358,7 +633,7 @@ class APIKeyManager:
             end_time = time.time()
             response_time = round((end_time - start_time) * 1000)
             
-            if response and response.text:
+            if response and response.candidates and response.candidates[0].content.parts:
                 return {
                     "valid": True,
                     "message": "API key hợp lệ và đang hoạt động",
@@ -421,7 +696,7 @@ class APIKeyManager:
         }
 
     def add_api_key(self, new_api_key, name=None, description=None, provider='openai'):
-        """Thêm API key mới vào hệ thống và kiểm tra tính hợp lệ"""
+        """Thêm API key mới vào hệ thống; tính hợp lệ được kiểm tra trong nền"""
         try:
             if not new_api_key or new_api_key.strip() == "":
                 logger.warning("Empty API key provided")
@@ -430,57 +705,35 @@ class APIKeyManager:
             if not (current_app and hasattr(current_app, 'app_context')):
                 logger.warning("Cannot add API key - no application context")
                 return None
-                
-            validity_result = self.check_api_key_validity(new_api_key, provider)
-            
-            api_key = APIKey.add_key(new_api_key, name, provider, description)
-            
-            is_valid = validity_result['valid']
-            status_message = validity_result['message']
-            
-            response_time = None
-            available_models = None
-            error_details = None
-            
-            if is_valid:
-                response_time = validity_result['details'].get('response_time_ms')
-                if provider == 'openai':
-                    available_models = json.dumps(validity_result['details'].get('available_models', []))
-            else:
-                error_details = validity_result['details'].get('error')
-            
-            APIKey.update_key_status(
-                api_key.id, 
-                is_valid, 
-                status_message, 
-                response_time, 
-                available_models, 
-                error_details
-            )
+
+            new_api_key = new_api_key.strip()
+            api_key = APIKey.add_key(new_api_key, name, description=description, provider=provider)
             
             active_key = APIKey.get_active_key(provider)
             if not active_key:
                 APIKey.set_active_key(api_key.id, provider)
-                
-                if is_valid:
-                    if provider == 'openai':
-                        self._current_openai_key = new_api_key
-                        self._openai_client = OpenAI(api_key=new_api_key)
-                    elif provider == 'gemini':
-                        self._current_gemini_key = new_api_key
-                        genai.configure(api_key=new_api_key)
-                        self._gemini_client = genai.GenerativeModel('gemini-2.0-flash')
-            
-            if is_valid and not active_key and provider == 'openai':
-                WebConfig.set_value('openai_api_key', new_api_key, 'api')
+                if provider == 'openai':
+                    WebConfig.set_value('openai_api_key', new_api_key, 'api')
+
+            validator = get_key_validator()
+            if validator is not None:
+                api_key.status_message = "Đang kiểm tra API key..."
+                db.session.commit()
+                validator.request_check(api_key.id)
+            else:
+                # Không có luồng nền (vd. chạy từ script): kiểm tra ngay
+                result = self.check_api_key_validity(new_api_key, provider)
+                self.apply_validation_results([(api_key.id, result)])
+                api_key = APIKey.query.get(api_key.id)
             
+            self.invalidate_key_cache()
             return api_key
         except Exception as e:
             logger.error(f"Error adding API key for {provider}: {str(e)}")
             return None
 
     def get_key_details(self, key_id):
-        """Lấy thông tin chi tiết về API key"""
+        """Lấy thông tin chi tiết về API key từ trạng thái đã lưu (không gọi provider)"""
         try:
             if current_app and hasattr(current_app, 'app_context'):
                 api_key = APIKey.query.get(key_id)
@@ -488,11 +741,16 @@ class APIKeyManager:
                     return None
                     
                 if not api_key.last_checked or (datetime.now() - api_key.last_checked).total_seconds() > 3600:
-                    api_key = self.refresh_api_key_status(key_id)
+                    validator = get_key_validator()
+                    if validator is not None:
+                        validator.request_check(key_id)
                     
                 return {
-                    'total_requests': api_key.total_requests if hasattr(api_key, 'total_requests') else 0,
-                    'successful_requests': api_key.successful_requests if hasattr(api_key, 'successful_requests') else 0,
+                    'total_requests': api_key.total_requests or 0,
+                    'successful_requests': api_key.successful_requests or 0,
+                    'usage_limit': api_key.usage_limit,
+                    'usage_reset_at': api_key.usage_reset_at,
+                    'rpm_limit': api_key.rpm_limit,
                     'available_models': json.loads(api_key.available_models) if api_key.available_models else [],
                     'last_checked': api_key.last_checked,
                     'response_time': api_key.response_time,
@@ -530,8 +788,10 @@ class APIKeyManager:
                 status_message=status_message,
                 response_time=response_time,
                 available_models=available_models,
-                error_details=error_details
+                error_details=error_details,
+                rpm_limit=validity_result['details'].get('rate_limit_requests')
             )
+            self.invalidate_key_cache()
             
             if not updated_key:
                 return False, "Không thể cập nhật trạng thái API key"
@@ -567,13 +827,13 @@ class APIKeyManager:
                         self._openai_client = OpenAI(api_key=new_api_key)
                     elif provider == 'gemini':
                         self._current_gemini_key = new_api_key
-                        genai.configure(api_key=new_api_key)
-                        self._gemini_client = genai.GenerativeModel('gemini-2.0-flash')
+                        self._gemini_client = GeminiKeyClient(new_api_key)
                 else:
                     self.add_api_key(new_api_key, f"Updated {provider} Key", provider=provider)
 
                 if provider == 'openai':
                     WebConfig.set_value('openai_api_key', new_api_key, 'api')
+                self.invalidate_key_cache()
                 return True
             else:
                 logger.warning("Empty API key provided for update")
@@ -593,7 +853,12 @@ class APIKeyManager:
             return []
 
     def set_active_api_key(self, key_id, provider='openai'):
-        """Đặt một API key làm key hoạt động chính với reset client"""
+        """
+        Bật một API key và dùng nó cho client mặc định của provider.
+
+        Các key đang bật khác không bị tắt: acquire_client cân bằng tải trên mọi
+        key đang bật của provider.
+        """
         try:
             if not current_app:
                 logger.error("Không có Flask app context")
@@ -611,13 +876,10 @@ class APIKeyManager:
             # Reset client trước khi thay đổi
             self.reset_client(provider)
             
-            # Deactivate tất cả các key khác cùng provider
-            APIKey.query.filter_by(provider=provider).update({APIKey.is_active: False})
-            
-            # Activate key hiện tại
             api_key.is_active = True
             api_key.last_checked = datetime.now()
             db.session.commit()
+            self.invalidate_key_cache()
 
             key_value = api_key.key.strip()
             
@@ -628,8 +890,7 @@ class APIKeyManager:
                 WebConfig.set_value('openai_api_key', key_value, 'api')
             elif provider == 'gemini':
                 self._current_gemini_key = key_value
-                genai.configure(api_key=key_value)
-                self._gemini_client = genai.GenerativeModel('gemini-2.0-flash')
+                self._gemini_client = GeminiKeyClient(key_value)
 
             logger.info(f"Đã kích hoạt {provider} key: {api_key.name}")
             return True
@@ -641,12 +902,8 @@ class APIKeyManager:
     # Trong models/web_config.py (hoặc file chứa model APIKey)
     @classmethod
     def set_active_key(cls, key_id, provider):
-        """Phương thức class để set active key và trả về key đó"""
+        """Phương thức class để bật một key (các key khác giữ nguyên) và trả về key đó"""
         try:
-            # Deactivate tất cả các key cùng provider
-            cls.query.filter_by(provider=provider).update({cls.is_active: False})
-            
-            # Activate key được chọn
             key = cls.query.get(key_id)
             if key:
                 key.is_active = True
@@ -663,7 +920,14 @@ class APIKeyManager:
         """Xóa một API key"""
         try:
             if current_app and hasattr(current_app, 'app_context'):
-                return APIKey.delete_key(key_id)
+                api_key = APIKey.query.get(key_id)
+                provider = api_key.provider if api_key else None
+                deleted = APIKey.delete_key(key_id)
+                if deleted:
+                    self.invalidate_key_cache()
+                    if provider:
+                        self.reset_client(provider)
+                return deleted
             return False
         except Exception as e:
             logger.error(f"Error deleting API key: {str(e)}")
@@ -684,18 +948,21 @@ class APIKeyManager:
                 if api_key.is_active:
                     api_key.is_active = False
                     db.session.commit()
+                    self.invalidate_key_cache()
                     
                     # Reset client cache
                     self.reset_client(provider)
                     
-                    # Tìm key khác để kích hoạt
-                    other_key = APIKey.query.filter_by(
-                        provider=provider, 
-                        is_valid=True
-                    ).filter(
-                        APIKey.id != key_id,
-                        APIKey.is_active == False
-                    ).first()
+                    # Chỉ bật key dự phòng khi provider không còn key nào đang bật
+                    other_key = None
+                    if not APIKey.query.filter_by(provider=provider, is_active=True).count():
+                        other_key = APIKey.query.filter_by(
+                            provider=provider,
+                            is_valid=True
+                        ).filter(
+                            APIKey.id != key_id,
+                            APIKey.is_active == False
+                        ).first()
                     
                     if other_key:
                         # Kích hoạt key khác
@@ -722,6 +989,7 @@ class APIKeyManager:
                     
                 api_key.is_active = True
                 db.session.commit()
+                self.invalidate_key_cache()
                 
                 return True
             return False
@@ -744,14 +1012,17 @@ class APIKeyManager:
                     available_models = json.dumps(validity_result['details'].get('available_models', [])) if is_valid else None
                     error_details = validity_result['details'].get('error') if not is_valid else None
                     
-                    return APIKey.update_key_status(
+                    updated_key = APIKey.update_key_status(
                         key_id, 
                         is_valid, 
                         status_message, 
                         response_time, 
                         available_models, 
-                        error_details
+                        error_details,
+                        rpm_limit=validity_result['details'].get('rate_limit_requests')
                     )
+                    self.invalidate_key_cache()
+                    return updated_key
             return None
         except Exception as e:
             logger.error(f"Error refreshing API key status: {str(e)}")
@@ -8,11 +8,12 @@ from flask import session
 from transformers import AutoTokenizer, AutoModelForTokenClassification
 from transformers import pipeline
 import spacy
+from utils.model_registry import freeze_module
 
 # Load models
 model_name = "Davlan/bert-base-multilingual-cased-ner-hrl"
 tokenizer = AutoTokenizer.from_pretrained(model_name)
-model = AutoModelForTokenClassification.from_pretrained(model_name)
+model = freeze_module(AutoModelForTokenClassification.from_pretrained(model_name))
 ner_pipeline = pipeline("ner", model=model, tokenizer=tokenizer, aggregation_strategy="simple")
 
 # Load spaCy model for Vietnamese (nếu có) hoặc English
@@ -0,0 +1,207 @@
+"""
+Kho embedding gọn cho tên trường: một ma trận liền khối, đã chuẩn hóa L2 và
+lượng tử hóa, kèm bảng khóa -> số hàng.
+
+Vì mọi hàng đã chuẩn hóa, cosine giữa truy vấn và mọi trường là một phép nhân
+ma trận - vector. Truy vấn giữ float32, chỉ ma trận được lượng tử hóa:
+    float32  4 byte/chiều, dùng làm chuẩn đối chiếu
+    float16  2 byte/chiều, sai số cosine cỡ 1e-4; đổi float16 -> float32
+             chậm (~7 lần float32 khi quét cả ma trận)
+    int8     1 byte/chiều + 4 byte hệ số/hàng: hàng i lưu round(v / s_i)
+             với s_i = max|v| / 127, cosine = s_i * (q_i . truy vấn),
+             sai số cosine cỡ 1e-3; mặc định: quét ~1.5 lần float32
+
+Lưu xuống đĩa thành <tên>.npy (+ <tên>.scales.npy cho int8) và nạp lại bằng
+memory map. evaluate_recall đo mức mất recall@k so với độ chính xác đầy đủ.
+"""
+import os
+from typing import Dict, Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+EMBEDDING_DTYPE = os.environ.get('EMBEDDING_DTYPE', 'int8')
+DTYPES = ('float32', 'float16', 'int8')
+# Số hàng được đổi sang float32 mỗi lần khi chấm điểm, giới hạn bộ nhớ tạm
+_BLOCK_ROWS = 2048
+
+
+def normalize_rows(matrix) -> np.ndarray:
+    """Chuẩn hóa L2 từng hàng (float32); hàng toàn 0 giữ nguyên"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms > 0, norms, 1.0)
+
+
+def _save_array(path: str, array: np.ndarray):
+    """np.save qua file tạm rồi os.replace: người đang memory-map bản cũ không bị ảnh hưởng"""
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(tmp_path, 'wb') as f:
+            np.save(f, array)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class EmbeddingStore:
+    """Ma trận embedding đã chuẩn hóa, lượng tử hóa, tra theo khóa"""
+
+    def __init__(self, keys: Sequence[Hashable], matrix: np.ndarray, dtype: str = EMBEDDING_DTYPE,
+                 scales: Optional[np.ndarray] = None, dim: Optional[int] = None):
+        """
+        Thường tạo qua from_vectors / from_dict / load; khi truyền scales thì
+        matrix được coi là đã lượng tử hóa sẵn.
+        """
+        if dtype not in DTYPES:
+            raise ValueError(f"Kiểu lượng tử hóa không hỗ trợ: {dtype}")
+        self.keys = list(keys)
+        self.rows: Dict[Hashable, int] = {key: row for row, key in enumerate(self.keys)}
+        self.dtype = dtype
+        self.matrix = matrix
+        self.scales = scales
+        self.dim = dim if dim is not None else (matrix.shape[1] if matrix.ndim == 2 else 0)
+
+    @classmethod
+    def from_vectors(cls, keys: Sequence[Hashable], vectors, dtype: str = EMBEDDING_DTYPE,
+                     dim: Optional[int] = None) -> 'EmbeddingStore':
+        """Chuẩn hóa rồi lượng tử hóa các vector (mỗi khóa một hàng)"""
+        if dtype not in DTYPES:
+            raise ValueError(f"Kiểu lượng tử hóa không hỗ trợ: {dtype}")
+        keys = list(keys)
+        if not keys:
+            dim = dim or 0
+            empty = np.zeros((0, dim), dtype=np.int8 if dtype == 'int8' else dtype)
+            return cls([], empty, dtype, np.zeros(0, dtype=np.float32) if dtype == 'int8' else None, dim)
+        normalized = normalize_rows(vectors)
+        if dtype != 'int8':
+            return cls(keys, np.ascontiguousarray(normalized.astype(dtype)), dtype)
+        peak = np.abs(normalized).max(axis=1)
+        scales = np.where(peak > 0, peak / 127.0, 1.0).astype(np.float32)
+        quantized = np.clip(np.rint(normalized / scales[:, None]), -127, 127).astype(np.int8)
+        return cls(keys, np.ascontiguousarray(quantized), dtype, scales)
+
+    @classmethod
+    def from_dict(cls, vectors: Dict[Hashable, np.ndarray], dtype: str = EMBEDDING_DTYPE,
+                  dim: Optional[int] = None) -> 'EmbeddingStore':
+        keys = list(vectors)
+        return cls.from_vectors(keys, np.stack([vectors[key] for key in keys]) if keys else None, dtype, dim)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return key in self.rows
+
+    @property
+    def nbytes(self) -> int:
+        """Số byte của ma trận và hệ số (không tính bảng khóa)"""
+        return int(self.matrix.nbytes + (self.scales.nbytes if self.scales is not None else 0))
+
+    def vector(self, key) -> Optional[np.ndarray]:
+        """Vector đã chuẩn hóa (giải lượng tử về float32) của khóa, None nếu không có"""
+        row = self.rows.get(key)
+        if row is None:
+            return None
+        vector = self.matrix[row].astype(np.float32)
+        return vector * self.scales[row] if self.scales is not None else vector
+
+    def similarities(self, query) -> np.ndarray:
+        """Cosine của query (một hoặc nhiều vector) với mọi hàng: (số truy vấn, số hàng) hoặc (số hàng,)"""
+        single = np.ndim(query) == 1
+        query = normalize_rows(query)
+        scores = np.empty((len(query), len(self.keys)), dtype=np.float32)
+        # Đổi từng khối hàng sang float32 để dùng BLAS mà không giải lượng tử cả ma trận
+        for start in range(0, len(self.keys), _BLOCK_ROWS):
+            block = np.asarray(self.matrix[start:start + _BLOCK_ROWS], dtype=np.float32)
+            scores[:, start:start + len(block)] = query @ block.T
+        if self.scales is not None:
+            scores *= self.scales
+        return scores[0] if single else scores
+
+    def similarity(self, key, query) -> Optional[float]:
+        """Cosine của query với một khóa, None nếu khóa không có trong kho"""
+        row = self.rows.get(key)
+        if row is None:
+            return None
+        score = float(np.dot(normalize_rows(query)[0], self.matrix[row].astype(np.float32)))
+        return score * float(self.scales[row]) if self.scales is not None else score
+
+    def top_k(self, query, k: int = 10) -> List[Tuple[Hashable, float]]:
+        scores = self.similarities(query)
+        if not len(scores):
+            return []
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(self.keys[i], float(scores[i])) for i in top]
+
+    # ----- lưu / nạp -----
+
+    def save(self, directory: str, name: str) -> Dict:
+        """Ghi ma trận (và hệ số) vào directory; trả về metadata cần để nạp lại"""
+        _save_array(os.path.join(directory, f'{name}.npy'), self.matrix)
+        if self.scales is not None:
+            _save_array(os.path.join(directory, f'{name}.scales.npy'), self.scales)
+        return {'dtype': self.dtype, 'dim': self.dim, 'keys': self.keys}
+
+    @classmethod
+    def load(cls, directory: str, name: str, meta: Dict, mmap: bool = True) -> 'EmbeddingStore':
+        mode = 'r' if mmap else None
+        matrix = np.load(os.path.join(directory, f'{name}.npy'), mmap_mode=mode)
+        scales = None
+        if meta['dtype'] == 'int8':
+            scales = np.load(os.path.join(directory, f'{name}.scales.npy'), mmap_mode=mode)
+        return cls(meta['keys'], matrix, meta['dtype'], scales, meta.get('dim'))
+
+
+def evaluate_recall(reference, store: EmbeddingStore, queries=None, k: int = 10,
+                    sample: int = 1000, seed: int = 0) -> Dict:
+    """
+    Đo mức mất chính xác của store so với reference (vector float đầy đủ, cùng thứ tự khóa).
+
+    Truy vấn mặc định là một mẫu ngẫu nhiên các hàng của reference. Trả về
+    recall@k trung bình (tỉ lệ top-k đúng còn nằm trong top-k của store), sai
+    số cosine tuyệt đối và dung lượng so với float64 / float32.
+    """
+    reference = normalize_rows(reference)
+    rows = len(reference)
+    if not rows:
+        return {'recall_at_k': 1.0, 'k': k, 'queries': 0}
+    if queries is None:
+        rng = np.random.default_rng(seed)
+        picked = rng.choice(rows, size=min(sample, rows), replace=False)
+        queries = reference[picked]
+    queries = normalize_rows(queries)
+    k = min(k, rows)
+
+    hits = []
+    max_error = 0.0
+    total_error = 0.0
+    # Theo lô truy vấn để ma trận điểm tạm không vượt (lô x số hàng)
+    for start in range(0, len(queries), 64):
+        batch = queries[start:start + 64]
+        exact = batch @ reference.T
+        approx = store.similarities(batch)
+        exact_top = np.argpartition(-exact, k - 1, axis=1)[:, :k]
+        approx_top = np.argpartition(-approx, k - 1, axis=1)[:, :k]
+        hits.extend(len(np.intersect1d(e, a, assume_unique=True)) for e, a in zip(exact_top, approx_top))
+        error = np.abs(exact - approx)
+        max_error = max(max_error, float(error.max()))
+        total_error += float(error.sum())
+    return {
+        'dtype': store.dtype,
+        'k': k,
+        'queries': len(queries),
+        'recall_at_k': round(float(np.mean(hits)) / k, 4),
+        'max_abs_error': round(max_error, 6),
+        'mean_abs_error': round(total_error / (len(queries) * rows), 6),
+        'bytes': store.nbytes,
+        'float64_bytes': rows * store.dim * 8,
+        'float32_bytes': rows * store.dim * 4,
+    }
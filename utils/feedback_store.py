@@ -0,0 +1,126 @@
+"""
+Lưu phản hồi của người dùng về giá trị gợi ý (giá trị nào đã được chọn).
+
+Dữ liệu gồm hai phần:
+    - log chỉ ghi thêm (JSON Lines), mỗi phản hồi một dòng, không bao giờ
+      ghi lại toàn bộ file;
+    - bảng đếm trong bộ nhớ (user_id, tên trường chuẩn hóa) -> {giá trị: [số lần
+      chọn, thời điểm dùng gần nhất]}, cập nhật O(1) cho mỗi phản hồi.
+
+Mỗi worker đọc tiếp phần log mà worker khác vừa ghi (theo offset) trước khi
+trả lời truy vấn, nên phản hồi có hiệu lực ngay cho mọi tiến trình.
+"""
+import os
+import json
+import time
+import logging
+import threading
+import unicodedata
+from typing import Dict, List, Optional, Tuple
+
+from config.config import FEEDBACK_LOG_PATH
+
+logger = logging.getLogger(__name__)
+
+
+def _field_key(field_name: str) -> str:
+    """Khóa trường; bộ so khớp truyền vào tên đã chuẩn hóa theo từ đồng nghĩa"""
+    return " ".join(unicodedata.normalize('NFC', (field_name or '').lower()).split())
+
+
+class FeedbackStore:
+    """Bảng đếm số lần chấp nhận giá trị gợi ý theo người dùng và trường"""
+
+    def __init__(self, log_path: str = FEEDBACK_LOG_PATH):
+        self.log_path = log_path
+        self._counts: Dict[Tuple[Optional[str], str], Dict[str, List[float]]] = {}
+        self._offset = 0
+        self._inode = None
+        self._lock = threading.Lock()
+        self._sync()
+
+    @staticmethod
+    def _user_key(user_id) -> Optional[str]:
+        return str(user_id) if user_id is not None else None
+
+    def _apply(self, user_key: Optional[str], field_key: str, value: str, timestamp: float):
+        values = self._counts.setdefault((user_key, field_key), {})
+        entry = values.get(value)
+        if entry is None:
+            values[value] = [1, timestamp]
+        else:
+            entry[0] += 1
+            entry[1] = max(entry[1], timestamp)
+
+    def _sync(self):
+        """Đọc các dòng log mới được ghi thêm kể từ lần đọc trước"""
+        try:
+            if not os.path.exists(self.log_path):
+                return
+            stat = os.stat(self.log_path)
+            if stat.st_size == self._offset and stat.st_ino == self._inode:
+                return
+            with self._lock:
+                if stat.st_size < self._offset or (self._inode is not None and stat.st_ino != self._inode):
+                    # Log bị cắt ngắn hoặc thay bằng file mới: đọc lại từ đầu
+                    logger.info(f"Log phản hồi {self.log_path} đã thay đổi, nạp lại từ đầu")
+                    self._counts.clear()
+                    self._offset = 0
+                self._inode = stat.st_ino
+                with open(self.log_path, 'r', encoding='utf-8') as f:
+                    f.seek(self._offset)
+                    while True:
+                        line = f.readline()
+                        if not line or not line.endswith('\n'):
+                            break  # dòng đang ghi dở, đọc lại ở lần sau
+                        self._offset = f.tell()
+                        try:
+                            record = json.loads(line)
+                            self._apply(record.get('user_id'), record['field'], record['value'], record['ts'])
+                        except (ValueError, KeyError) as e:
+                            logger.warning(f"Bỏ qua dòng phản hồi lỗi: {e}")
+        except OSError as e:
+            logger.error(f"Không đọc được log phản hồi: {e}")
+
+    def record(self, user_id, field_name: str, value: str) -> None:
+        """Ghi nhận người dùng đã chọn value cho field_name"""
+        value = str(value).strip()
+        field_key = _field_key(field_name)
+        if not value or not field_key:
+            return
+        record = {'user_id': self._user_key(user_id), 'field': field_key, 'value': value, 'ts': time.time()}
+
+        with self._lock:
+            with open(self.log_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        # Bảng đếm được cập nhật khi đọc lại log (gồm cả dòng của worker khác)
+        self._sync()
+
+    def get_values(self, user_id, field_name: str) -> Dict[str, List[float]]:
+        """Trả về {giá trị: [số lần chọn, thời điểm dùng gần nhất]} của người dùng cho trường"""
+        self._sync()
+        return dict(self._counts.get((self._user_key(user_id), _field_key(field_name)), {}))
+
+    @staticmethod
+    def entry_score(entry: List[float]) -> float:
+        """Điểm ưu tiên trong [0, 1] từ [số lần chọn, thời điểm dùng gần nhất]"""
+        count, last_used = entry
+        age_days = max(0.0, (time.time() - last_used) / 86400)
+        recency = 1.0 / (1.0 + age_days / 30)
+        return min(count, 5) / 5 * 0.7 + 0.3 * recency
+
+    def score(self, user_id, field_name: str, value: str) -> float:
+        """Điểm ưu tiên của một giá trị dựa trên số lần chọn và độ mới"""
+        entry = self.get_values(user_id, field_name).get(str(value).strip())
+        return self.entry_score(entry) if entry else 0.0
+
+
+_store = None
+
+
+def get_feedback_store() -> FeedbackStore:
+    """FeedbackStore dùng chung trong tiến trình"""
+    global _store
+    if _store is None:
+        _store = FeedbackStore()
+    return _store
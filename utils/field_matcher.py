@@ -2,87 +2,98 @@ import numpy as np
 import re
 import nltk
 from nltk.corpus import stopwords
-from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
-from gensim.models import Word2Vec
 import os
-import json
 from typing import List, Dict, Optional, Tuple, Set, Union, Any
-from collections import defaultdict
-import difflib
+from collections import Counter, defaultdict
 import unicodedata
-from sentence_transformers import SentenceTransformer
+from utils.model_registry import get_sentence_transformer, DEFAULT_SBERT_MODEL
 from config.config import FORM_HISTORY_PATH
+from utils.feedback_store import FeedbackStore, get_feedback_store
+from utils.json_store import update_json, read_json
+from utils.history_snapshot import get_history_snapshot
+from utils.model_snapshot import get_model_snapshot_store
+from utils.fuzzy_kernel import FuzzyIndex, similarity as fuzzy_similarity
+from utils.field_ontology import get_field_ontology
+from utils.embedding_store import EmbeddingStore, normalize_rows
+
+# Số trường ứng viên tối đa (mỗi trường cần so khớp) được chấm bằng TF-IDF/Word2Vec/SBERT
+BLOCKING_TOP_K = int(os.environ.get('MATCH_BLOCKING_TOP_K', '20'))
+
+class FieldLookupIndex:
+    """
+    Chỉ mục gần đúng và cấu trúc blocking trên tên đã chuẩn hóa của mọi trường.
+
+    Chỉ phụ thuộc danh sách tên trường nên được dựng một lần cho mỗi ảnh chụp
+    mô hình (MatcherModels.derived) và dùng chung cho mọi EnhancedFieldMatcher.
+    """
+
+    def __init__(self, field_names: List[str], normalize):
+        labels = []
+        self.positions: Dict[str, int] = {}
+        label_positions = {}
+        for field_name in field_names:
+            label = normalize(field_name)
+            if label not in label_positions:
+                label_positions[label] = len(labels)
+                labels.append(label)
+            self.positions[field_name] = label_positions[label]
+        self.fuzzy = FuzzyIndex(labels)
+
+        # Chỉ mục ngược từ -> nhãn, nhóm đồng nghĩa -> nhãn và độ dài nhãn cho bước blocking
+        ontology = get_field_ontology()
+        self.label_tokens = [set(label.split()) for label in labels]
+        self.token_postings = defaultdict(set)
+        self.synonym_buckets = defaultdict(set)
+        for position, label in enumerate(labels):
+            for token in self.label_tokens[position]:
+                self.token_postings[token].add(position)
+            for target in ontology.classes(label):
+                self.synonym_buckets[target].add(position)
+        self.label_lengths = np.array([len(label) for label in labels], dtype=np.int32)
+
 
 class EnhancedFieldMatcher:
     def __init__(self, form_history_path: str):
         self.form_history_path = form_history_path
         self.user_preferences = defaultdict(dict)
+        self.ontology = get_field_ontology()
         self.synonym_map = self._build_synonym_map()
         self.stop_words = self._initialize_stopwords()
         self.field_name_cache = {}
         self.field_value_mapping = defaultdict(list)
         self.vectorizer = None
-        self.word2vec_model = None
+        self.word_vectors = None
+        self.models_key = None
+        self._models = None
+        self._sbert_store = None
+        self.sbert_vector_cache = {}
         self.field_vectors = None
         self.field_names = []
-        self.field_embeddings = {}
+        self.field_embeddings: Optional[EmbeddingStore] = None
         self.matched_fields = {}
         self.similarity_cache = {}
         self.processed_text_cache = {}
+        self.normalized_name_cache = {}
+        self._lookup_index: Optional[FieldLookupIndex] = None
+        self._fuzzy_positions = {}
         self.field_index = defaultdict(list)
-        self.sbert_model = SentenceTransformer('all-MiniLM-L6-v2', device='cpu')
+        self.match_stats = Counter()
+        self.sbert_model = get_sentence_transformer()
+        self.feedback_store = get_feedback_store()
         
-        self.form_history = self._load_form_history()
+        # Lịch sử JSON chỉ được đọc khi cần (ghi thêm, hoặc không có ảnh chụp dạng cột)
+        self._form_history = None
+        self._history_version = None
+        self._snapshot = self._history_snapshot()
         self._load_user_preferences()
         self._build_field_value_mapping()
         self._build_field_index()
         self._build_models()
 
     def _build_synonym_map(self) -> Dict[str, List[str]]:
-        raw_map = {
-            'họ tên': [
-                'hovaten', 'ho va ten', 'ho và tên', 'hoten', 'họ_tên', 'tên', 
-                'họ và tên', 'fullname', 'full name', 'name', 'your name', 'tên đầy đủ'
-            ],
-            'địa chỉ': [
-                'diachi', 'địa_chỉ', 'địa chỉ', 'address', 'place', 'location', 
-                'home address', 'residence', 'chỗ ở', 'nơi ở', 'current address', 'address line'
-            ],
-            'điện thoại': [
-                'sdt', 'so_dien_thoai', 'so dien thoai', 'đt', 'phone', 'tel', 
-                'telephone', 'mobile', 'mobile phone', 'phone number', 'số điện thoại', 'contact number'
-            ],
-            'email': [
-                'e-mail', 'mail', 'email address', 'email', 'địa chỉ email', 'thư điện tử'
-            ],
-            'ngày sinh': [
-                "ngày sinh", "dob", "birth date", "birthdate", "date of birth", 
-                "d.o.b", "ngay_sinh", "birth"
-            ],
-            'giới tính': [
-                'gender', 'sex', 'gioi_tinh', 'gioi tinh', 'giới tính', 'male/female'
-            ],
-            'mã số thuế': [
-                'tax code', 'mã thuế', 'mst', 'tax id'
-            ],
-            'quốc tịch': [
-                'nationality', 'country'
-            ],
-            'thành phố': [
-                'city', 'tỉnh thành', 'tỉnh/thành phố'
-            ],
-            'quận huyện': [
-                'district', 'huyện', 'quận'
-            ],
-            'phường xã': [
-                'ward', 'xã', 'phường'
-            ],
-            'chuyên nghành': [
-                'học nghành', 'nghành'
-            ]
-        }
-        return raw_map
+        """Dạng chuẩn -> từ đồng nghĩa, lấy từ ontology lớp trường dùng chung"""
+        return self.ontology.synonym_map()
 
     def _initialize_stopwords(self) -> Set[str]:
         english_stopwords = set(stopwords.words('english'))
@@ -95,25 +106,76 @@ class EnhancedFieldMatcher:
         return english_stopwords.union(vietnamese_stopwords)
 
     def _load_form_history(self) -> List[Dict]:
+        self._history_version = None
         try:
-            if os.path.exists(self.form_history_path):
-                with open(self.form_history_path, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    return data
-            return []
+            data, self._history_version = read_json(self.form_history_path, [])
+            return data
         except Exception as e:
             print(f"Unexpected error loading form history: {str(e)}")
             return []
 
+    @property
+    def form_history(self) -> List[Dict]:
+        """Toàn bộ lịch sử dạng JSON, đọc ở lần truy cập đầu tiên"""
+        if self._form_history is None:
+            self._form_history = self._load_form_history()
+        return self._form_history
+
+    @form_history.setter
+    def form_history(self, value: List[Dict]):
+        self._form_history = value
+
+    def _history_snapshot(self):
+        """
+        Ảnh chụp dạng cột của lịch sử (đọc bằng memory map), None nếu không dùng được.
+
+        Khi ảnh chụp trên đĩa khớp phiên bản file lịch sử thì không phải đọc JSON.
+        """
+        try:
+            return get_history_snapshot(self.form_history_path, self._form_history, self._history_version)
+        except Exception as e:
+            print(f"Không dùng được ảnh chụp lịch sử, duyệt JSON: {e}")
+            return None
+
+    def _use_snapshot(self) -> bool:
+        """Dùng ảnh chụp khi chưa đọc JSON (sau khi đọc/ghi thêm, bản JSON trong bộ nhớ mới hơn)"""
+        return self._snapshot is not None and self._form_history is None
+
+    def history_record(self, index: int) -> Optional[Dict]:
+        """Bản ghi thứ index của lịch sử (thứ tự như trong field_index), None nếu ngoài phạm vi"""
+        if self._use_snapshot():
+            return self._snapshot.record(index) if 0 <= index < len(self._snapshot) else None
+        history = self.form_history
+        record = history[index] if 0 <= index < len(history) else None
+        return record if isinstance(record, dict) else None
+
+    def _user_records(self, user_id) -> List[Dict]:
+        """Các bản ghi của người dùng theo thứ tự lịch sử (không có người dùng: không gợi ý từ lịch sử)"""
+        if user_id is None:
+            return []
+        if self._use_snapshot():
+            return self._snapshot.user_records(user_id)
+        return [record for record in self.form_history
+                if isinstance(record, dict) and str(record.get("user_id")) == str(user_id)]
+
     def _build_field_value_mapping(self):
         special_fields = {'form_id', 'document_name'}
+        snapshot = self._snapshot
+        if self._use_snapshot():
+            for field_name, val_str in snapshot.field_values(exclude=special_fields):
+                self.field_value_mapping[field_name].append(val_str)
+            return
         for form in self.form_history:
             if isinstance(form, dict) and 'form_data' in form:
                 for field_name, value in form['form_data'].items():
-                    if field_name not in special_fields and value and (val_str := str(value).strip()):
+                    if field_name not in special_fields and value is not None and (val_str := str(value).strip()):
                         self.field_value_mapping[field_name].append(val_str)
 
     def _build_field_index(self):
+        if self._use_snapshot():
+            for idx, field_name in self._snapshot.field_keys():
+                self.field_index[self._normalize_field_name(field_name)].append((idx, field_name))
+            return
         for idx, form in enumerate(self.form_history):
             if isinstance(form, dict) and 'form_data' in form:
                 for field_name in form['form_data'].keys():
@@ -121,12 +183,21 @@ class EnhancedFieldMatcher:
                     self.field_index[normalized_field].append((idx, field_name))
 
     def _load_user_preferences(self):
+        snapshot = self._snapshot
+        if self._use_snapshot():
+            for user_id, fields in snapshot.user_value_counts().items():
+                for field_name, values in fields.items():
+                    self.user_preferences[user_id][field_name] = {
+                        'count': sum(values.values()),
+                        'values': defaultdict(int, values)
+                    }
+            return
         for form in self.form_history:
             if isinstance(form, dict) and 'user_id' in form:
                 user_id = form['user_id']
                 if 'form_data' in form:
                     for field_name, value in form['form_data'].items():
-                        if value and str(value).strip():
+                        if value is not None and str(value).strip():
                             if field_name not in self.user_preferences[user_id]:
                                 self.user_preferences[user_id][field_name] = {
                                     'count': 0,
@@ -142,9 +213,7 @@ class EnhancedFieldMatcher:
             return self.processed_text_cache[text]
         normalized = unicodedata.normalize('NFC', text.lower())
         cleaned = re.sub(r'[^\w\sáàảãạăắằẳẵặâấầẩẫậéèẻẽẹêếềểễệíìỉĩịóòỏõọôốồổỗộơớờởỡợúùủũụưứừửữựýỳỷỹỵđ]', ' ', normalized)
-        for target, synonyms in sorted(self.synonym_map.items(), key=lambda x: len(x[0]), reverse=True):
-            for synonym in sorted(synonyms, key=len, reverse=True):
-                cleaned = re.sub(r'\b' + re.escape(synonym) + r'\b', target, cleaned)
+        cleaned = self.ontology.canonicalize(cleaned)
         tokens = cleaned.split()
         filtered_tokens = [token for token in tokens if token not in self.stop_words]
         result = ' '.join(filtered_tokens)
@@ -154,59 +223,151 @@ class EnhancedFieldMatcher:
     def _normalize_field_name(self, text: str) -> str:
         if not text:
             return ""
-        text = unicodedata.normalize('NFC', text.lower())
-        synonym_items = sorted(self.synonym_map.items(), key=lambda x: max(len(s) for s in x[1]), reverse=True)
-        for target, synonyms in synonym_items:
-            for synonym in sorted(synonyms, key=len, reverse=True):
-                text = re.sub(r'\b' + re.escape(synonym) + r'\b', target, text)
+        cached = self.normalized_name_cache.get(text)
+        if cached is not None:
+            return cached
+        original = text
+        text = self.ontology.canonicalize(text)
         text = re.sub(r'[^\w\sáàảãạăắằẳẵặâấầẩẫậéèẻẽẹêếềểễệíìỉĩịóòỏõọôốồổỗộơớờởỡợúùủũụưứừửữựýỳỷỹỵđ]', ' ', text)
         tokens = [token for token in text.split() if token not in self.stop_words]
-        return ' '.join(tokens).strip()
+        result = ' '.join(tokens).strip()
+        self.normalized_name_cache[original] = result
+        return result
 
     def _build_models(self):
-        processed_fields = []
-        field_names = []
-        for form in self.form_history:
-            if isinstance(form, dict) and 'form_data' in form:
-                for field_name in form['form_data'].keys():
-                    if field_name not in self.field_name_cache:
-                        processed = self._preprocess_text(field_name)
-                        self.field_name_cache[field_name] = processed
-                        processed_fields.append(processed)
-                        field_names.append(field_name)
-        
+        """
+        Gắn TF-IDF, Word2Vec và embedding trường cho toàn bộ tên trường trong lịch sử.
+
+        Mô hình được lấy từ ảnh chụp theo khóa của danh sách tên trường (nạp bằng
+        mmap, dùng chung giữa các matcher và worker); chỉ huấn luyện khi tập tên
+        trường thay đổi.
+        """
+        if self._use_snapshot():
+            # Từ điển tên trường của ảnh chụp giữ thứ tự xuất hiện đầu tiên, như khi duyệt JSON
+            history_fields = self._snapshot.fields
+        else:
+            history_fields = (field_name for form in self.form_history
+                              if isinstance(form, dict) and isinstance(form.get('form_data'), dict)
+                              for field_name in form['form_data'])
+        for field_name in history_fields:
+            if field_name not in self.field_name_cache:
+                self.field_name_cache[field_name] = self._preprocess_text(field_name)
+
+
+        field_names = list(self.field_name_cache)
+        processed_fields = [self.field_name_cache[field_name] for field_name in field_names]
         if processed_fields:
-            self.vectorizer = TfidfVectorizer()
-            self.field_vectors = self.vectorizer.fit_transform(processed_fields)
-            self.field_names = field_names
-            sentences = [field.split() for field in processed_fields if field.split()]
-            if sentences:
-                self.word2vec_model = Word2Vec(
-                    sentences, 
-                    vector_size=100, 
-                    window=5, 
-                    min_count=1, 
-                    workers=4,
-                    epochs=20
-                )
-                for field, processed in zip(field_names, processed_fields):
-                    tokens = processed.split()
-                    if tokens:
-                        embeddings = [self.word2vec_model.wv[token] for token in tokens if token in self.word2vec_model.wv]
-                        if embeddings:
-                            self.field_embeddings[field] = np.mean(embeddings, axis=0)
+            models = get_model_snapshot_store().get(field_names, processed_fields)
+            self._models = models
+            self._sbert_store = None
+            self.models_key = models.key
+            self.vectorizer = models.vectorizer
+            self.field_vectors = models.field_vectors
+            self.field_names = models.field_names
+            self.word_vectors = models.word_vectors
+            self.field_embeddings = models.field_embeddings
+        self._lookup_index = None  # lấy lại theo tập tên trường mới ở lần so khớp kế tiếp
+
+    def _get_lookup_index(self) -> FieldLookupIndex:
+        """Chỉ mục gần đúng / blocking của ảnh chụp mô hình hiện tại (dựng một lần, dùng chung)"""
+        if self._lookup_index is None:
+            if self._models is not None:
+                index = self._models.derived(
+                    'lookup_index', lambda models: FieldLookupIndex(models.field_names, self._normalize_field_name))
+            else:
+                index = FieldLookupIndex(list(self.field_name_cache), self._normalize_field_name)
+            self._fuzzy_positions = index.positions
+            self._lookup_index = index
+        return self._lookup_index
+
+    def _get_fuzzy_index(self) -> FuzzyIndex:
+        """Chỉ mục so khớp gần đúng trên tên đã chuẩn hóa của mọi trường trong lịch sử"""
+        return self._get_lookup_index().fuzzy
+
+    def _synonym_classes(self, normalized: str) -> Set[str]:
+        """Các lớp trường của ontology xuất hiện trong tên đã chuẩn hóa"""
+        return set(self.ontology.classes(normalized))
+
+    def _block_candidates(self, normalized: str, fuzzy_scores: np.ndarray, top_k: int = BLOCKING_TOP_K) -> Set[int]:
+        """
+        Bước lọc rẻ trước khi chấm điểm đầy đủ: trả về vị trí các nhãn được giữ lại.
+
+        Ứng viên là nhãn có chung từ (chỉ mục ngược), cùng nhóm đồng nghĩa, hoặc
+        có độ dài gần với truy vấn. Điểm lọc = điểm gần đúng + Jaccard theo từ +
+        0.5 nếu cùng nhóm đồng nghĩa; chỉ giữ top_k nhãn cao nhất.
+        """
+        if not len(fuzzy_scores):
+            return set()
+        index = self._get_lookup_index()
+        bonus = np.zeros(len(fuzzy_scores), dtype=np.float64)
+        matched = np.zeros(len(fuzzy_scores), dtype=bool)
+
+        tokens = set(normalized.split())
+        overlap = Counter()
+        for token in tokens:
+            for position in index.token_postings.get(token, ()):
+                overlap[position] += 1
+        for position, shared in overlap.items():
+            bonus[position] += shared / len(tokens | index.label_tokens[position])
+            matched[position] = True
+        for target in self._synonym_classes(normalized):
+            for position in index.synonym_buckets.get(target, ()):
+                bonus[position] += 0.5
+                matched[position] = True
+
+        query_length = len(normalized)
+        in_band = np.abs(index.label_lengths - query_length) <= np.maximum(
+            3, 0.5 * np.maximum(index.label_lengths, query_length))
+        scores = np.where(matched | in_band, fuzzy_scores + bonus, -np.inf)
+
+        k = min(top_k, int(np.isfinite(scores).sum()))
+        if k <= 0:
+            return set()
+        return set(np.argpartition(-scores, k - 1)[:k].tolist())
+
+    def _fuzzy_scores(self, text: str) -> np.ndarray:
+        """Điểm gần đúng của text với mọi nhãn trong chỉ mục, tính trong một lần gọi"""
+        return self._get_fuzzy_index().scores(self._normalize_field_name(text))
+
+    def _fuzzy_score_of(self, scores: Optional[np.ndarray], field_name: str) -> Optional[float]:
+        position = self._fuzzy_positions.get(field_name)
+        return float(scores[position]) if scores is not None and position is not None else None
 
     def _calculate_sbert_similarity(self, text1: str, text2: str) -> float:
         cache_key = f"sbert_{text1}||{text2}"
         if cache_key in self.similarity_cache:
             return self.similarity_cache[cache_key]
-        vec1 = self.sbert_model.encode([text1])[0]
-        vec2 = self.sbert_model.encode([text2])[0]
-        similarity = cosine_similarity([vec1], [vec2])[0][0]
+        self.match_stats['sbert'] += 1
+        query = self._sbert_vector(text1)
+        store = self._get_sbert_store()
+        # Trường trong lịch sử đã có vector chuẩn hóa sẵn trong kho: cosine là một tích vô hướng
+        similarity = store.similarity(text2, query) if store is not None else None
+        if similarity is None:
+            similarity = float(np.dot(query, self._sbert_vector(text2)))
         self.similarity_cache[cache_key] = similarity
         return similarity
 
-    def _calculate_similarity(self, text1: str, text2: str) -> float:
+    def _sbert_vector(self, text: str) -> np.ndarray:
+        """Vector SBERT đã chuẩn hóa của một chuỗi ngoài kho (có nhớ đệm)"""
+        vector = self.sbert_vector_cache.get(text)
+        if vector is None:
+            vector = normalize_rows(self.sbert_model.encode([text])[0])[0]
+            self.sbert_vector_cache[text] = vector
+        return vector
+
+    def _get_sbert_store(self) -> Optional[EmbeddingStore]:
+        """Embedding SBERT của mọi tên trường trong lịch sử, mã hóa một lần và lưu cùng ảnh chụp mô hình"""
+        if self._sbert_store is None and self._models is not None:
+            try:
+                self._sbert_store = get_model_snapshot_store().sbert_embeddings(
+                    self._models, DEFAULT_SBERT_MODEL,
+                    lambda texts: self.sbert_model.encode(texts, batch_size=64, show_progress_bar=False))
+            except Exception as e:
+                print(f"Không dựng được kho embedding SBERT, mã hóa từng cặp: {e}")
+                self._sbert_store = False
+        return self._sbert_store or None
+
+    def _calculate_similarity(self, text1: str, text2: str, seq_sim: Optional[float] = None) -> float:
         cache_key = f"{text1}||{text2}"
         if cache_key in self.similarity_cache:
             return self.similarity_cache[cache_key]
@@ -218,7 +379,9 @@ class EnhancedFieldMatcher:
             self.similarity_cache[cache_key] = 1.0
             return 1.0
         
-        seq_sim = difflib.SequenceMatcher(None, norm1, norm2).quick_ratio()
+        # seq_sim có thể được tính sẵn theo lô bằng FuzzyIndex
+        if seq_sim is None:
+            seq_sim = fuzzy_similarity(norm1, norm2, self._get_fuzzy_index().method)
         tfidf_sim = 0.0
         if seq_sim < 0.8 and self.vectorizer and self.field_vectors is not None:
             query_vec = self.vectorizer.transform([self._preprocess_text(text1)])
@@ -226,14 +389,14 @@ class EnhancedFieldMatcher:
             tfidf_sim = cosine_similarity(query_vec, target_vec)[0][0]
         
         w2v_sim = 0.0
-        if seq_sim < 0.8 and tfidf_sim < 0.8 and self.word2vec_model:
+        if seq_sim < 0.8 and tfidf_sim < 0.8 and self.word_vectors is not None:
             tokens1 = self._preprocess_text(text1).split()
             tokens2 = self._preprocess_text(text2).split()
             if tokens1 and tokens2:
-                valid_tokens1 = [t for t in tokens1 if t in self.word2vec_model.wv]
-                valid_tokens2 = [t for t in tokens2 if t in self.word2vec_model.wv]
+                valid_tokens1 = [t for t in tokens1 if t in self.word_vectors]
+                valid_tokens2 = [t for t in tokens2 if t in self.word_vectors]
                 if valid_tokens1 and valid_tokens2:
-                    w2v_sim = self.word2vec_model.wv.n_similarity(valid_tokens1, valid_tokens2)
+                    w2v_sim = self.word_vectors.n_similarity(valid_tokens1, valid_tokens2)
         
         sbert_sim = 0.0
         if seq_sim < 0.8 and tfidf_sim < 0.8 and w2v_sim < 0.8:
@@ -248,6 +411,14 @@ class EnhancedFieldMatcher:
         boost = min(frequency / 10, 1.0)
         return base_score + 0.05 * boost
 
+    def _feedback_boost(self, feedback_values: Dict[str, List[float]], value: Any) -> float:
+        entry = feedback_values.get(str(value).strip()) if feedback_values else None
+        return 0.2 * FeedbackStore.entry_score(entry) if entry else 0.0
+
+    def record_feedback(self, field_name: str, value: str, user_id: Optional[int] = None) -> None:
+        """Ghi nhận giá trị người dùng đã chọn, có hiệu lực ngay cho xếp hạng gợi ý"""
+        self.feedback_store.record(user_id, self._normalize_field_name(field_name) or field_name, value)
+
     def _exact_token_match_boost(self, model_field: str, data_field: str) -> float:
         model_tokens = set(self._preprocess_text(model_field).split())
         data_tokens = set(self._preprocess_text(data_field).split())
@@ -276,14 +447,9 @@ class EnhancedFieldMatcher:
         if hasattr(self, cache_key):
             user_records = getattr(self, cache_key)
         else:
-            str_user_id = str(user_id) if user_id is not None else None
-            user_records = [record for record in self.form_history if str(record.get("user_id")) == str_user_id]
-            user_records = list(reversed(user_records))  # Prioritize recent records
+            user_records = list(reversed(self._user_records(user_id)))  # Prioritize recent records
             setattr(self, cache_key, user_records)
 
-        if not user_records:
-            return {}
-
         # Limit records to check for performance
         records_to_check = user_records[:5] if fast_mode else user_records[:10]
 
@@ -291,6 +457,17 @@ class EnhancedFieldMatcher:
             normalized_model = self._normalize_field_name(model_field)
             potential_matches = []
 
+            # Giá trị người dùng đã chọn từ gợi ý trước đây được ưu tiên
+            feedback_values = (self.feedback_store.get_values(user_id, normalized_model or model_field)
+                               if user_id is not None else {})
+            for value, entry in feedback_values.items():
+                key = (model_field, model_field, value)
+                if key in seen_matches:
+                    continue
+                similarity = 1.0 + 0.2 * FeedbackStore.entry_score(entry)
+                potential_matches.append((similarity, model_field, model_field, value))
+                seen_matches.add(key)
+
             # Use field_index for quick lookup
             if normalized_model in self.field_index:
                 for record_idx, data_field in self.field_index[normalized_model]:
@@ -298,17 +475,21 @@ class EnhancedFieldMatcher:
                         continue
                     form_data = records_to_check[record_idx].get("form_data", {})
                     value = form_data.get(data_field)
-                    if not value or not str(value).strip():
+                    if value is None or not str(value).strip():
                         continue
                     key = (model_field, data_field, value)
                     if key in seen_matches:
                         continue
                     similarity = 1.0  # Exact match via index
                     similarity += self._boost_by_frequency(data_field, similarity)
+                    similarity += self._feedback_boost(feedback_values, value)
                     potential_matches.append((similarity, model_field, data_field, value))
                     seen_matches.add(key)
 
             # Fallback to similarity calculation for non-indexed fields
+            fuzzy_scores = self._fuzzy_scores(model_field) if records_to_check else None
+            candidates = (self._block_candidates(normalized_model, fuzzy_scores)
+                          if fuzzy_scores is not None else None)
             for idx, record in enumerate(records_to_check):
                 form_data = record.get("form_data", {})
                 for data_field in form_data.keys():
@@ -316,11 +497,21 @@ class EnhancedFieldMatcher:
                         break
                     value = form_data[data_field]
                     key = (model_field, data_field, value)
-                    if key in seen_matches or not value or not str(value).strip():
+                    if key in seen_matches or value is None or not str(value).strip():
+                        continue
+                    seq_sim = self._fuzzy_score_of(fuzzy_scores, data_field)
+                    self.match_stats['pairs'] += 1
+                    # Bị loại ở bước blocking: không chấm bằng các mô hình đắt
+                    # (cặp có điểm gần đúng >= 0.8 vẫn đi tiếp vì chỉ dùng điểm rẻ)
+                    position = self._fuzzy_positions.get(data_field)
+                    if (candidates is not None and position is not None and position not in candidates
+                            and (seq_sim is None or seq_sim < 0.8)):
+                        self.match_stats['blocked'] += 1
                         continue
-                    similarity = self._calculate_similarity(model_field, data_field)
+                    similarity = self._calculate_similarity(model_field, data_field, seq_sim)
                     similarity += self._boost_by_frequency(data_field, similarity)
                     similarity += self._exact_token_match_boost(model_field, data_field)
+                    similarity += self._feedback_boost(feedback_values, value)
                     if similarity >= threshold:
                         potential_matches.append((similarity, model_field, data_field, value))
                         seen_matches.add(key)
@@ -340,6 +531,7 @@ class EnhancedFieldMatcher:
             if len(all_matches[model_field]) >= 3:
                 continue
 
+        all_matches = defaultdict(list, {field: matches for field, matches in all_matches.items() if matches})
         self.matched_fields = all_matches
         return all_matches
 
@@ -358,25 +550,13 @@ class EnhancedFieldMatcher:
                                 if similarities[i] > 0]
             
             w2v_results = []
-            if self.word2vec_model and self.field_embeddings:
+            if self.word_vectors is not None and self.field_embeddings:
                 query_tokens = processed_query.split()
                 if query_tokens:
-                    valid_tokens = [token for token in query_tokens if token in self.word2vec_model.wv]
+                    valid_tokens = [token for token in query_tokens if token in self.word_vectors]
                     if valid_tokens:
-                        query_embedding = np.mean([self.word2vec_model.wv[token] for token in valid_tokens], axis=0)
-                        similarities = {}
-                        for field, embedding in self.field_embeddings.items():
-                            if embedding is not None:
-                                sim = cosine_similarity(
-                                    query_embedding.reshape(1, -1), 
-                                    embedding.reshape(1, -1)
-                                )[0][0]
-                                similarities[field] = sim
-                        w2v_results = sorted(
-                            [(field, sim) for field, sim in similarities.items()], 
-                            key=lambda x: x[1], 
-                            reverse=True
-                        )[:top_n]
+                        query_embedding = np.mean([self.word_vectors[token] for token in valid_tokens], axis=0)
+                        w2v_results = self.field_embeddings.top_k(query_embedding, top_n)
             
             combined_results = defaultdict(float)
             for field, score in tfidf_results:
@@ -404,6 +584,11 @@ class EnhancedFieldMatcher:
                 user_values = self.user_preferences[user_id][field_name]['values']
                 for val, count in user_values.items():
                     all_values.append((val, count * 2.0))
+
+        if user_id is not None:
+            feedback_values = self.feedback_store.get_values(user_id, self._normalize_field_name(field_name) or field_name)
+            for val, entry in feedback_values.items():
+                all_values.append((val, 5.0 * FeedbackStore.entry_score(entry)))
         
         similar_fields = self.find_most_similar_field(field_name, top_n=3)
         for similar_field, _ in similar_fields:
@@ -434,7 +619,7 @@ class EnhancedFieldMatcher:
             
             self.form_history.append({'form_data': new_form_data, 'user_id': user_id})
             for field_name, value in new_form_data.items():
-                if value and str(value).strip():
+                if value is not None and str(value).strip():
                     val_str = str(value).strip()
                     self.field_value_mapping[field_name].append(val_str)
                     normalized_field = self._normalize_field_name(field_name)
@@ -449,7 +634,9 @@ class EnhancedFieldMatcher:
                         self.user_preferences[user_id][field_name]['values'][val_str] += 1
             
             self._build_models()
-            with open(self.form_history_path, 'w', encoding='utf-8') as f:
-                json.dump(self.form_history, f, ensure_ascii=False, indent=2)
+            # Nối thêm vào bản mới nhất trên đĩa thay vì ghi đè bằng bản trong bộ nhớ,
+            # để không làm mất bản ghi do worker khác vừa lưu
+            entry = self.form_history[-1]
+            update_json(self.form_history_path, lambda history: history.append(entry))
         except Exception as e:
             print(f"Error updating form history: {e}")
\ No newline at end of file
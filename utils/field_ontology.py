@@ -0,0 +1,320 @@
+"""
+Ontology các lớp trường biểu mẫu, dùng chung cho EnhancedFieldMatcher (chuẩn
+hóa tên trường theo từ đồng nghĩa) và AIFieldMatcher (nhận diện thông tin cá
+nhân).
+
+Mỗi lớp có:
+    canonical    dạng chuẩn mà bộ so khớp thay cho mọi từ đồng nghĩa
+    aliases      từ đồng nghĩa của bộ so khớp: được thay bằng canonical khi
+                 chuẩn hóa và dùng để nhóm tên trường ở bước blocking
+    keywords     từ khóa của bộ phân tích thông tin cá nhân (classify_personal)
+    personal     lớp thuộc thông tin cá nhân
+    sensitivity  mức độ nhạy cảm (high / medium / low)
+
+Hai bộ từ được giữ tách riêng như hai từ điển cũ mà chúng thay thế: từ khóa
+của bộ phân tích không làm thay đổi cách bộ so khớp chuẩn hóa tên (vd. "tên
+ngân hàng" vẫn thành "họ tên ngân hàng"), và từ đồng nghĩa của bộ so khớp
+không làm một trường thành thông tin cá nhân (vd. "country", "location").
+
+Mỗi bộ từ được tách từ (chữ thường, NFC, bỏ dấu câu) rồi biên dịch một lần
+thành trie theo từ. Tra một nhãn là một lượt quét trái sang phải, lấy cụm dài
+nhất tại mỗi vị trí: chi phí chỉ phụ thuộc độ dài nhãn, không phụ thuộc số từ
+khóa; kết quả theo nhãn được nhớ đệm nên nhãn lặp lại tra cứu O(1).
+
+Khác với hai từ điển cũ: so khớp theo nguyên từ thay vì chuỗi con, mỗi vị trí
+chỉ được thay một lần (không thay dây chuyền kiểu "họ và tên" -> "họ tên" ->
+"họ họ tên"), và bộ phân tích chọn cụm dài nhất thay vì lớp khai báo trước
+("địa chỉ email" là email, không phải địa chỉ).
+"""
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+_NON_WORD = re.compile(r'[^\w]+')
+_CACHE_LIMIT = 50000
+
+# id lớp -> đặc tả; thứ tự khai báo quyết định lớp thắng khi một cụm thuộc nhiều lớp.
+# aliases là synonym_map cũ của EnhancedFieldMatcher, keywords là danh sách
+# personal_fields cũ của AIFieldMatcher._analyze_personal_info.
+FIELD_CLASSES = OrderedDict([
+    ('họ tên', {
+        'canonical': 'họ tên',
+        'aliases': ['hovaten', 'ho va ten', 'ho và tên', 'hoten', 'họ_tên', 'tên', 'họ và tên',
+                    'fullname', 'full name', 'name', 'your name', 'tên đầy đủ'],
+        'keywords': ['họ và tên', 'họ tên', 'tên', 'name', 'full name'],
+        'personal': True,
+        'sensitivity': 'medium',
+    }),
+    ('địa chỉ', {
+        'canonical': 'địa chỉ',
+        'aliases': ['diachi', 'địa_chỉ', 'địa chỉ', 'address', 'place', 'location', 'home address',
+                    'residence', 'chỗ ở', 'nơi ở', 'current address', 'address line'],
+        'keywords': ['địa chỉ', 'address', 'nơi ở', 'chỗ ở', 'địa chỉ thường trú', 'địa chỉ tạm trú'],
+        'personal': True,
+        'sensitivity': 'medium',
+    }),
+    ('số điện thoại', {
+        'canonical': 'điện thoại',
+        'aliases': ['sdt', 'so_dien_thoai', 'so dien thoai', 'đt', 'phone', 'tel', 'telephone', 'mobile',
+                    'mobile phone', 'phone number', 'số điện thoại', 'contact number'],
+        'keywords': ['điện thoại', 'phone', 'số điện thoại', 'di động', 'mobile', 'tel', 'số di động'],
+        'personal': True,
+        'sensitivity': 'high',
+    }),
+    ('email', {
+        'canonical': 'email',
+        'aliases': ['e-mail', 'mail', 'email address', 'email', 'địa chỉ email', 'thư điện tử'],
+        'keywords': ['email', 'thư điện tử', 'mail', 'e-mail', 'địa chỉ email'],
+        'personal': True,
+        'sensitivity': 'high',
+    }),
+    ('ngày sinh', {
+        'canonical': 'ngày sinh',
+        'aliases': ['ngày sinh', 'dob', 'birth date', 'birthdate', 'date of birth', 'd.o.b', 'ngay_sinh',
+                    'birth'],
+        'keywords': ['ngày sinh', 'sinh ngày', 'birthday', 'date of birth', 'dob', 'ngày tháng năm sinh'],
+        'personal': True,
+        'sensitivity': 'high',
+    }),
+    ('giới tính', {
+        'canonical': 'giới tính',
+        'aliases': ['gender', 'sex', 'gioi_tinh', 'gioi tinh', 'giới tính', 'male/female'],
+        'keywords': ['giới tính', 'gender', 'sex', 'nam/nữ', 'nam nữ'],
+        'personal': True,
+        'sensitivity': 'low',
+    }),
+    ('mã số thuế', {
+        'canonical': 'mã số thuế',
+        'aliases': ['tax code', 'mã thuế', 'mst', 'tax id'],
+        'keywords': ['mã số thuế', 'tax', 'tax code', 'tax id', 'mst'],
+        'personal': True,
+        'sensitivity': 'low',
+    }),
+    ('quốc tịch', {
+        'canonical': 'quốc tịch',
+        'aliases': ['nationality', 'country'],
+        'keywords': ['quốc tịch', 'nationality', 'quốc gia', 'công dân'],
+        'personal': True,
+        'sensitivity': 'low',
+    }),
+    ('cmnd', {
+        'canonical': 'cmnd',
+        'aliases': [],
+        'keywords': ['cmnd', 'cccd', 'căn cước', 'chứng minh', 'id card', 'identity', 'số cmnd', 'số căn cước'],
+        'personal': True,
+        'sensitivity': 'high',
+    }),
+    ('nghề nghiệp', {
+        'canonical': 'nghề nghiệp',
+        'aliases': [],
+        'keywords': ['nghề nghiệp', 'nghề', 'công việc', 'occupation', 'job', 'profession', 'chức vụ', 'vị trí'],
+        'personal': True,
+        'sensitivity': 'low',
+    }),
+    ('học vấn', {
+        'canonical': 'học vấn',
+        'aliases': [],
+        'keywords': ['học vấn', 'trình độ', 'bằng cấp', 'education', 'degree', 'trình độ học vấn'],
+        'personal': True,
+        'sensitivity': 'low',
+    }),
+    ('tôn giáo', {
+        'canonical': 'tôn giáo',
+        'aliases': [],
+        'keywords': ['tôn giáo', 'religion', 'đạo'],
+        'personal': True,
+        'sensitivity': 'low',
+    }),
+    ('dân tộc', {
+        'canonical': 'dân tộc',
+        'aliases': [],
+        'keywords': ['dân tộc', 'ethnicity', 'ethnic'],
+        'personal': True,
+        'sensitivity': 'low',
+    }),
+    ('số tài khoản', {
+        'canonical': 'số tài khoản',
+        'aliases': [],
+        'keywords': ['số tài khoản', 'tài khoản', 'account', 'account number', 'stk', 'bank account'],
+        'personal': True,
+        'sensitivity': 'high',
+    }),
+    ('ngân hàng', {
+        'canonical': 'ngân hàng',
+        'aliases': [],
+        'keywords': ['ngân hàng', 'bank', 'tên ngân hàng', 'chi nhánh'],
+        'personal': True,
+        'sensitivity': 'low',
+    }),
+    ('hộ chiếu', {
+        'canonical': 'hộ chiếu',
+        'aliases': [],
+        'keywords': ['hộ chiếu', 'passport', 'số hộ chiếu'],
+        'personal': True,
+        'sensitivity': 'low',
+    }),
+    ('bảo hiểm', {
+        'canonical': 'bảo hiểm',
+        'aliases': [],
+        'keywords': ['bảo hiểm', 'bhyt', 'bhxh', 'insurance', 'số bảo hiểm'],
+        'personal': True,
+        'sensitivity': 'low',
+    }),
+    ('thành phố', {
+        'canonical': 'thành phố',
+        'aliases': ['city', 'tỉnh thành', 'tỉnh/thành phố'],
+        'keywords': [],
+        'personal': False,
+        'sensitivity': 'low',
+    }),
+    ('quận huyện', {
+        'canonical': 'quận huyện',
+        'aliases': ['district', 'huyện', 'quận'],
+        'keywords': [],
+        'personal': False,
+        'sensitivity': 'low',
+    }),
+    ('phường xã', {
+        'canonical': 'phường xã',
+        'aliases': ['ward', 'xã', 'phường'],
+        'keywords': [],
+        'personal': False,
+        'sensitivity': 'low',
+    }),
+    ('chuyên nghành', {
+        'canonical': 'chuyên nghành',
+        'aliases': ['học nghành', 'nghành'],
+        'keywords': [],
+        'personal': False,
+        'sensitivity': 'low',
+    }),
+])
+
+# Khóa đánh dấu nút kết thúc cụm trong trie: id lớp
+_END = ''
+
+
+def tokenize_label(text) -> List[str]:
+    """Tách nhãn thành từ: chữ thường, NFC, dấu câu thành khoảng trắng"""
+    text = unicodedata.normalize('NFC', str(text or '').lower())
+    return _NON_WORD.sub(' ', text).split()
+
+
+class _PhraseTrie:
+    """Trie theo từ của một bộ cụm, tra các cụm khớp dài nhất (có nhớ đệm theo nhãn)"""
+
+    def __init__(self):
+        self._root: Dict = {}
+        self._cache: Dict[str, Tuple[List[str], List[Tuple[int, int, str]]]] = {}
+        self._cache_lock = threading.Lock()
+
+    def insert(self, phrase: str, class_id: str):
+        tokens = tokenize_label(phrase)
+        if not tokens:
+            return
+        node = self._root
+        for token in tokens:
+            node = node.setdefault(token, {})
+        # Lớp khai báo trước thắng khi cùng một cụm thuộc nhiều lớp
+        node.setdefault(_END, class_id)
+
+    def _matches(self, tokens: List[str]) -> List[Tuple[int, int, str]]:
+        """Các cụm khớp không chồng nhau (trái sang phải, dài nhất): (đầu, cuối, lớp)"""
+        matches = []
+        i = 0
+        while i < len(tokens):
+            node = self._root
+            best = None
+            j = i
+            while j < len(tokens):
+                node = node.get(tokens[j])
+                if node is None:
+                    break
+                j += 1
+                if _END in node:
+                    best = (i, j, node[_END])
+            if best is None:
+                i += 1
+            else:
+                matches.append(best)
+                i = best[1]
+        return matches
+
+    def lookup(self, text) -> Tuple[List[str], List[Tuple[int, int, str]]]:
+        """(từ, cụm khớp) của nhãn; nhớ đệm theo nhãn gốc nên nhãn lặp lại chỉ tốn một lần băm"""
+        cached = self._cache.get(text)
+        if cached is None:
+            tokens = tokenize_label(text)
+            cached = (tokens, self._matches(tokens))
+            with self._cache_lock:
+                if len(self._cache) >= _CACHE_LIMIT:
+                    self._cache.clear()
+                self._cache[text] = cached
+        return cached
+
+
+class FieldOntology:
+    """Hai trie theo từ (từ đồng nghĩa của bộ so khớp, từ khóa của bộ phân tích) trên FIELD_CLASSES"""
+
+    def __init__(self, classes: Dict[str, Dict] = FIELD_CLASSES):
+        self.specs = classes
+        self._canonical_tokens = {class_id: tokenize_label(spec['canonical'])
+                                  for class_id, spec in classes.items()}
+        self._aliases = _PhraseTrie()
+        self._keywords = _PhraseTrie()
+        for class_id, spec in classes.items():
+            # Dạng chuẩn cũng là từ đồng nghĩa của chính nó (chỉ với lớp của bộ so khớp)
+            if spec['aliases']:
+                for phrase in [spec['canonical']] + list(spec['aliases']):
+                    self._aliases.insert(phrase, class_id)
+            for phrase in spec['keywords']:
+                self._keywords.insert(phrase, class_id)
+
+    def classes(self, text) -> List[str]:
+        """Các lớp có từ đồng nghĩa (của bộ so khớp) xuất hiện trong nhãn, theo thứ tự xuất hiện"""
+        _, matches = self._aliases.lookup(text)
+        return list(OrderedDict.fromkeys(match[2] for match in matches))
+
+    def classify_personal(self, text) -> Optional[str]:
+        """Lớp thông tin cá nhân đầu tiên có từ khóa (của bộ phân tích) trong nhãn"""
+        _, matches = self._keywords.lookup(text)
+        for _, _, class_id in matches:
+            if self.specs[class_id]['personal']:
+                return class_id
+        return None
+
+    def canonicalize(self, text) -> str:
+        """Nhãn đã tách từ, mọi từ đồng nghĩa được thay bằng dạng chuẩn của lớp"""
+        tokens, matches = self._aliases.lookup(text)
+        result = []
+        position = 0
+        for start, end, class_id in matches:
+            result.extend(tokens[position:start])
+            result.extend(self._canonical_tokens[class_id])
+            position = end
+        result.extend(tokens[position:])
+        return ' '.join(result)
+
+    def spec(self, class_id: str) -> Dict:
+        return self.specs[class_id]
+
+    def synonym_map(self) -> Dict[str, List[str]]:
+        """Dạng chuẩn -> từ đồng nghĩa (như synonym_map cũ của bộ so khớp)"""
+        return {spec['canonical']: list(OrderedDict.fromkeys([spec['canonical']] + list(spec['aliases'])))
+                for spec in self.specs.values() if spec['aliases']}
+
+
+_ontology = None
+_ontology_lock = threading.Lock()
+
+
+def get_field_ontology() -> FieldOntology:
+    """FieldOntology dùng chung trong tiến trình (biên dịch một lần)"""
+    global _ontology
+    if _ontology is None:
+        with _ontology_lock:
+            if _ontology is None:
+                _ontology = FieldOntology()
+    return _ontology
@@ -0,0 +1,121 @@
+"""
+Nhân so khớp chuỗi gần đúng, chấm một truy vấn với hàng nghìn nhãn trong một lần gọi NumPy.
+
+Hai phương pháp:
+    quick_ratio  đúng bằng difflib.SequenceMatcher(None, a, b).quick_ratio():
+                 mỗi nhãn là vector đếm ký tự, điểm = 2 * sum(min(đếm)) /
+                 (len(a) + len(b)). Mặc định, giữ nguyên điểm số và ngưỡng
+                 hiện có của bộ so khớp.
+    trigram      Jaccard trên tập trigram ký tự, băm vào FUZZY_TRIGRAM_BITS bit
+                 và đóng gói thành byte; giao/hợp tính bằng AND/OR + bảng
+                 popcount. Phân biệt tốt hơn với các chuỗi hoán vị ký tự.
+
+Chọn phương pháp mặc định bằng biến môi trường FUZZY_KERNEL.
+"""
+import os
+import zlib
+from collections import Counter
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+FUZZY_KERNEL = os.environ.get('FUZZY_KERNEL', 'quick_ratio')
+FUZZY_TRIGRAM_BITS = int(os.environ.get('FUZZY_TRIGRAM_BITS', '1024'))
+
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint16)
+
+
+def _trigrams(text: str) -> set:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class FuzzyIndex:
+    """Tập nhãn cố định, chấm điểm gần đúng của một truy vấn với mọi nhãn"""
+
+    def __init__(self, labels: Sequence[str], method: str = FUZZY_KERNEL, bits: int = FUZZY_TRIGRAM_BITS):
+        if method not in ('quick_ratio', 'trigram'):
+            raise ValueError(f"Phương pháp so khớp không hỗ trợ: {method}")
+        self.labels = list(labels)
+        self.method = method
+        self.bits = bits
+        if method == 'quick_ratio':
+            self._build_char_counts()
+        else:
+            self._build_trigram_bits()
+
+    def __len__(self):
+        return len(self.labels)
+
+    # ----- quick_ratio -----
+
+    def _build_char_counts(self):
+        self._alphabet: Dict[str, int] = {}
+        for label in self.labels:
+            for ch in label:
+                self._alphabet.setdefault(ch, len(self._alphabet))
+        counts = np.zeros((len(self.labels), max(1, len(self._alphabet))), dtype=np.int32)
+        for row, label in enumerate(self.labels):
+            for ch, count in Counter(label).items():
+                counts[row, self._alphabet[ch]] = count
+        self._counts = counts
+        self._lengths = np.array([len(label) for label in self.labels], dtype=np.int32)
+
+    def _quick_ratio_scores(self, query: str) -> np.ndarray:
+        query_counts = np.zeros(self._counts.shape[1], dtype=np.int32)
+        for ch, count in Counter(query).items():
+            column = self._alphabet.get(ch)
+            if column is not None:
+                query_counts[column] = count
+        matches = np.minimum(self._counts, query_counts).sum(axis=1)
+        total = self._lengths + len(query)
+        # SequenceMatcher coi hai chuỗi rỗng là giống hệt nhau
+        return np.where(total > 0, 2.0 * matches / np.maximum(total, 1), 1.0)
+
+    # ----- trigram -----
+
+    def _signature(self, text: str) -> np.ndarray:
+        bits = np.zeros(self.bits, dtype=np.uint8)
+        for gram in _trigrams(text):
+            bits[zlib.crc32(gram.encode('utf-8')) % self.bits] = 1
+        return np.packbits(bits)
+
+    def _build_trigram_bits(self):
+        self._packed = (np.stack([self._signature(label) for label in self.labels])
+                        if self.labels else np.zeros((0, self.bits // 8), dtype=np.uint8))
+
+    def _trigram_scores(self, query: str) -> np.ndarray:
+        signature = self._signature(query)
+        intersection = _POPCOUNT[self._packed & signature].sum(axis=1)
+        union = _POPCOUNT[self._packed | signature].sum(axis=1)
+        return np.where(union > 0, intersection / np.maximum(union, 1), 1.0)
+
+    # ----- truy vấn -----
+
+    def scores(self, query: str) -> np.ndarray:
+        """Điểm trong [0, 1] của query với từng nhãn, theo thứ tự labels"""
+        if not self.labels:
+            return np.zeros(0, dtype=np.float64)
+        if self.method == 'quick_ratio':
+            return self._quick_ratio_scores(query)
+        return self._trigram_scores(query)
+
+    def top_k(self, query: str, k: int = 10) -> List[Tuple[str, float]]:
+        scores = self.scores(query)
+        if not len(scores):
+            return []
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(self.labels[i], float(scores[i])) for i in top]
+
+
+def similarity(a: str, b: str, method: str = FUZZY_KERNEL) -> float:
+    """Điểm gần đúng của một cặp chuỗi (cùng công thức với FuzzyIndex)"""
+    if method == 'quick_ratio':
+        total = len(a) + len(b)
+        if not total:
+            return 1.0
+        matches = sum((Counter(a) & Counter(b)).values())
+        return 2.0 * matches / total
+    return float(FuzzyIndex([b], method=method).scores(a)[0])
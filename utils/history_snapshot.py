@@ -0,0 +1,433 @@
+"""
+Ảnh chụp dạng cột của lịch sử biểu mẫu cho thống kê và dựng mô hình.
+
+Lịch sử (JSON lồng nhau) được trải phẳng thành bảng "khóa", mỗi dòng là một
+trường trong form_data của một biểu mẫu:
+    form   int32  thứ tự bản ghi trong lịch sử
+    field  int32  mã tên trường (từ điển fields, theo thứ tự xuất hiện đầu tiên)
+    value  int32  mã giá trị đã strip (từ điển values), -1 / null nếu bỏ trống
+                  (None hoặc chuỗi rỗng; 0 và False được giữ dạng '0', 'False')
+kèm các cột theo bản ghi: form_id, timestamp, mã người dùng (-1 nếu bản ghi
+không có user_id, -2 nếu phần tử trong lịch sử không phải bản ghi dict: dòng
+giữ chỗ để thứ tự khớp file JSON, không bao giờ được trả về như một bản ghi).
+Các "ô" (cell_*) là những dòng có giá trị.
+
+Ảnh chụp đủ để dựng lại tên trường, chỉ mục trường và các bản ghi cần cho gợi ý
+(record / user_records), nên EnhancedFieldMatcher không phải đọc file JSON khi
+ảnh chụp còn khớp phiên bản.
+
+Định dạng file (cạnh file lịch sử):
+    - '<lịch sử>.arrow': Arrow IPC không nén, field/value là cột dictionary,
+      khi có pyarrow;
+    - '<lịch sử>.npz': npz không nén (np.savez), chuỗi lưu dạng blob utf-8 +
+      offsets. Các mảng được memory-map thẳng từ file zip nên nạp gần như
+      không tốn thời gian.
+
+Ảnh chụp ghi kèm phiên bản của file lịch sử lúc dựng; khi lịch sử đổi thì
+dựng lại (một worker ghi, các worker khác đọc lại file mới).
+"""
+import os
+import json
+import logging
+import tempfile
+import threading
+import zipfile
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from config.config import FORM_HISTORY_PATH
+from utils.json_store import file_lock, file_version, read_json
+
+logger = logging.getLogger(__name__)
+
+# auto | arrow | npz
+SNAPSHOT_FORMAT = os.environ.get('HISTORY_SNAPSHOT_FORMAT', 'auto')
+_META_KEY = b'history_snapshot'
+# Tăng khi bố cục thay đổi; ảnh chụp khác phiên bản được dựng lại
+SNAPSHOT_VERSION = 3
+# Mã người dùng của dòng giữ chỗ cho phần tử không phải dict
+NOT_A_RECORD = -2
+
+
+def _has_pyarrow() -> bool:
+    try:
+        import pyarrow  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def _encode_strings(strings: List[str]):
+    encoded = [s.encode('utf-8') for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    if encoded:
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return offsets, np.frombuffer(b''.join(encoded), dtype=np.uint8)
+
+
+def _decode_strings(offsets, blob) -> List[str]:
+    data = bytes(blob)
+    return [data[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(len(offsets) - 1)]
+
+
+class _Dictionary:
+    """Mã hóa từ điển: chuỗi -> mã int theo thứ tự gặp đầu tiên"""
+
+    def __init__(self):
+        self.codes: Dict[Any, int] = {}
+        self.items: List[Any] = []
+
+    def code(self, item) -> int:
+        code = self.codes.get(item)
+        if code is None:
+            code = self.codes[item] = len(self.items)
+            self.items.append(item)
+        return code
+
+
+class HistorySnapshot:
+    """Lịch sử biểu mẫu dạng cột, chỉ đọc"""
+
+    def __init__(self, source_version, fields: List[str], values: List[str], users: List[Any],
+                 form_ids: List[str], form_timestamps: List[str], form_user,
+                 key_form, key_field, key_value):
+        self.source_version = list(source_version) if source_version is not None else None
+        self.fields = fields
+        self.values = values
+        self.users = users
+        self.form_ids = form_ids
+        self.form_timestamps = form_timestamps
+        self.form_user = form_user
+        self.key_form = key_form
+        self.key_field = key_field
+        self.key_value = key_value
+        filled = key_value >= 0
+        if filled.all():
+            self.cell_form, self.cell_field, self.cell_value = key_form, key_field, key_value
+        else:
+            self.cell_form, self.cell_field, self.cell_value = key_form[filled], key_field[filled], key_value[filled]
+
+    @classmethod
+    def from_records(cls, records: List[Dict], source_version=None) -> 'HistorySnapshot':
+        fields, values, users = _Dictionary(), _Dictionary(), _Dictionary()
+        form_ids, form_timestamps, form_user = [], [], []
+        key_form, key_field, key_value = [], [], []
+        for record in records:
+            # Bản ghi hỏng vẫn giữ một dòng để thứ tự khớp với chỉ số trong file JSON
+            form = len(form_ids)
+            if not isinstance(record, dict):
+                form_ids.append('')
+                form_timestamps.append('')
+                form_user.append(NOT_A_RECORD)
+                continue
+            form_ids.append(str(record.get('form_id') or ''))
+            form_timestamps.append(str(record.get('timestamp') or ''))
+            form_user.append(users.code(record['user_id']) if 'user_id' in record else -1)
+            form_data = record.get('form_data')
+            if not isinstance(form_data, dict):
+                continue
+            for field_name, value in form_data.items():
+                value = str(value).strip() if value is not None else ''
+                key_form.append(form)
+                key_field.append(fields.code(field_name))
+                key_value.append(values.code(value) if value else -1)
+        return cls(
+            source_version, fields.items, values.items, users.items, form_ids, form_timestamps,
+            np.asarray(form_user, dtype=np.int32), np.asarray(key_form, dtype=np.int32),
+            np.asarray(key_field, dtype=np.int32), np.asarray(key_value, dtype=np.int32),
+        )
+
+    def __len__(self):
+        return len(self.form_ids)
+
+    def _meta(self) -> Dict:
+        return {'format': SNAPSHOT_VERSION, 'source_version': self.source_version, 'users': self.users}
+
+    # ----- ghi / đọc -----
+
+    def write(self, path: str, fmt: str):
+        """Ghi nguyên tử ra path (file tạm + fsync + os.replace)"""
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(prefix='.' + os.path.basename(path) + '.', dir=directory)
+        os.close(fd)
+        try:
+            if fmt == 'arrow':
+                self._write_arrow(tmp_path)
+            else:
+                self._write_npz(tmp_path)
+            with open(tmp_path, 'rb') as f:
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def _write_npz(self, path: str):
+        arrays = {
+            'form_user': self.form_user,
+            'key_form': self.key_form,
+            'key_field': self.key_field,
+            'key_value': self.key_value,
+            'meta': np.frombuffer(json.dumps(self._meta(), ensure_ascii=False).encode('utf-8'), dtype=np.uint8),
+        }
+        for name, strings in (('fields', self.fields), ('values', self.values),
+                              ('form_ids', self.form_ids), ('form_timestamps', self.form_timestamps)):
+            arrays[name + '_offsets'], arrays[name + '_blob'] = _encode_strings(strings)
+        with open(path, 'wb') as f:
+            np.savez(f, **arrays)
+
+    @classmethod
+    def _read_npz(cls, path: str) -> 'HistorySnapshot':
+        arrays = _mmap_npz(path)
+        strings = {
+            name: _decode_strings(arrays[name + '_offsets'], arrays[name + '_blob'])
+            for name in ('fields', 'values', 'form_ids', 'form_timestamps')
+        }
+        meta = json.loads(bytes(arrays['meta']).decode('utf-8'))
+        _check_format(meta, path)
+        return cls(meta['source_version'], strings['fields'], strings['values'], meta['users'],
+                   strings['form_ids'], strings['form_timestamps'], arrays['form_user'],
+                   arrays['key_form'], arrays['key_field'], arrays['key_value'])
+
+    def _write_arrow(self, path: str):
+        import pyarrow as pa
+        import pyarrow.ipc as ipc
+
+        meta = dict(self._meta(), form_ids=self.form_ids, form_timestamps=self.form_timestamps,
+                    form_user=self.form_user.tolist())
+        table = pa.table({
+            'form': pa.array(self.key_form, type=pa.int32()),
+            'field': pa.DictionaryArray.from_arrays(pa.array(self.key_field, type=pa.int32()),
+                                                    pa.array(self.fields, type=pa.string())),
+            # Trường bỏ trống: chỉ số null
+            'value': pa.DictionaryArray.from_arrays(pa.array(self.key_value, type=pa.int32(),
+                                                             mask=self.key_value < 0),
+                                                    pa.array(self.values, type=pa.string())),
+        })
+        table = table.replace_schema_metadata({_META_KEY: json.dumps(meta, ensure_ascii=False).encode('utf-8')})
+        with pa.OSFile(path, 'wb') as sink:
+            with ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table, max_chunksize=max(1, table.num_rows))
+
+    @classmethod
+    def _read_arrow(cls, path: str) -> 'HistorySnapshot':
+        import pyarrow as pa
+        import pyarrow.ipc as ipc
+
+        table = ipc.open_file(pa.memory_map(path, 'r')).read_all()
+        meta = json.loads(table.schema.metadata[_META_KEY].decode('utf-8'))
+        _check_format(meta, path)
+
+        def dictionary_column(name):
+            if table.num_rows == 0:
+                return [], np.zeros(0, dtype=np.int32)
+            column = table.column(name).combine_chunks()
+            indices = column.indices.fill_null(-1) if column.null_count else column.indices
+            return column.dictionary.to_pylist(), indices.to_numpy(zero_copy_only=False).astype(np.int32, copy=False)
+
+        fields, key_field = dictionary_column('field')
+        values, key_value = dictionary_column('value')
+        key_form = table.column('form').to_numpy() if table.num_rows else np.zeros(0, dtype=np.int32)
+        return cls(meta['source_version'], fields, values, meta['users'], meta['form_ids'],
+                   meta['form_timestamps'], np.asarray(meta['form_user'], dtype=np.int32),
+                   key_form, key_field, key_value)
+
+    @classmethod
+    def read(cls, path: str) -> 'HistorySnapshot':
+        return cls._read_arrow(path) if path.endswith('.arrow') else cls._read_npz(path)
+
+    # ----- truy vấn cho mô hình và thống kê -----
+
+    def field_keys(self):
+        """Duyệt (thứ tự bản ghi, tên trường) của mọi khóa form_data, kể cả trường bỏ trống"""
+        fields = self.fields
+        for form, field_code in zip(self.key_form.tolist(), self.key_field.tolist()):
+            yield form, fields[field_code]
+
+    def _form_record(self, form: int, start: int, end: int) -> Dict:
+        form_data = {}
+        for field_code, value_code in zip(self.key_field[start:end].tolist(), self.key_value[start:end].tolist()):
+            form_data[self.fields[field_code]] = self.values[value_code] if value_code >= 0 else ''
+        record = {'form_data': form_data, 'form_id': self.form_ids[form], 'timestamp': self.form_timestamps[form]}
+        if self.form_user[form] >= 0:
+            record['user_id'] = self.users[self.form_user[form]]
+        return record
+
+    def record(self, form: int) -> Optional[Dict]:
+        """Dựng lại bản ghi thứ form (giá trị đã strip, trường trống thành ''); None với dòng giữ chỗ"""
+        if self.form_user[form] == NOT_A_RECORD:
+            return None
+        # Các khóa được ghi theo thứ tự bản ghi nên key_form tăng dần
+        start, end = np.searchsorted(self.key_form, [form, form + 1])
+        return self._form_record(form, int(start), int(end))
+
+    def user_records(self, user_id) -> List[Dict]:
+        """Các bản ghi có str(user_id) trùng (bản ghi không có user_id khớp với None), theo thứ tự lịch sử"""
+        target = str(user_id)
+        codes = [code for code, user in enumerate(self.users) if str(user) == target]
+        if target == 'None':
+            codes.append(-1)  # dòng giữ chỗ (NOT_A_RECORD) không bao giờ khớp
+        forms = np.flatnonzero(np.isin(self.form_user, codes))
+        if not len(forms):
+            return []
+        starts = np.searchsorted(self.key_form, forms)
+        ends = np.searchsorted(self.key_form, forms + 1)
+        return [self._form_record(int(form), int(start), int(end))
+                for form, start, end in zip(forms, starts, ends)]
+
+    def field_values(self, exclude=()):
+        """Duyệt (tên trường, giá trị) theo thứ tự trong lịch sử"""
+        excluded = {code for code, name in enumerate(self.fields) if name in exclude}
+        fields, values = self.fields, self.values
+        for field_code, value_code in zip(self.cell_field.tolist(), self.cell_value.tolist()):
+            if field_code not in excluded:
+                yield fields[field_code], values[value_code]
+
+    def user_value_counts(self) -> Dict[Any, Dict[str, Dict[str, int]]]:
+        """{user_id: {tên trường: {giá trị: số lần}}} của các bản ghi có khóa user_id"""
+        cell_user = self.form_user[self.cell_form] if len(self.cell_form) else np.zeros(0, dtype=np.int32)
+        mask = cell_user >= 0
+        if not mask.any():
+            return {}
+        combos = np.stack([cell_user[mask], self.cell_field[mask], self.cell_value[mask]], axis=1)
+        unique, counts = np.unique(combos, axis=0, return_counts=True)
+        result: Dict[Any, Dict[str, Dict[str, int]]] = {}
+        for (user_code, field_code, value_code), count in zip(unique.tolist(), counts.tolist()):
+            user_fields = result.setdefault(self.users[user_code], {})
+            user_fields.setdefault(self.fields[field_code], {})[self.values[value_code]] = count
+        return result
+
+    def field_fill_counts(self) -> Dict[str, int]:
+        """Số biểu mẫu đã điền mỗi trường"""
+        counts = np.bincount(self.cell_field, minlength=len(self.fields))
+        return {name: int(count) for name, count in zip(self.fields, counts)}
+
+    def top_values(self, field_name: str, limit: int = 10) -> List[tuple]:
+        """Các giá trị phổ biến nhất của một trường"""
+        try:
+            field_code = self.fields.index(field_name)
+        except ValueError:
+            return []
+        counts = np.bincount(self.cell_value[self.cell_field == field_code], minlength=len(self.values))
+        order = np.argsort(-counts, kind='stable')[:limit]
+        return [(self.values[code], int(counts[code])) for code in order if counts[code] > 0]
+
+    def stats(self) -> Dict:
+        return {
+            'forms': len(self.form_ids),
+            'cells': int(len(self.cell_form)),
+            'fields': len(self.fields),
+            'distinct_values': len(self.values),
+            'users': len(self.users),
+        }
+
+
+def _check_format(meta: Dict, path: str):
+    if meta.get('format') != SNAPSHOT_VERSION:
+        raise ValueError(f"{path}: ảnh chụp định dạng {meta.get('format')}, cần {SNAPSHOT_VERSION}")
+
+
+def _mmap_npz(path: str) -> Dict[str, np.ndarray]:
+    """Memory-map các mảng trong file npz không nén (mỗi thành viên là một .npy)"""
+    arrays = {}
+    with zipfile.ZipFile(path) as archive, open(path, 'rb') as f:
+        for info in archive.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError(f"{path}: thành viên {info.filename} bị nén, không memory-map được")
+            # Local file header: 30 byte cố định + tên file + trường extra
+            f.seek(info.header_offset + 26)
+            name_length, extra_length = np.frombuffer(f.read(4), dtype='<u2')
+            f.seek(info.header_offset + 30 + int(name_length) + int(extra_length))
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            name = info.filename[:-4] if info.filename.endswith('.npy') else info.filename
+            if int(np.prod(shape)) == 0:
+                arrays[name] = np.zeros(shape, dtype=dtype)
+            else:
+                arrays[name] = np.memmap(path, dtype=dtype, mode='r', offset=f.tell(), shape=shape,
+                                         order='F' if fortran_order else 'C')
+    return arrays
+
+
+class HistorySnapshotManager:
+    """Giữ ảnh chụp mới nhất của từng file lịch sử trong tiến trình"""
+
+    def __init__(self, fmt: str = SNAPSHOT_FORMAT):
+        if fmt == 'auto':
+            fmt = 'arrow' if _has_pyarrow() else 'npz'
+        self.format = fmt
+        self._snapshots: Dict[str, HistorySnapshot] = {}
+        self._lock = threading.Lock()
+
+    def snapshot_path(self, source_path: str) -> str:
+        base, _ = os.path.splitext(os.path.abspath(source_path))
+        return f"{base}.{self.format}"
+
+    def get(self, source_path: str = FORM_HISTORY_PATH, records: Optional[List[Dict]] = None,
+            records_version=None) -> HistorySnapshot:
+        """
+        Ảnh chụp khớp với phiên bản hiện tại của file lịch sử.
+
+        Thứ tự: bản trong bộ nhớ -> file ảnh chụp trên đĩa -> dựng lại (từ
+        records nếu người gọi đã đọc đúng phiên bản records_version, nếu không
+        thì đọc lại file).
+        """
+        source_path = os.path.abspath(source_path)
+        version = file_version(source_path)
+        expected = list(version) if version is not None else None
+        snapshot = self._snapshots.get(source_path)
+        if snapshot is not None and snapshot.source_version == expected:
+            return snapshot
+
+        with self._lock:
+            path = self.snapshot_path(source_path)
+            snapshot = self._read(path)
+            if snapshot is None or snapshot.source_version != expected:
+                with file_lock(path):
+                    snapshot = self._read(path)
+                    if snapshot is None or snapshot.source_version != expected:
+                        if records_version is None or list(records_version) != expected:
+                            records = None
+                        snapshot = self._build(source_path, path, records)
+            self._snapshots[source_path] = snapshot
+            return snapshot
+
+    def _read(self, path: str) -> Optional[HistorySnapshot]:
+        if not os.path.exists(path):
+            return None
+        try:
+            return HistorySnapshot.read(path)
+        except Exception as e:
+            logger.warning(f"Không đọc được ảnh chụp lịch sử {path}: {e}")
+            return None
+
+    def _build(self, source_path: str, path: str, records: Optional[List[Dict]]) -> HistorySnapshot:
+        version = file_version(source_path)
+        if records is None:
+            records, version = read_json(source_path, [])
+        snapshot = HistorySnapshot.from_records(records if isinstance(records, list) else [], version)
+        try:
+            snapshot.write(path, self.format)
+            logger.info(f"Đã ghi ảnh chụp lịch sử {path}: {snapshot.stats()}")
+        except OSError as e:
+            logger.warning(f"Không ghi được ảnh chụp lịch sử {path}: {e}")
+        return snapshot
+
+
+_manager = None
+
+
+def get_history_snapshot(source_path: str = FORM_HISTORY_PATH, records: Optional[List[Dict]] = None,
+                         records_version=None) -> HistorySnapshot:
+    """Ảnh chụp dạng cột của lịch sử biểu mẫu (dùng chung trong tiến trình)"""
+    global _manager
+    if _manager is None:
+        _manager = HistorySnapshotManager()
+    return _manager.get(source_path, records, records_version)
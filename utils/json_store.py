@@ -0,0 +1,159 @@
+"""
+Ghi file JSON an toàn khi có nhiều worker và khi tiến trình bị dừng đột ngột.
+
+    - Ghi nguyên tử: dump ra file tạm cùng thư mục, fsync, rồi os.replace lên
+      file đích. Người đọc luôn thấy bản cũ hoặc bản mới đầy đủ, không bao
+      giờ thấy file bị cắt dở; người đọc không cần khóa.
+    - Khóa liên tiến trình: flock trên file '<đích>.lock', chỉ giữ trong lúc
+      kiểm tra phiên bản và ghi.
+    - Phiên bản lạc quan: phiên bản của file là (inode, mtime_ns, kích thước);
+      os.replace luôn tạo inode mới nên mỗi lần ghi đổi phiên bản. Đọc - sửa -
+      ghi qua update_json: đọc và sửa ngoài khóa, khi ghi nếu file đã bị worker
+      khác đổi thì đọc lại và làm lại thay vì ghi đè mất dữ liệu của họ.
+"""
+import os
+import json
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+UPDATE_RETRIES = 10
+
+_thread_locks = {}
+_thread_locks_guard = threading.Lock()
+
+
+class StaleWriteError(RuntimeError):
+    """File đã bị thay đổi kể từ lần đọc mà thao tác ghi dựa vào"""
+
+
+def file_version(path: str) -> Optional[Tuple[int, int, int]]:
+    """Phiên bản hiện tại của file, None nếu file chưa tồn tại"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def _thread_lock(path: str) -> threading.Lock:
+    with _thread_locks_guard:
+        lock = _thread_locks.get(path)
+        if lock is None:
+            lock = _thread_locks[path] = threading.Lock()
+        return lock
+
+
+@contextmanager
+def file_lock(path: str):
+    """Khóa ghi độc quyền cho path giữa các luồng và các tiến trình"""
+    path = os.path.abspath(path)
+    with _thread_lock(path):
+        try:
+            import fcntl
+        except ImportError:
+            yield  # Không có fcntl (Windows): chỉ có một tiến trình
+            return
+        fd = os.open(path + '.lock', os.O_CREAT | os.O_RDWR, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+
+def read_json(path: str, default: Any = None) -> Tuple[Any, Optional[Tuple[int, int, int]]]:
+    """Đọc file JSON, trả về (dữ liệu, phiên bản); file chưa có thì (default, None)"""
+    while True:
+        version = file_version(path)
+        if version is None:
+            return default, None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            continue
+        # File được thay bằng os.replace giữa stat và open: đọc lại cho khớp phiên bản
+        if file_version(path) == version:
+            return data, version
+
+
+def _replace_atomically(path: str, data: Any, indent: int):
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix='.' + os.path.basename(path) + '.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=indent)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    # fsync thư mục để việc đổi tên cũng bền vững sau sự cố (không hỗ trợ trên Windows)
+    try:
+        dir_fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(dir_fd)
+    except OSError:
+        pass
+    finally:
+        os.close(dir_fd)
+
+
+def write_json(path: str, data: Any, expected_version=False, indent: int = 4):
+    """
+    Ghi nguyên tử data vào path.
+
+    Args:
+        expected_version: phiên bản lấy từ read_json; nếu truyền vào mà file đã
+            đổi thì ném StaleWriteError. Mặc định (False) ghi không kiểm tra.
+
+    Returns:
+        Phiên bản mới của file
+    """
+    with file_lock(path):
+        if expected_version is not False and file_version(path) != expected_version:
+            raise StaleWriteError(f"{path} đã bị thay đổi bởi tiến trình khác")
+        _replace_atomically(path, data, indent)
+        return file_version(path)
+
+
+def update_json(path: str, mutate: Callable[[Any], Any], default: Callable[[], Any] = list,
+                indent: int = 4, retries: int = UPDATE_RETRIES):
+    """
+    Đọc - sửa - ghi với kiểm tra phiên bản lạc quan.
+
+    mutate nhận dữ liệu vừa đọc (sửa tại chỗ) và trả về giá trị cho người gọi;
+    có thể được gọi lại nhiều lần nếu có ghi đồng thời nên không được có tác
+    dụng phụ nào khác.
+    """
+    for _ in range(retries):
+        data, version = read_json(path, None)
+        if data is None:
+            data = default()
+        result = mutate(data)
+        try:
+            write_json(path, data, expected_version=version, indent=indent)
+            return result
+        except StaleWriteError:
+            logger.debug(f"Ghi đồng thời vào {path}, thử lại")
+    # Tranh chấp kéo dài: làm lần cuối trong khóa để chắc chắn thành công
+    with file_lock(path):
+        data, _ = read_json(path, None)
+        if data is None:
+            data = default()
+        result = mutate(data)
+        _replace_atomically(path, data, indent)
+        return result
@@ -0,0 +1,166 @@
+"""
+Kiểm tra API key trong nền thay vì trong lúc xử lý request.
+
+Mỗi worker chạy một luồng nền:
+    - ghi bộ đếm sử dụng (số request, số thành công, thời gian phản hồi) đã
+      gom trong bộ nhớ vào bảng APIKey sau mỗi nhịp (tick);
+    - kiểm tra ngay các key được yêu cầu (vd. key vừa thêm, key đã cũ khi
+      trang quản trị mở);
+    - một worker duy nhất (giữ khóa file) kiểm tra định kỳ toàn bộ key đã cũ,
+      gọi provider song song.
+
+Trang quản trị chỉ đọc trạng thái đã lưu trong DB, không chờ provider.
+"""
+import os
+import time
+import logging
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+KEY_CHECK_INTERVAL = int(os.environ.get('API_KEY_CHECK_INTERVAL', '3600'))
+KEY_VALIDATOR_TICK = int(os.environ.get('API_KEY_VALIDATOR_TICK', '60'))
+KEY_VALIDATOR_WORKERS = int(os.environ.get('API_KEY_VALIDATOR_WORKERS', '4'))
+KEY_VALIDATOR_LOCK_PATH = os.environ.get(
+    'API_KEY_VALIDATOR_LOCK', os.path.join(tempfile.gettempdir(), 'api_key_validator.lock')
+)
+
+
+class APIKeyValidator:
+    """Luồng nền kiểm tra trạng thái API key và ghi bộ đếm sử dụng"""
+
+    def __init__(self, app, interval: int = KEY_CHECK_INTERVAL, tick: int = KEY_VALIDATOR_TICK,
+                 max_workers: int = KEY_VALIDATOR_WORKERS, lock_path: str = KEY_VALIDATOR_LOCK_PATH):
+        self.app = app
+        self.interval = interval
+        self.tick = tick
+        self.max_workers = max_workers
+        self.lock_path = lock_path
+        self._pending = set()
+        self._pending_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._leader_fd = None
+        self._next_sweep = 0.0
+        self._thread = None
+        self.pid = None
+
+    def start(self):
+        self.pid = os.getpid()
+        self._thread = threading.Thread(target=self._loop, name='api-key-validator', daemon=True)
+        self._thread.start()
+        logger.info(f"Đã khởi động luồng kiểm tra API key (pid {self.pid})")
+
+    def request_check(self, key_id):
+        """Yêu cầu kiểm tra một key ở nhịp kế tiếp (không chờ kết quả)"""
+        with self._pending_lock:
+            self._pending.add(int(key_id))
+        self._wake.set()
+
+    def _is_leader(self) -> bool:
+        """Chỉ một tiến trình giữ khóa file được quét định kỳ toàn bộ key"""
+        if self._leader_fd is not None:
+            return True
+        try:
+            import fcntl
+        except ImportError:
+            return True  # Không có fcntl (Windows): chỉ có một tiến trình
+        fd = os.open(self.lock_path, os.O_CREAT | os.O_RDWR, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._leader_fd = fd
+        return True
+
+    def _loop(self):
+        from utils.api_key_manager import get_api_key_manager
+
+        manager = get_api_key_manager()
+        while True:
+            self._wake.wait(self.tick)
+            self._wake.clear()
+            with self.app.app_context():
+                try:
+                    manager.flush_usage()
+                except Exception as e:
+                    logger.error(f"Không ghi được bộ đếm sử dụng API key: {e}")
+
+                with self._pending_lock:
+                    key_ids, self._pending = self._pending, set()
+                sweep = time.time() >= self._next_sweep and self._is_leader()
+                if sweep:
+                    self._next_sweep = time.time() + self.tick
+                if key_ids or sweep:
+                    try:
+                        self.run_once(key_ids=key_ids, sweep=sweep)
+                    except Exception as e:
+                        logger.error(f"Lỗi khi kiểm tra API key trong nền: {e}", exc_info=True)
+
+    def run_once(self, key_ids=None, sweep: bool = True):
+        """
+        Kiểm tra các key được chỉ định và (nếu sweep) mọi key đã cũ hơn interval.
+
+        Gọi provider song song ngoài transaction, rồi ghi toàn bộ kết quả
+        trong một lần commit. Cần application context.
+        """
+        from models.user import db
+        from models.web_config import APIKey
+        from utils.api_key_manager import get_api_key_manager
+
+        manager = get_api_key_manager()
+        query = APIKey.query
+        conditions = []
+        if key_ids:
+            conditions.append(APIKey.id.in_(list(key_ids)))
+        if sweep:
+            stale_before = datetime.now() - timedelta(seconds=self.interval)
+            conditions.append(APIKey.last_checked.is_(None))
+            conditions.append(APIKey.last_checked < stale_before)
+        if not conditions:
+            return 0
+        targets = [(key.id, key.key, key.provider) for key in query.filter(db.or_(*conditions)).all()]
+        db.session.rollback()  # Không giữ transaction đọc trong lúc gọi provider
+        if not targets:
+            return 0
+
+        # Mỗi key dùng client riêng (kể cả Gemini) nên mọi key được kiểm tra song song
+        def check(target):
+            key_id, key_value, provider = target
+            return key_id, manager.check_api_key_validity(key_value, provider)
+
+        with ThreadPoolExecutor(max_workers=max(1, self.max_workers)) as executor:
+            results = list(executor.map(check, targets))
+
+        manager.apply_validation_results(results)
+        logger.info(f"Đã kiểm tra {len(results)} API key trong nền")
+        return len(results)
+
+
+_validator = None
+_validator_lock = threading.Lock()
+
+
+def start_key_validator(app):
+    """Khởi động luồng kiểm tra cho tiến trình hiện tại (gọi lại nhiều lần vẫn an toàn)"""
+    global _validator
+    if _validator is not None and _validator.pid == os.getpid():
+        return _validator
+    with _validator_lock:
+        # Sau khi fork, luồng của tiến trình cha không còn: tạo luồng mới
+        if _validator is None or _validator.pid != os.getpid():
+            if os.environ.get('API_KEY_VALIDATOR', '1') == '0':
+                return None
+            _validator = APIKeyValidator(app)
+            _validator.start()
+    return _validator
+
+
+def get_key_validator():
+    """Luồng kiểm tra của tiến trình hiện tại, None nếu chưa khởi động"""
+    if _validator is not None and _validator.pid == os.getpid():
+        return _validator
+    return None
@@ -0,0 +1,186 @@
+"""
+Backend suy luận cục bộ cho các tác vụ AI khi không có (hoặc không cần) provider.
+
+Mô hình được nạp lười ở lần gọi đầu tiên và chạy trên CPU. Backend có cùng
+giao diện generate()/stream() nên AIFieldMatcher dùng nó như một provider
+'local' bên cạnh 'openai' và 'gemini'.
+
+Biến môi trường:
+    LOCAL_LLM_BACKEND              'transformers' (mặc định) hoặc 'none' để tắt
+    LOCAL_LLM_MODEL                tên mô hình seq2seq trên HuggingFace hoặc thư mục
+                                   mô hình; nếu không đặt thì chỉ dùng khi
+                                   DEFAULT_LOCAL_MODEL đã có sẵn trong cache
+    LOCAL_LLM_REWRITE_MAX_CHARS    nội dung viết lại ngắn hơn ngưỡng này được gửi
+                                   cho mô hình cục bộ trước (mặc định 0: tắt)
+    LOCAL_LLM_CONTEXT_MAX_CHARS    tương tự cho phân tích ngữ cảnh biểu mẫu
+    LOCAL_LLM_STREAM_TIMEOUT       số giây tối đa chờ mỗi đoạn khi stream (mặc định 60)
+
+Mô hình cục bộ chỉ được coi là khả dụng khi đã cấu hình hoặc đã tải sẵn, để
+request không phải chờ tải mô hình về.
+"""
+import os
+import queue
+import logging
+import threading
+from typing import Dict, Iterator, Optional
+
+from utils.model_registry import freeze_module
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LOCAL_MODEL = 'bigscience/mt0-small'
+LOCAL_LLM_STREAM_TIMEOUT = float(os.environ.get('LOCAL_LLM_STREAM_TIMEOUT', '60'))
+
+
+class LocalLLMBackend:
+    """Giao diện chung cho backend suy luận cục bộ"""
+
+    name = 'none'
+
+    @property
+    def available(self) -> bool:
+        return False
+
+    def generate(self, prompt: str, max_new_tokens: int = 200, temperature: float = 0.3) -> str:
+        raise RuntimeError("Không có backend suy luận cục bộ")
+
+    def stream(self, prompt: str, max_new_tokens: int = 200, temperature: float = 0.3) -> Iterator[str]:
+        text = self.generate(prompt, max_new_tokens=max_new_tokens, temperature=temperature)
+        if text:
+            yield text
+
+
+class TransformersSeq2SeqBackend(LocalLLMBackend):
+    """Backend dùng một mô hình seq2seq nhỏ của transformers chạy trên CPU"""
+
+    name = 'transformers'
+
+    def __init__(self, model_name: Optional[str] = None, max_input_tokens: int = 512):
+        configured = model_name or os.environ.get('LOCAL_LLM_MODEL')
+        self.model_name = configured or DEFAULT_LOCAL_MODEL
+        self.configured = bool(configured)
+        self.max_input_tokens = max_input_tokens
+        self._tokenizer = None
+        self._model = None
+        self._load_failed = False
+        self._present = None
+        self._lock = threading.Lock()
+
+    def _model_present(self) -> bool:
+        """Mô hình đã được cấu hình, là thư mục cục bộ, hoặc đã nằm trong cache HuggingFace"""
+        if self._present is None:
+            if self.configured or os.path.isdir(self.model_name):
+                self._present = True
+            else:
+                try:
+                    from huggingface_hub import try_to_load_from_cache
+                    self._present = isinstance(try_to_load_from_cache(self.model_name, 'config.json'), str)
+                except Exception:
+                    self._present = False
+        return self._present
+
+    @property
+    def available(self) -> bool:
+        if self._load_failed:
+            return False
+        if self._model is not None:
+            return True
+        try:
+            import transformers  # noqa: F401
+        except ImportError:
+            return False
+        return self._model_present()
+
+    def _load(self):
+        """Nạp tokenizer và mô hình ở lần dùng đầu tiên"""
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    try:
+                        from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
+                        self._tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+                        self._model = freeze_module(AutoModelForSeq2SeqLM.from_pretrained(self.model_name))
+                        logger.info(f"Đã nạp mô hình cục bộ '{self.model_name}'")
+                    except Exception:
+                        self._load_failed = True
+                        raise
+        return self._tokenizer, self._model
+
+    def _generate_kwargs(self, prompt: str, max_new_tokens: int, temperature: float) -> Dict:
+        tokenizer, _ = self._load()
+        inputs = tokenizer(prompt, return_tensors='pt', truncation=True, max_length=self.max_input_tokens)
+        kwargs = dict(inputs, max_new_tokens=max_new_tokens)
+        if temperature and temperature > 0:
+            kwargs.update(do_sample=True, temperature=temperature)
+        return kwargs
+
+    def generate(self, prompt: str, max_new_tokens: int = 200, temperature: float = 0.3) -> str:
+        tokenizer, model = self._load()
+        output = model.generate(**self._generate_kwargs(prompt, max_new_tokens, temperature))
+        return tokenizer.decode(output[0], skip_special_tokens=True).strip()
+
+    def stream(self, prompt: str, max_new_tokens: int = 200, temperature: float = 0.3) -> Iterator[str]:
+        from transformers import TextIteratorStreamer
+
+        tokenizer, model = self._load()
+        streamer = TextIteratorStreamer(tokenizer, skip_special_tokens=True, timeout=LOCAL_LLM_STREAM_TIMEOUT)
+        kwargs = self._generate_kwargs(prompt, max_new_tokens, temperature)
+        kwargs['streamer'] = streamer
+        errors = []
+
+        def run():
+            try:
+                model.generate(**kwargs)
+            except Exception as e:
+                # Báo kết thúc cho streamer, nếu không vòng lặp bên dưới chờ mãi
+                errors.append(e)
+                streamer.end()
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        try:
+            for text in streamer:
+                if text:
+                    yield text
+        except queue.Empty:
+            raise TimeoutError(f"Mô hình cục bộ không trả về trong {LOCAL_LLM_STREAM_TIMEOUT}s")
+        thread.join()
+        if errors:
+            raise errors[0]
+
+
+class LocalRoutingPolicy:
+    """
+    Quyết định yêu cầu nào được gửi cho mô hình cục bộ trước provider.
+
+    Yêu cầu có nội dung ngắn hơn ngưỡng của tác vụ được xử lý cục bộ
+    (không tốn độ trễ API, chạy được khi offline); yêu cầu dài hơn đi thẳng
+    tới provider. Mặc định mọi ngưỡng là 0 (tắt): định tuyến cục bộ phải được
+    bật rõ ràng qua biến môi trường.
+    """
+
+    def __init__(self, backend: LocalLLMBackend, max_chars: Optional[Dict[str, int]] = None):
+        self.backend = backend
+        self.max_chars = max_chars if max_chars is not None else {
+            'rewrite': int(os.environ.get('LOCAL_LLM_REWRITE_MAX_CHARS', '0')),
+            'context': int(os.environ.get('LOCAL_LLM_CONTEXT_MAX_CHARS', '0')),
+        }
+
+    def prefer_local(self, task: str, text: str) -> bool:
+        limit = self.max_chars.get(task, 0)
+        return bool(limit) and bool(text) and len(text) <= limit and self.backend.available
+
+
+_backend = None
+
+
+def get_local_backend() -> LocalLLMBackend:
+    """Trả về backend cục bộ dùng chung theo cấu hình LOCAL_LLM_BACKEND"""
+    global _backend
+    if _backend is None:
+        backend_name = os.environ.get('LOCAL_LLM_BACKEND', 'transformers').lower()
+        if backend_name == 'transformers':
+            _backend = TransformersSeq2SeqBackend()
+        else:
+            _backend = LocalLLMBackend()
+    return _backend
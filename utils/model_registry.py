@@ -0,0 +1,58 @@
+"""
+Registry dùng chung cho các mô hình ML nặng (SentenceTransformer, pipeline NER...).
+
+Mỗi mô hình chỉ được nạp một lần cho mỗi tiến trình. Khi chạy gunicorn với
+``preload_app`` các mô hình được nạp trong master, chuyển sang chế độ chỉ đọc
+và "đóng băng" trước khi fork để các worker dùng chung trang bộ nhớ
+(copy-on-write) thay vì mỗi worker giữ một bản sao riêng.
+"""
+import gc
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SBERT_MODEL = 'all-MiniLM-L6-v2'
+
+_lock = threading.Lock()
+_sentence_models = {}
+
+
+def freeze_module(module):
+    """Chuyển một mô hình torch sang chế độ suy luận, không lưu gradient"""
+    try:
+        module.eval()
+        for param in module.parameters():
+            param.requires_grad_(False)
+    except Exception as e:
+        logger.warning(f"Không thể đóng băng mô hình {type(module).__name__}: {e}")
+    return module
+
+
+def get_sentence_transformer(model_name: str = DEFAULT_SBERT_MODEL, device: str = 'cpu'):
+    """Trả về SentenceTransformer dùng chung, nạp lần đầu khi cần"""
+    key = (model_name, device)
+    model = _sentence_models.get(key)
+    if model is None:
+        with _lock:
+            model = _sentence_models.get(key)
+            if model is None:
+                from sentence_transformers import SentenceTransformer
+                model = freeze_module(SentenceTransformer(model_name, device=device))
+                _sentence_models[key] = model
+                logger.info(f"Đã nạp SentenceTransformer '{model_name}' ({device})")
+    return model
+
+
+def freeze_shared_state():
+    """
+    Đóng băng toàn bộ đối tượng Python hiện có trước khi fork worker.
+
+    gc.freeze() chuyển các đối tượng vào thế hệ vĩnh viễn nên bộ thu gom rác
+    trong worker không ghi vào header của chúng, tránh làm bẩn các trang bộ
+    nhớ đang được chia sẻ với master.
+    """
+    gc.collect()
+    if hasattr(gc, 'freeze'):
+        gc.freeze()
+        logger.info(f"Đã đóng băng {gc.get_freeze_count()} đối tượng trước khi fork")
@@ -0,0 +1,323 @@
+"""
+Ảnh chụp (snapshot) mô hình đã huấn luyện của EnhancedFieldMatcher.
+
+Mô hình phụ thuộc danh sách tên trường (gốc và đã tiền xử lý) và tham số huấn
+luyện, nên được lưu theo khóa băm của các thứ đó trong MODEL_SNAPSHOT_DIR:
+
+    <khóa>/tfidf_vocabulary.json   từ vựng TF-IDF
+    <khóa>/tfidf_idf.npy           vector IDF
+    <khóa>/word_vectors.kv(+ .npy) KeyedVectors của Word2Vec, mảng lưu riêng
+    <khóa>/field_embeddings.npy    EmbeddingStore: embedding trung bình của từng
+                                   trường, đã chuẩn hóa và lượng tử hóa
+    <khóa>/manifest.json           tên trường, tham số, recall của embedding; ghi cuối cùng
+    <khóa>/sbert_<mô hình>.*       embedding SBERT của tên trường, thêm vào ở
+                                   warm-up hoặc khi cần lần đầu (xem
+                                   ModelSnapshotStore.sbert_embeddings)
+
+Thư mục được dựng trong thư mục tạm rồi đổi tên nguyên tử. Các mảng được nạp
+với mmap='r' nên mọi worker dùng chung trang bộ nhớ của page cache; trong một
+tiến trình, mô hình đã nạp được dùng lại cho mọi EnhancedFieldMatcher.
+"""
+import os
+import re
+import json
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+from gensim.models import KeyedVectors, Word2Vec
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from config.config import BASE_DIR
+from utils.json_store import file_lock
+from utils.embedding_store import EmbeddingStore, evaluate_recall
+
+logger = logging.getLogger(__name__)
+
+MODEL_SNAPSHOT_DIR = os.environ.get('MODEL_SNAPSHOT_DIR', os.path.join(BASE_DIR, 'model_snapshots'))
+MODEL_SNAPSHOT_KEEP = int(os.environ.get('MODEL_SNAPSHOT_KEEP', '3'))
+SNAPSHOT_FORMAT_VERSION = 2
+WORD2VEC_PARAMS = {'vector_size': 100, 'window': 5, 'min_count': 1, 'workers': 4, 'epochs': 20}
+
+
+class MatcherModels:
+    """Mô hình dùng chung (chỉ đọc) của EnhancedFieldMatcher"""
+
+    def __init__(self, key: str, field_names: List[str], vectorizer=None, field_vectors=None,
+                 word_vectors: Optional[KeyedVectors] = None, field_embeddings: Optional[EmbeddingStore] = None,
+                 embedding_quality: Optional[Dict] = None):
+        self.key = key
+        self.field_names = field_names
+        self.vectorizer = vectorizer
+        self.field_vectors = field_vectors
+        self.word_vectors = word_vectors
+        self.field_embeddings = field_embeddings or EmbeddingStore.from_vectors(
+            [], None, dim=WORD2VEC_PARAMS['vector_size'])
+        self.embedding_quality = embedding_quality
+        self._derived: Dict[str, Any] = {}
+        self._derived_locks: Dict[str, threading.Lock] = {}
+        self._derived_lock = threading.Lock()
+
+    def derived(self, name: str, build: Callable[['MatcherModels'], Any]) -> Any:
+        """
+        Cấu trúc chỉ đọc dựng từ field_names (chỉ mục gần đúng, blocking...),
+        dựng một lần rồi dùng chung cho mọi matcher của cùng ảnh chụp.
+        """
+        value = self._derived.get(name)
+        if value is None:
+            # Khóa riêng từng cấu trúc: mã hóa SBERT lâu không chặn việc dựng chỉ mục khác
+            with self._derived_lock:
+                lock = self._derived_locks.setdefault(name, threading.Lock())
+            with lock:
+                value = self._derived.get(name)
+                if value is None:
+                    value = build(self)
+                    self._derived[name] = value
+        return value
+
+
+def snapshot_key(field_names: List[str], processed_fields: List[str]) -> str:
+    """
+    Khóa của ảnh chụp. Tên gốc cũng được băm: hai tập tên khác nhau có thể cho
+    cùng tên đã tiền xử lý ("Họ tên" / "họ_tên"), mà field_names, embedding SBERT
+    và chỉ mục gần đúng của ảnh chụp đều theo tên gốc.
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps([SNAPSHOT_FORMAT_VERSION, WORD2VEC_PARAMS], sort_keys=True).encode('utf-8'))
+    for field_name, processed in zip(field_names, processed_fields):
+        digest.update(field_name.encode('utf-8') + b'\t' + processed.encode('utf-8') + b'\n')
+    return digest.hexdigest()[:32]
+
+
+def _field_embeddings(word_vectors: KeyedVectors, field_names: List[str], processed_fields: List[str]) -> Dict:
+    embeddings = {}
+    for field, processed in zip(field_names, processed_fields):
+        vectors = [word_vectors[token] for token in processed.split() if token in word_vectors]
+        if vectors:
+            embeddings[field] = np.mean(vectors, axis=0)
+    return embeddings
+
+
+def train_models(key: str, field_names: List[str], processed_fields: List[str]) -> MatcherModels:
+    """Huấn luyện TF-IDF và Word2Vec từ tên trường đã tiền xử lý"""
+    vectorizer = TfidfVectorizer()
+    field_vectors = vectorizer.fit_transform(processed_fields)
+    word_vectors = None
+    embeddings = None
+    quality = None
+    sentences = [field.split() for field in processed_fields if field.split()]
+    if sentences:
+        word_vectors = Word2Vec(sentences, **WORD2VEC_PARAMS).wv
+        vectors = _field_embeddings(word_vectors, field_names, processed_fields)
+        embeddings = EmbeddingStore.from_dict(vectors, dim=WORD2VEC_PARAMS['vector_size'])
+        if vectors:
+            # Đo mức mất recall của bản lượng tử hóa so với float32 đầy đủ
+            quality = evaluate_recall(np.stack(list(vectors.values())), embeddings)
+            logger.info(f"Embedding trường {embeddings.dtype}: recall@{quality['k']} = "
+                        f"{quality['recall_at_k']}, {quality['bytes']} byte "
+                        f"(float64: {quality['float64_bytes']})")
+    return MatcherModels(key, field_names, vectorizer, field_vectors, word_vectors, embeddings, quality)
+
+
+def save_models(models: MatcherModels, processed_fields: List[str], directory: str):
+    """Ghi ảnh chụp vào directory (tạo mới bằng đổi tên nguyên tử)"""
+    parent = os.path.dirname(directory)
+    os.makedirs(parent, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix='.' + os.path.basename(directory) + '.', dir=parent)
+    try:
+        vocabulary = {term: int(index) for term, index in models.vectorizer.vocabulary_.items()}
+        with open(os.path.join(tmp_dir, 'tfidf_vocabulary.json'), 'w', encoding='utf-8') as f:
+            json.dump(vocabulary, f, ensure_ascii=False)
+        np.save(os.path.join(tmp_dir, 'tfidf_idf.npy'), models.vectorizer.idf_)
+
+        if models.word_vectors is not None:
+            # Lưu mảng vectors thành file .npy riêng để nạp được bằng mmap
+            models.word_vectors.save(os.path.join(tmp_dir, 'word_vectors.kv'), separately=['vectors'])
+        embeddings_meta = models.field_embeddings.save(tmp_dir, 'field_embeddings')
+
+        manifest = {
+            'format': SNAPSHOT_FORMAT_VERSION,
+            'key': models.key,
+            'params': WORD2VEC_PARAMS,
+            'field_names': models.field_names,
+            'processed_fields': processed_fields,
+            'field_embeddings': embeddings_meta,
+            'embedding_quality': models.embedding_quality,
+            'has_word_vectors': models.word_vectors is not None,
+        }
+        with open(os.path.join(tmp_dir, 'manifest.json'), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(tmp_dir, directory)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+
+def load_models(directory: str) -> MatcherModels:
+    """Nạp ảnh chụp, các mảng lớn được memory-map chỉ đọc"""
+    with open(os.path.join(directory, 'manifest.json'), 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    with open(os.path.join(directory, 'tfidf_vocabulary.json'), 'r', encoding='utf-8') as f:
+        vocabulary = json.load(f)
+
+    # Vectorizer với từ vựng cố định và IDF đã học: không phải fit lại
+    vectorizer = TfidfVectorizer(vocabulary=vocabulary)
+    vectorizer.idf_ = np.load(os.path.join(directory, 'tfidf_idf.npy'))
+    field_vectors = vectorizer.transform(manifest['processed_fields'])
+
+    word_vectors = None
+    if manifest['has_word_vectors']:
+        word_vectors = KeyedVectors.load(os.path.join(directory, 'word_vectors.kv'), mmap='r')
+    embeddings = EmbeddingStore.load(directory, 'field_embeddings', manifest['field_embeddings'])
+    return MatcherModels(manifest['key'], manifest['field_names'], vectorizer, field_vectors,
+                         word_vectors, embeddings, manifest.get('embedding_quality'))
+
+
+class ModelSnapshotStore:
+    """Tìm mô hình theo khóa: bộ nhớ tiến trình -> đĩa -> huấn luyện và ghi"""
+
+    def __init__(self, root: str = MODEL_SNAPSHOT_DIR, keep: int = MODEL_SNAPSHOT_KEEP):
+        self.root = root
+        self.keep = keep
+        self._loaded: Dict[str, MatcherModels] = {}
+        self._lock = threading.Lock()
+        # tên mô hình SBERT -> kho embedding mới nhất, để ảnh chụp sau chỉ mã hóa tên mới
+        self._latest_sbert: Dict[str, EmbeddingStore] = {}
+
+    def get(self, field_names: List[str], processed_fields: List[str]) -> MatcherModels:
+        key = snapshot_key(field_names, processed_fields)
+        models = self._loaded.get(key)
+        if models is not None:
+            return models
+        with self._lock:
+            models = self._loaded.get(key)
+            if models is None:
+                models = self._load_or_train(key, field_names, processed_fields)
+                # Chỉ giữ bản mới nhất trong bộ nhớ; bản cũ được giải phóng khi matcher cũ hết dùng
+                self._loaded = {key: models}
+            return models
+
+    def _load_or_train(self, key: str, field_names: List[str], processed_fields: List[str]) -> MatcherModels:
+        directory = os.path.join(self.root, key)
+        models = self._try_load(directory)
+        if models is not None:
+            return models
+        os.makedirs(self.root, exist_ok=True)
+        with file_lock(directory):
+            # Worker khác có thể vừa huấn luyện xong trong lúc chờ khóa
+            models = self._try_load(directory)
+            if models is not None:
+                return models
+            models = train_models(key, field_names, processed_fields)
+            try:
+                save_models(models, processed_fields, directory)
+                logger.info(f"Đã lưu ảnh chụp mô hình {key} ({len(field_names)} trường)")
+                self._prune(exclude=key)
+            except OSError as e:
+                logger.warning(f"Không lưu được ảnh chụp mô hình {key}: {e}")
+                return models
+        # Dùng bản đã memory-map thay vì bản vừa huấn luyện để chia sẻ trang với worker khác
+        return self._try_load(directory) or models
+
+    def sbert_embeddings(self, models: MatcherModels, model_name: str,
+                         encode: Callable[[List[str]], np.ndarray]) -> EmbeddingStore:
+        """
+        Embedding SBERT của mọi tên trường trong models, mã hóa một lần theo lô.
+
+        Được thêm vào thư mục ảnh chụp của models (mọi worker nạp lại bằng
+        mmap); nếu thư mục không ghi được thì chỉ giữ trong bộ nhớ. Tên đã có
+        trong kho của ảnh chụp trước được dùng lại, chỉ tên mới được mã hóa.
+        """
+        return models.derived('sbert:' + model_name,
+                              lambda models: self._build_sbert(models, model_name, encode))
+
+    def _build_sbert(self, models: MatcherModels, model_name: str, encode: Callable) -> EmbeddingStore:
+        directory = os.path.join(self.root, models.key)
+        name = 'sbert_' + re.sub(r'[^\w.-]', '_', model_name)
+        store = self._load_sbert(directory, name)
+        if store is None and os.path.isdir(directory):
+            with file_lock(os.path.join(directory, name)):
+                store = self._load_sbert(directory, name) or self._encode_sbert(
+                    models, model_name, encode, directory, name)
+        if store is None:
+            store = self._encode_incremental(models, model_name, encode)
+        self._latest_sbert[model_name] = store
+        return store
+
+    def _encode_incremental(self, models: MatcherModels, model_name: str, encode: Callable) -> EmbeddingStore:
+        """Mã hóa các tên chưa có trong kho trước đó, tên còn lại lấy lại vector đã có"""
+        previous = self._latest_sbert.get(model_name)
+        reused = [name for name in models.field_names if previous is not None and name in previous]
+        missing = [name for name in models.field_names if previous is None or name not in previous]
+        vectors = {name: previous.vector(name) for name in reused}
+        if missing:
+            vectors.update(zip(missing, encode(missing)))
+        if reused:
+            logger.info(f"Embedding SBERT {model_name}: dùng lại {len(reused)} tên, mã hóa {len(missing)} tên mới")
+        return EmbeddingStore.from_vectors(models.field_names, [vectors[name] for name in models.field_names])
+
+    def _load_sbert(self, directory: str, name: str) -> Optional[EmbeddingStore]:
+        try:
+            with open(os.path.join(directory, name + '.json'), 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            return EmbeddingStore.load(directory, name, meta)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Không nạp được embedding SBERT {directory}/{name}: {e}")
+            return None
+
+    def _encode_sbert(self, models: MatcherModels, model_name: str, encode: Callable,
+                      directory: str, name: str) -> EmbeddingStore:
+        store = self._encode_incremental(models, model_name, encode)
+        try:
+            meta = store.save(directory, name)
+            meta_path = os.path.join(directory, name + '.json')
+            with open(meta_path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(meta, f, ensure_ascii=False)
+            # Metadata ghi cuối cùng: có file .json nghĩa là các mảng đã đầy đủ
+            os.replace(meta_path + '.tmp', meta_path)
+            logger.info(f"Đã lưu embedding SBERT {name} cho {len(store)} trường ({store.nbytes} byte)")
+            return self._load_sbert(directory, name) or store
+        except OSError as e:
+            logger.warning(f"Không lưu được embedding SBERT {name}: {e}")
+            return store
+
+    def _try_load(self, directory: str) -> Optional[MatcherModels]:
+        if not os.path.exists(os.path.join(directory, 'manifest.json')):
+            return None
+        try:
+            return load_models(directory)
+        except Exception as e:
+            logger.warning(f"Không nạp được ảnh chụp mô hình {directory}: {e}")
+            return None
+
+    def _prune(self, exclude: str):
+        """Xóa các ảnh chụp cũ, giữ lại keep bản mới nhất"""
+        try:
+            entries = [entry for entry in os.scandir(self.root)
+                       if entry.is_dir() and not entry.name.startswith('.') and entry.name != exclude]
+        except OSError:
+            return
+        entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+        for entry in entries[max(0, self.keep - 1):]:
+            shutil.rmtree(entry.path, ignore_errors=True)
+            try:
+                os.remove(entry.path + '.lock')
+            except OSError:
+                pass
+
+
+_store = None
+
+
+def get_model_snapshot_store() -> ModelSnapshotStore:
+    """ModelSnapshotStore dùng chung trong tiến trình"""
+    global _store
+    if _store is None:
+        _store = ModelSnapshotStore()
+    return _store
@@ -0,0 +1,147 @@
+"""
+Lắp ráp nội dung biểu mẫu cho prompt LLM theo ngân sách token.
+
+Thay vì cắt cứng form_text[:N] (làm mất phần cuối biểu mẫu và tốn token cho
+phần mở đầu lặp lại), nội dung được:
+    1. bỏ các dòng trống và dòng trùng lặp (trừ dòng chứa ô cần điền: mỗi
+       dòng "…………" lặp lại là một ô riêng),
+    2. chấm điểm từng dòng: dòng chứa ô cần điền, dòng lân cận và tiêu đề
+       được ưu tiên,
+    3. chọn các dòng có điểm cao nhất cho tới khi hết ngân sách token (dòng
+       dài hơn phần ngân sách còn lại được cắt theo token), rồi xuất lại
+       theo thứ tự gốc.
+"""
+import re
+import logging
+from typing import List, Optional, Tuple
+
+from config.config import PROMPT_TOKEN_BUDGET
+
+logger = logging.getLogger(__name__)
+
+# Cùng mẫu ô cần điền với utils.document_utils.extract_fields
+FIELD_PLACEHOLDER_PATTERN = re.compile(r"\[_\d+_\]|_{4,}|\.{4,}|\[fill\]|\[\s*\d+\s*\]")
+
+GAP_MARKER = "..."
+# Phần ngân sách còn lại tối thiểu để cắt một dòng dài thay vì bỏ qua
+MIN_TRUNCATED_TOKENS = 8
+
+_encoding = None
+_encoding_loaded = False
+
+
+def _get_encoding():
+    """Nạp tokenizer tiktoken nếu có (đếm token chính xác cho mô hình OpenAI)"""
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            logger.warning(f"tiktoken không khả dụng, dùng ước lượng số token: {e}")
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    """Đếm số token của văn bản"""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    # Ước lượng: tiếng Việt có dấu thường tốn ~1 token cho mỗi 2-3 ký tự
+    return max(1, len(text) // 3)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cắt văn bản còn tối đa max_tokens token"""
+    if max_tokens <= 0:
+        return ""
+    encoding = _get_encoding()
+    if encoding is not None:
+        tokens = encoding.encode(text)
+        if len(tokens) <= max_tokens:
+            return text
+        # Giải mã có thể sinh thêm ký tự thay thế ở điểm cắt giữa một ký tự nhiều byte
+        return encoding.decode(tokens[:max_tokens]).rstrip("\ufffd")
+    return text[:max_tokens * 3]
+
+
+def _normalize_line(line: str) -> str:
+    return re.sub(r"\s+", " ", line).strip().lower()
+
+
+def _score_lines(lines: List[str], window: int) -> List[float]:
+    """Chấm điểm quan trọng cho từng dòng"""
+    placeholder_rows = [i for i, line in enumerate(lines) if FIELD_PLACEHOLDER_PATTERN.search(line)]
+    scores = [0.1] * len(lines)
+
+    for i in placeholder_rows:
+        scores[i] = max(scores[i], 1.0)
+        for offset in range(1, window + 1):
+            weight = 0.6 / offset
+            if i - offset >= 0:
+                scores[i - offset] = max(scores[i - offset], weight)
+            if i + offset < len(lines):
+                scores[i + offset] = max(scores[i + offset], weight * 0.5)
+
+    # Các dòng đầu thường là tiêu đề / loại biểu mẫu
+    for i in range(min(3, len(lines))):
+        scores[i] = max(scores[i], 0.9 - 0.1 * i)
+    return scores
+
+
+def compress_form_text(form_text: str, token_budget: Optional[int] = None, window: int = 1) -> str:
+    """
+    Rút gọn nội dung biểu mẫu cho vừa ngân sách token mà vẫn giữ các ô cần điền.
+
+    Args:
+        form_text: nội dung biểu mẫu (mỗi đoạn một dòng)
+        token_budget: số token tối đa, mặc định PROMPT_TOKEN_BUDGET
+        window: số dòng lân cận quanh ô cần điền được ưu tiên giữ lại
+    """
+    if not form_text:
+        return ""
+    token_budget = token_budget or PROMPT_TOKEN_BUDGET
+
+    lines = []
+    seen = set()
+    for raw_line in form_text.splitlines():
+        line = raw_line.strip()
+        key = _normalize_line(line)
+        if not key or (key in seen and not FIELD_PLACEHOLDER_PATTERN.search(line)):
+            continue
+        seen.add(key)
+        lines.append(line)
+
+    line_tokens = [count_tokens(line) for line in lines]
+    if sum(line_tokens) <= token_budget:
+        return "\n".join(lines)
+
+    scores = _score_lines(lines, window)
+    # Ưu tiên điểm cao, cùng điểm thì giữ dòng xuất hiện trước
+    ranked: List[Tuple[float, int]] = sorted(((-score, i) for i, score in enumerate(scores)))
+
+    selected = {}
+    used = 0
+    for _, i in ranked:
+        remaining = token_budget - used
+        if line_tokens[i] <= remaining:
+            selected[i] = lines[i]
+            used += line_tokens[i]
+        elif remaining >= MIN_TRUNCATED_TOKENS:
+            # Dòng dài (đoạn văn không xuống dòng) vẫn giữ phần đầu thay vì bị bỏ cả dòng
+            truncated = truncate_to_tokens(lines[i], remaining - 1)
+            if truncated:
+                selected[i] = truncated + "…"
+                used += count_tokens(selected[i])
+
+    output = []
+    previous = -1
+    for i in sorted(selected):
+        if previous >= 0 and i != previous + 1:
+            output.append(GAP_MARKER)
+        output.append(selected[i])
+        previous = i
+    return "\n".join(output)
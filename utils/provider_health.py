@@ -0,0 +1,200 @@
+"""
+Theo dõi sức khỏe của provider AI và từng API key để định tuyến trước khi gọi.
+
+Mỗi (provider, key) có một cửa sổ trượt các lượt gọi gần nhất (độ trễ, thành
+công/thất bại) và một circuit breaker:
+    - closed:    nhận request bình thường;
+    - open:      bị loại khỏi định tuyến sau nhiều lỗi liên tiếp hoặc tỷ lệ lỗi
+                 cao, trong khoảng thời gian chờ (tăng dần mỗi lần mở lại);
+    - half_open: hết thời gian chờ, cho đúng một request thử; thành công thì
+                 đóng lại, thất bại thì mở lại.
+
+Khi có nhiều key khỏe, key được chọn theo "power of two choices": lấy ngẫu
+nhiên hai key và dùng key có chi phí kỳ vọng (độ trễ EWMA x tỷ lệ lỗi) thấp
+hơn, giúp dàn tải mà không dồn hết vào một key.
+"""
+import os
+import time
+import random
+import logging
+import threading
+from collections import deque
+from typing import Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# Lỗi cho thấy key không dùng được một thời gian (hết hạn mức, sai key...)
+_FATAL_ERROR_MARKERS = ('quota', 'rate limit', 'rate_limit', '429', 'invalid api key',
+                        'incorrect api key', 'api_key_invalid', 'deactivated', 'expired')
+
+
+class KeyHealth:
+    """Thống kê trượt và trạng thái circuit của một API key"""
+
+    def __init__(self, window: int):
+        self.calls = deque(maxlen=window)  # (thời điểm, độ trễ giây, thành công)
+        self.ewma_latency = None
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.open_seconds = 0.0
+        self.trial_in_flight = False
+        self.last_error = None
+
+    @property
+    def error_rate(self) -> float:
+        if not self.calls:
+            return 0.0
+        return sum(1 for _, _, ok in self.calls if not ok) / len(self.calls)
+
+    def latency_percentile(self, percentile: float) -> Optional[float]:
+        latencies = sorted(latency for _, latency, ok in self.calls if ok)
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * percentile))]
+
+    def cost(self) -> float:
+        """Chi phí kỳ vọng của một lượt gọi; key chưa có số liệu được ưu tiên thử"""
+        if self.ewma_latency is None:
+            return 0.0
+        return self.ewma_latency * (1.0 + 4.0 * self.error_rate)
+
+
+class ProviderHealthTracker:
+    """Circuit breaker và cân bằng tải theo (provider, key_id)"""
+
+    def __init__(self, failure_threshold: int = 3, error_rate_threshold: float = 0.5,
+                 min_calls: int = 10, base_open_seconds: float = 30.0,
+                 max_open_seconds: float = 600.0, window: int = 50):
+        self.failure_threshold = failure_threshold
+        self.error_rate_threshold = error_rate_threshold
+        self.min_calls = min_calls
+        self.base_open_seconds = base_open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.window = window
+        self._keys: Dict[tuple, KeyHealth] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, provider: str, key_id) -> KeyHealth:
+        health = self._keys.get((provider, key_id))
+        if health is None:
+            health = self._keys[(provider, key_id)] = KeyHealth(self.window)
+        return health
+
+    def _open(self, health: KeyHealth, now: float, fatal: bool = False):
+        if health.state == CLOSED:
+            health.open_seconds = self.base_open_seconds
+        else:
+            health.open_seconds = min(self.max_open_seconds, max(health.open_seconds, self.base_open_seconds) * 2)
+        if fatal:
+            health.open_seconds = self.max_open_seconds
+        health.state = OPEN
+        health.opened_at = now
+        health.trial_in_flight = False
+
+    def _allow(self, health: KeyHealth, now: float) -> bool:
+        if health.state == CLOSED:
+            return True
+        if health.state == OPEN and now - health.opened_at >= health.open_seconds:
+            health.state = HALF_OPEN
+            health.trial_in_flight = False
+        return health.state == HALF_OPEN and not health.trial_in_flight
+
+    def is_available(self, provider: str, key_id) -> bool:
+        """Key có đang nhận request không (không đánh dấu lượt thử)"""
+        with self._lock:
+            return self._allow(self._get(provider, key_id), time.time())
+
+    def choose(self, provider: str, key_ids: Iterable, exclude: Iterable = ()) -> Optional[int]:
+        """
+        Chọn key để gọi trong danh sách key_ids, bỏ qua key đang mở circuit.
+
+        Returns:
+            key_id được chọn hoặc None nếu không còn key khỏe
+        """
+        excluded = set(exclude)
+        now = time.time()
+        with self._lock:
+            candidates = [key_id for key_id in key_ids
+                          if (provider, key_id) not in excluded and self._allow(self._get(provider, key_id), now)]
+            if not candidates:
+                return None
+            if len(candidates) == 1:
+                chosen = candidates[0]
+            else:
+                first, second = random.sample(candidates, 2)
+                chosen = first if self._get(provider, first).cost() <= self._get(provider, second).cost() else second
+            health = self._get(provider, chosen)
+            if health.state == HALF_OPEN:
+                health.trial_in_flight = True
+            return chosen
+
+    def record(self, provider: str, key_id, success: bool, latency: float, error: Optional[str] = None):
+        """Ghi nhận kết quả một lượt gọi provider"""
+        now = time.time()
+        with self._lock:
+            health = self._get(provider, key_id)
+            health.calls.append((now, latency, success))
+            if success:
+                health.consecutive_failures = 0
+                health.ewma_latency = latency if health.ewma_latency is None else 0.8 * health.ewma_latency + 0.2 * latency
+                if health.state != CLOSED:
+                    logger.info(f"Đóng lại circuit của {provider} key {key_id}")
+                health.state = CLOSED
+                health.trial_in_flight = False
+                return
+
+            health.consecutive_failures += 1
+            health.last_error = (error or '')[:300]
+            fatal = any(marker in health.last_error.lower() for marker in _FATAL_ERROR_MARKERS)
+            too_many_errors = len(health.calls) >= self.min_calls and health.error_rate >= self.error_rate_threshold
+            if (health.state == HALF_OPEN or fatal
+                    or health.consecutive_failures >= self.failure_threshold or too_many_errors):
+                self._open(health, now, fatal=fatal)
+                logger.warning(
+                    f"Mở circuit của {provider} key {key_id} trong {health.open_seconds:.0f}s: {health.last_error}"
+                )
+
+    def release(self, provider: str, key_id):
+        """Trả lượt thử half-open khi request bị hủy giữa chừng (không phải lỗi provider)"""
+        with self._lock:
+            self._get(provider, key_id).trial_in_flight = False
+
+    def snapshot(self) -> Dict:
+        """Trạng thái hiện tại của từng key (dùng cho trang quản trị)"""
+        now = time.time()
+        with self._lock:
+            result = {}
+            for (provider, key_id), health in self._keys.items():
+                p50 = health.latency_percentile(0.5)
+                p95 = health.latency_percentile(0.95)
+                result[f"{provider}:{key_id}"] = {
+                    'state': health.state,
+                    'calls': len(health.calls),
+                    'error_rate': round(health.error_rate, 3),
+                    'p50_ms': round(p50 * 1000) if p50 is not None else None,
+                    'p95_ms': round(p95 * 1000) if p95 is not None else None,
+                    'consecutive_failures': health.consecutive_failures,
+                    'reopen_in_seconds': (round(max(0.0, health.open_seconds - (now - health.opened_at)), 1)
+                                          if health.state == OPEN else 0),
+                    'last_error': health.last_error,
+                }
+            return result
+
+
+_tracker = None
+
+
+def get_health_tracker() -> ProviderHealthTracker:
+    """ProviderHealthTracker dùng chung trong tiến trình"""
+    global _tracker
+    if _tracker is None:
+        _tracker = ProviderHealthTracker(
+            failure_threshold=int(os.environ.get('AI_CIRCUIT_FAILURES', '3')),
+            base_open_seconds=float(os.environ.get('AI_CIRCUIT_OPEN_SECONDS', '30')),
+        )
+    return _tracker
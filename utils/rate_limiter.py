@@ -0,0 +1,116 @@
+"""
+Giới hạn tốc độ gọi provider AI theo từng API key.
+
+Hai lớp giới hạn được kiểm tra trước mỗi lượt gọi:
+    - token bucket theo số request/phút của key: hạn mức provider báo cho key
+      (cột rpm_limit, lấy từ header x-ratelimit-limit-requests khi kiểm tra
+      key) hoặc mặc định của provider (AI_OPENAI_RPM, AI_GEMINI_RPM), chia đều
+      cho số worker gunicorn (GUNICORN_WORKERS, được gunicorn.conf.py đặt theo
+      số worker thật) để tổng của mọi worker không vượt hạn mức của provider;
+    - hạn mức theo chu kỳ của key (cột usage_limit, đặt ở trang quản trị
+      API key; chu kỳ bắt đầu khi hạn mức được đặt): số request đã dùng
+      trong chu kỳ hiện tại (total_requests, đặt lại khi tới usage_reset_at)
+      cộng với số request chưa ghi xuống DB.
+
+Key hết token hoặc hết hạn mức bị bỏ qua khi định tuyến, nên tải được dàn
+sang key khác và dừng trước khi provider trả lỗi 429.
+"""
+import os
+import time
+import threading
+from typing import Dict, Optional
+
+DEFAULT_RPM = {
+    'openai': int(os.environ.get('AI_OPENAI_RPM', '500')),
+    'gemini': int(os.environ.get('AI_GEMINI_RPM', '15')),
+}
+# Độ dài chu kỳ hạn mức khi usage_reset_at được đặt lại
+USAGE_WINDOW_SECONDS = int(os.environ.get('API_KEY_USAGE_WINDOW', str(24 * 3600)))
+
+
+class TokenBucket:
+    """Token bucket: nạp rate token mỗi giây, tối đa capacity token"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def available(self) -> bool:
+        with self._lock:
+            self._refill(time.monotonic())
+            return self._tokens >= 1
+
+    def try_acquire(self, tokens: float = 1) -> bool:
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens < tokens:
+                return False
+            self._tokens -= tokens
+            return True
+
+
+def worker_count() -> int:
+    """Số worker gunicorn chia nhau hạn mức của provider (1 khi chạy một tiến trình)"""
+    return max(1, int(os.environ.get('GUNICORN_WORKERS', '1')))
+
+
+class KeyRateLimiter:
+    """Token bucket và kiểm tra hạn mức cho từng (provider, key_id)"""
+
+    def __init__(self, rpm: Optional[Dict[str, int]] = None, workers: Optional[int] = None):
+        self.rpm = dict(DEFAULT_RPM, **(rpm or {}))
+        self.workers = max(1, workers or worker_count())
+        self._buckets: Dict[tuple, tuple] = {}  # (provider, key_id) -> (rpm, TokenBucket)
+        self._lock = threading.Lock()
+
+    def set_workers(self, workers: int):
+        """Đổi số worker chia hạn mức; các bucket được tạo lại theo số mới"""
+        with self._lock:
+            self.workers = max(1, workers)
+            self._buckets = {}
+
+    def _bucket(self, provider: str, key_id, key_rpm: Optional[int] = None) -> Optional[TokenBucket]:
+        rpm = key_rpm or self.rpm.get(provider, 0)
+        if rpm <= 0:
+            return None  # không giới hạn
+        entry = self._buckets.get((provider, key_id))
+        if entry is None or entry[0] != rpm:
+            with self._lock:
+                entry = self._buckets.get((provider, key_id))
+                if entry is None or entry[0] != rpm:
+                    per_worker = rpm / self.workers
+                    bucket = TokenBucket(rate=per_worker / 60.0, capacity=max(1.0, per_worker / 6))
+                    entry = (rpm, bucket)
+                    self._buckets[(provider, key_id)] = entry
+        return entry[1]
+
+    def has_capacity(self, provider: str, key_id, key_rpm: Optional[int] = None) -> bool:
+        bucket = self._bucket(provider, key_id, key_rpm)
+        return bucket is None or bucket.available()
+
+    def try_acquire(self, provider: str, key_id, key_rpm: Optional[int] = None) -> bool:
+        bucket = self._bucket(provider, key_id, key_rpm)
+        return bucket is None or bucket.try_acquire()
+
+    @staticmethod
+    def within_quota(usage_limit: Optional[int], used_requests: int) -> bool:
+        """Key còn hạn mức trong chu kỳ hiện tại không"""
+        return not usage_limit or used_requests < usage_limit
+
+
+_limiter = None
+
+
+def get_rate_limiter() -> KeyRateLimiter:
+    """KeyRateLimiter dùng chung trong tiến trình"""
+    global _limiter
+    if _limiter is None:
+        _limiter = KeyRateLimiter()
+    return _limiter
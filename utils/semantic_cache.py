@@ -0,0 +1,223 @@
+"""
+Cache ngữ nghĩa cho kết quả viết lại nội dung bằng LLM.
+
+Mỗi mục được nhúng bằng SBERT từ (tên trường, loại biểu mẫu, nội dung nhập).
+Khi có yêu cầu mới, cache tìm mục gần nhất theo cosine trong ma trận
+embedding đã chuẩn hóa (một phép nhân ma trận) và trả lại kết quả cũ nếu độ
+tương đồng vượt ngưỡng, bỏ qua lượt gọi API.
+
+Cosine của SBERT không phân biệt được "3 năm" với "5 năm kinh nghiệm", nên
+chỉ so với các mục có cùng chữ ký nội dung: tập các từ không phải hư từ (kể
+cả mọi số) của nội dung nhập phải trùng khớp. Độ tương đồng ngữ nghĩa chỉ
+còn bù cho khác biệt về tên trường, hư từ, thứ tự từ và dấu câu.
+
+Ngữ cảnh biểu mẫu đưa vào prompt cũng làm kết quả khác đi: băm của ngữ cảnh
+nằm trong khóa chính xác và trong chữ ký, nên hai biểu mẫu cùng loại nhưng
+khác ngữ cảnh không dùng kết quả của nhau.
+
+Cache và thống kê nằm trong từng tiến trình (mỗi worker gunicorn một bản).
+
+Vector được giữ trong ma trận cấp phát sẵn max_entries hàng dùng như bộ đệm
+vòng: mục mới ghi đè mục cũ nhất, không phải chép lại cả ma trận.
+"""
+import os
+import time
+import hashlib
+import logging
+import threading
+from typing import Dict, Optional
+
+import numpy as np
+
+from utils.model_registry import get_sentence_transformer
+from utils.field_ontology import tokenize_label
+
+logger = logging.getLogger(__name__)
+
+# Hư từ được bỏ qua khi so chữ ký nội dung
+_FUNCTION_WORDS = {
+    'và', 'của', 'các', 'có', 'được', 'trong', 'là', 'cho', 'những', 'với', 'này', 'đến',
+    'khi', 'về', 'như', 'từ', 'một', 'bị', 'đã', 'sẽ', 'cũng', 'vào', 'ra', 'nếu', 'để',
+    'tại', 'theo', 'sau', 'trên', 'hoặc', 'thì', 'mà', 'rất', 'đang',
+    'a', 'an', 'the', 'and', 'or', 'of', 'to', 'in', 'for', 'with', 'at', 'on',
+}
+
+
+def content_signature(text: str) -> str:
+    """Các từ nội dung (mọi từ trừ hư từ, giữ nguyên số) của text, sắp xếp và không lặp"""
+    return ' '.join(sorted({token for token in tokenize_label(text) if token not in _FUNCTION_WORDS}))
+
+
+def context_hash(context: Optional[str]) -> str:
+    """Băm ngắn của ngữ cảnh biểu mẫu dùng trong prompt ('' khi không có ngữ cảnh)"""
+    context = ' '.join((context or '').split())
+    return hashlib.sha256(context.encode('utf-8')).hexdigest()[:16] if context else ''
+
+
+class SemanticResponseCache:
+    """Cache kết quả LLM theo độ tương đồng ngữ nghĩa của yêu cầu"""
+
+    def __init__(self, threshold: float = 0.97, max_entries: int = 5000, ttl_seconds: int = 7 * 24 * 3600):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._model = None
+        self._vectors = None
+        self._entries = [None] * max_entries
+        self._next = 0
+        self._size = 0
+        self._exact = {}
+        # chữ ký nội dung -> các ô trong bộ đệm vòng
+        self._by_signature: Dict[str, set] = {}
+        self._stats = {
+            'hits': 0,
+            'exact_hits': 0,
+            'misses': 0,
+            'saved_seconds': 0.0,
+            'llm_seconds': 0.0,
+            'llm_calls': 0,
+        }
+
+    @staticmethod
+    def _request_text(field_name: str, user_input: str, form_type: Optional[str]) -> str:
+        return f"{(field_name or '').strip().lower()} | {(form_type or '').strip().lower()} | {user_input.strip()}"
+
+    @staticmethod
+    def _keys(text: str, user_input: str, context: Optional[str]):
+        """(khóa chính xác, chữ ký) của yêu cầu, cùng gắn với ngữ cảnh"""
+        context_key = context_hash(context)
+        exact_key = hashlib.sha256(f"{text} | {context_key}".encode('utf-8')).hexdigest()
+        return exact_key, f"{context_key}|{content_signature(user_input)}"
+
+    def _embed(self, text: str) -> np.ndarray:
+        if self._model is None:
+            self._model = get_sentence_transformer()
+        vector = np.asarray(self._model.encode([text])[0], dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _average_llm_seconds(self) -> float:
+        calls = self._stats['llm_calls']
+        return self._stats['llm_seconds'] / calls if calls else 0.0
+
+    def lookup(self, field_name: str, user_input: str, form_type: Optional[str] = None,
+               context: Optional[str] = None):
+        """
+        Tìm kết quả đã cache cho yêu cầu tương tự (cùng ngữ cảnh biểu mẫu).
+
+        Returns:
+            (response, vector): response là None nếu không có; vector dùng lại khi store()
+        """
+        text = self._request_text(field_name, user_input, form_type)
+        exact_key, signature = self._keys(text, user_input, context)
+        now = time.time()
+
+        with self._lock:
+            slot = self._exact.get(exact_key)
+            if slot is not None and now - self._entries[slot]['created_at'] <= self.ttl_seconds:
+                self._record_hit(slot, exact=True)
+                return self._entries[slot]['response'], None
+
+        vector = self._embed(text)
+        with self._lock:
+            slots = self._by_signature.get(signature)
+            if slots:
+                slots = np.fromiter(slots, dtype=np.int64, count=len(slots))
+                scores = self._vectors[slots] @ vector
+                best = int(np.argmax(scores))
+                slot = int(slots[best])
+                entry = self._entries[slot]
+                if scores[best] >= self.threshold and now - entry['created_at'] <= self.ttl_seconds:
+                    self._record_hit(slot, exact=False)
+                    return entry['response'], vector
+            self._stats['misses'] += 1
+        return None, vector
+
+    def _record_hit(self, slot: int, exact: bool):
+        self._entries[slot]['hits'] += 1
+        self._stats['hits'] += 1
+        if exact:
+            self._stats['exact_hits'] += 1
+        self._stats['saved_seconds'] += self._average_llm_seconds()
+
+    def record_llm_call(self, seconds: float):
+        """Ghi nhận thời gian một lượt gọi LLM thật (dùng để ước lượng thời gian tiết kiệm)"""
+        with self._lock:
+            self._stats['llm_calls'] += 1
+            self._stats['llm_seconds'] += seconds
+
+    def store(self, field_name: str, user_input: str, form_type: Optional[str], response: str,
+              vector: Optional[np.ndarray] = None, context: Optional[str] = None):
+        """Lưu kết quả của một yêu cầu vào cache"""
+        if not response:
+            return
+        text = self._request_text(field_name, user_input, form_type)
+        if vector is None:
+            vector = self._embed(text)
+        exact_key, signature = self._keys(text, user_input, context)
+
+        with self._lock:
+            if self._vectors is None or self._vectors.shape[1] != len(vector):
+                self._vectors = np.zeros((self.max_entries, len(vector)), dtype=np.float32)
+            slot = self._exact.get(exact_key)
+            if slot is None:
+                # Ghi đè mục cũ nhất trong bộ đệm vòng
+                slot = self._next
+                self._next = (self._next + 1) % self.max_entries
+                self._size = min(self._size + 1, self.max_entries)
+                self._drop(slot)
+            self._vectors[slot] = vector
+            self._entries[slot] = {
+                'key': exact_key,
+                'signature': signature,
+                'response': response,
+                'created_at': time.time(),
+                'hits': 0,
+            }
+            self._exact[exact_key] = slot
+            self._by_signature.setdefault(signature, set()).add(slot)
+
+    def _drop(self, slot: int):
+        """Gỡ mục đang chiếm ô slot khỏi các chỉ mục"""
+        old = self._entries[slot]
+        if old is None:
+            return
+        self._exact.pop(old['key'], None)
+        slots = self._by_signature.get(old['signature'])
+        if slots is not None:
+            slots.discard(slot)
+            if not slots:
+                del self._by_signature[old['signature']]
+        self._entries[slot] = None
+
+    def stats(self) -> Dict:
+        """Thống kê tỷ lệ trúng cache và thời gian API tiết kiệm được của tiến trình này"""
+        with self._lock:
+            lookups = self._stats['hits'] + self._stats['misses']
+            return {
+                'scope': 'worker',
+                'pid': os.getpid(),
+                'entries': self._size,
+                'hits': self._stats['hits'],
+                'exact_hits': self._stats['exact_hits'],
+                'misses': self._stats['misses'],
+                'hit_rate': round(self._stats['hits'] / lookups, 4) if lookups else 0.0,
+                'saved_seconds': round(self._stats['saved_seconds'], 2),
+                'avg_llm_seconds': round(self._average_llm_seconds(), 3),
+                'threshold': self.threshold,
+            }
+
+
+_rewrite_cache = None
+
+
+def get_rewrite_cache() -> SemanticResponseCache:
+    """Cache dùng chung cho kết quả viết lại nội dung trong tiến trình"""
+    global _rewrite_cache
+    if _rewrite_cache is None:
+        _rewrite_cache = SemanticResponseCache(
+            threshold=float(os.environ.get('REWRITE_CACHE_THRESHOLD', '0.97')),
+            max_entries=int(os.environ.get('REWRITE_CACHE_MAX_ENTRIES', '5000')),
+        )
+    return _rewrite_cache
@@ -0,0 +1,171 @@
+"""
+Chỉ mục toàn văn (inverted index) thuần Python cho tìm kiếm tiếng Việt.
+
+    - Văn bản được gấp dấu: chữ thường, bỏ dấu thanh và dấu mũ, 'đ' -> 'd',
+      nên "ho ten" khớp "Họ và tên".
+    - Mỗi tài liệu là danh sách (văn bản, trọng số); trọng số từ = số lần xuất
+      hiện x trọng số của phần văn bản chứa nó.
+    - Từ vựng được giữ sắp xếp để tìm theo tiền tố bằng bisect.
+    - Cập nhật theo từng tài liệu (update/remove/rename) để nơi gọi biết đoạn
+      dữ liệu đã đổi chỉ phải xử lý đúng các tài liệu đó; sync so toàn bộ tập
+      tài liệu bằng dấu vân tay (fingerprint), chỉ dùng cho tập nhỏ (mẫu biểu mẫu).
+
+Điểm xếp hạng: tổng theo từng từ truy vấn của trọng số x IDF. Mọi từ truy
+vấn đều phải khớp (AND).
+"""
+import re
+import math
+import threading
+import unicodedata
+from bisect import bisect_left, insort
+from typing import Dict, Hashable, List, Optional, Sequence, Tuple
+
+_TOKEN_PATTERN = re.compile(r'\w+')
+
+
+def fold_text(text) -> str:
+    """Chữ thường, bỏ dấu tiếng Việt"""
+    text = unicodedata.normalize('NFD', str(text or '').lower().replace('đ', 'd'))
+    return ''.join(ch for ch in text if unicodedata.category(ch) != 'Mn')
+
+
+def tokenize(text) -> List[str]:
+    return _TOKEN_PATTERN.findall(fold_text(text))
+
+
+class TextIndex:
+    """Inverted index: từ -> {doc_id: trọng số}"""
+
+    def __init__(self):
+        self._postings: Dict[str, Dict[Hashable, float]] = {}
+        self._doc_terms: Dict[Hashable, Dict[str, float]] = {}
+        self._fingerprints: Dict[Hashable, int] = {}
+        self._vocabulary: List[str] = []
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._doc_terms)
+
+    def _remove(self, doc_id):
+        for term in self._doc_terms.pop(doc_id, {}):
+            postings = self._postings[term]
+            postings.pop(doc_id, None)
+            if not postings:
+                del self._postings[term]
+                del self._vocabulary[bisect_left(self._vocabulary, term)]
+        self._fingerprints.pop(doc_id, None)
+
+    def update(self, doc_id: Hashable, texts: Sequence[Tuple[str, float]]) -> bool:
+        """
+        Thêm hoặc cập nhật một tài liệu.
+
+        Returns:
+            True nếu postings thay đổi, False nếu nội dung như lần trước
+        """
+        texts = tuple((str(text), weight) for text, weight in texts if text)
+        fingerprint = hash(texts)
+        with self._lock:
+            if self._fingerprints.get(doc_id) == fingerprint:
+                return False
+            self._remove(doc_id)
+            terms: Dict[str, float] = {}
+            for text, weight in texts:
+                for term in tokenize(text):
+                    terms[term] = terms.get(term, 0.0) + weight
+            for term, weight in terms.items():
+                postings = self._postings.get(term)
+                if postings is None:
+                    postings = self._postings[term] = {}
+                    insort(self._vocabulary, term)
+                postings[doc_id] = weight
+            self._doc_terms[doc_id] = terms
+            self._fingerprints[doc_id] = fingerprint
+            return True
+
+    def remove(self, doc_id: Hashable):
+        with self._lock:
+            self._remove(doc_id)
+
+    def rename(self, doc_id: Hashable, new_id: Hashable):
+        """Đổi mã một tài liệu, giữ nguyên postings (không tách từ lại)"""
+        with self._lock:
+            terms = self._doc_terms.pop(doc_id, None)
+            if terms is None:
+                return
+            for term, weight in terms.items():
+                postings = self._postings[term]
+                del postings[doc_id]
+                postings[new_id] = weight
+            self._doc_terms[new_id] = terms
+            self._fingerprints[new_id] = self._fingerprints.pop(doc_id)
+
+    def sync(self, documents: Dict[Hashable, Sequence[Tuple[str, float]]]) -> int:
+        """
+        Đưa chỉ mục về đúng tập tài liệu hiện có: cập nhật tài liệu đổi nội dung,
+        gỡ tài liệu không còn. Trả về số tài liệu đã thay đổi.
+        """
+        changed = 0
+        with self._lock:
+            for doc_id in [doc_id for doc_id in self._doc_terms if doc_id not in documents]:
+                self._remove(doc_id)
+                changed += 1
+            for doc_id, texts in documents.items():
+                changed += self.update(doc_id, texts)
+        return changed
+
+    def _expand(self, token: str, prefix: bool) -> List[str]:
+        if not prefix:
+            return [token] if token in self._postings else []
+        start = bisect_left(self._vocabulary, token)
+        end = start
+        while end < len(self._vocabulary) and self._vocabulary[end].startswith(token):
+            end += 1
+        return self._vocabulary[start:end]
+
+    def search(self, query: str, limit: Optional[int] = None, prefix: bool = True) -> List[Tuple[Hashable, float]]:
+        """
+        Tìm tài liệu khớp mọi từ trong query, điểm cao nhất trước.
+
+        Args:
+            query: chuỗi tìm kiếm (có dấu hoặc không dấu)
+            limit: số kết quả tối đa, None là tất cả
+            prefix: cho phép mỗi từ truy vấn khớp tiền tố của từ trong tài liệu
+        """
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens:
+            return []
+        with self._lock:
+            total_docs = len(self._doc_terms)
+            scores: Optional[Dict[Hashable, float]] = None
+            # Từ hiếm trước để tập ứng viên thu hẹp nhanh
+            expansions = sorted(
+                (self._expand(token, prefix) for token in tokens),
+                key=lambda terms: sum(len(self._postings[term]) for term in terms)
+            )
+            for terms in expansions:
+                token_scores: Dict[Hashable, float] = {}
+                for term in terms:
+                    postings = self._postings[term]
+                    idf = math.log(1.0 + total_docs / len(postings))
+                    for doc_id, weight in postings.items():
+                        if scores is not None and doc_id not in scores:
+                            continue
+                        score = weight * idf
+                        if score > token_scores.get(doc_id, 0.0):
+                            token_scores[doc_id] = score
+                if scores is None:
+                    scores = token_scores
+                else:
+                    scores = {doc_id: scores[doc_id] + score for doc_id, score in token_scores.items()}
+                if not scores:
+                    return []
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return ranked[:limit] if limit is not None else ranked
+
+    def matching(self, query: str, prefix: bool = True) -> Optional[set]:
+        """Tập doc_id khớp query; None nếu query không có từ nào (không lọc)"""
+        if not tokenize(query):
+            return None
+        return {doc_id for doc_id, _ in self.search(query, prefix=prefix)}
+
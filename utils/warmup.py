@@ -0,0 +1,241 @@
+"""
+Khởi động nóng (warm-up) trước khi worker nhận request.
+
+Các bước tốn thời gian ở request đầu tiên được chạy chủ động và đo thời gian:
+    nltk          nạp stopwords của NLTK
+    sbert_load    nạp SentenceTransformer
+    ner_load      nạp pipeline NER (tùy chọn)
+    history       nạp chỉ mục lịch sử biểu mẫu và ảnh chụp dạng cột
+    sbert         chạy thử một lần encode                         (worker)
+    ner           chạy thử pipeline NER (tùy chọn)                (worker)
+    field_matcher dựng EnhancedFieldMatcher, chỉ mục gần đúng và
+                  embedding SBERT của tên trường, gợi ý thử       (worker)
+    database      mở kết nối DB đầu tiên                          (worker)
+
+Khi gunicorn preload ứng dụng, các bước chỉ nạp mô hình chạy một lần trong
+master trước khi fork; worker thừa hưởng kết quả (và bộ nhớ) của master. Các
+bước đánh dấu (worker) chỉ chạy sau khi fork: suy luận torch trong master sẽ
+khởi tạo thread pool OpenMP, mà libgomp không an toàn khi fork nên worker có
+thể treo ở phép tính song song đầu tiên; kết nối DB cũng không dùng chung
+được giữa các tiến trình.
+
+Bước lỗi được thử lại với thời gian chờ tăng dần. /readyz báo sẵn sàng khi mọi
+bước bắt buộc đã xong; bước tùy chọn (NER, có thể không có mô hình khi
+offline) lỗi không chặn worker nhận request.
+
+Cấu hình qua biến môi trường:
+    WARMUP=0                 tắt warm-up (worker sẵn sàng ngay)
+    WARMUP_STAGES=a,b        chỉ chạy các bước này
+    WARMUP_CONCURRENCY=n     số bước chạy song song (mặc định 1: tuần tự)
+    WARMUP_RETRIES=n         số lần thử lại bước lỗi (mặc định 3)
+    WARMUP_RETRY_DELAY=s     thời gian chờ trước lần thử lại đầu, nhân đôi mỗi lần (mặc định 5)
+"""
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from config.config import FORM_HISTORY_PATH
+
+logger = logging.getLogger(__name__)
+
+WARMUP_ENABLED = os.environ.get('WARMUP', '1') != '0'
+WARMUP_CONCURRENCY = int(os.environ.get('WARMUP_CONCURRENCY', '1'))
+WARMUP_RETRIES = int(os.environ.get('WARMUP_RETRIES', '3'))
+WARMUP_RETRY_DELAY = float(os.environ.get('WARMUP_RETRY_DELAY', '5'))
+
+PENDING = 'pending'
+RUNNING = 'running'
+OK = 'ok'
+FAILED = 'failed'
+
+
+def _stage_nltk(app):
+    from nltk.corpus import stopwords
+    stopwords.words('english')
+
+
+def _stage_sbert_load(app):
+    from utils.model_registry import get_sentence_transformer
+    get_sentence_transformer()
+
+
+def _stage_ner_load(app):
+    import utils.document_utils  # noqa: F401  (nạp pipeline NER khi import)
+
+
+def _stage_sbert(app):
+    from utils.model_registry import get_sentence_transformer
+    get_sentence_transformer().encode(['họ và tên'])
+
+
+def _stage_ner(app):
+    from utils.document_utils import ner_pipeline
+    ner_pipeline('Nguyễn Văn An sống tại Hà Nội')
+
+
+def _stage_history(app):
+    from models.form_history_store import get_form_history_store
+    from utils.history_snapshot import get_history_snapshot
+    get_form_history_store().count()
+    get_history_snapshot()
+
+
+def _stage_field_matcher(app):
+    from utils.field_matcher import EnhancedFieldMatcher
+    matcher = EnhancedFieldMatcher(FORM_HISTORY_PATH)
+    # Mã hóa tên trường ở đây thay vì trong request đầu tiên cần SBERT
+    matcher._get_lookup_index()
+    matcher._get_sbert_store()
+    matcher.match_fields('họ và tên', fast_mode=True)
+
+
+def _stage_database(app):
+    from models.user import db
+    with app.app_context():
+        db.session.execute(db.text('SELECT 1'))
+        db.session.remove()
+
+
+# tên -> (hàm, chỉ chạy trong worker sau khi fork, tùy chọn)
+STAGES = OrderedDict([
+    ('nltk', (_stage_nltk, False, False)),
+    ('sbert_load', (_stage_sbert_load, False, False)),
+    ('ner_load', (_stage_ner_load, False, True)),
+    ('history', (_stage_history, False, False)),
+    ('sbert', (_stage_sbert, True, False)),
+    ('ner', (_stage_ner, True, True)),
+    ('field_matcher', (_stage_field_matcher, True, False)),
+    ('database', (_stage_database, True, False)),
+])
+
+
+class WarmupRunner:
+    """Chạy các bước warm-up của một tiến trình và giữ kết quả từng bước"""
+
+    def __init__(self, stages: Optional[List[str]] = None, concurrency: int = WARMUP_CONCURRENCY,
+                 inherited: Optional[Dict[str, Dict]] = None, master: bool = False,
+                 retries: int = WARMUP_RETRIES, retry_delay: float = WARMUP_RETRY_DELAY):
+        self.stage_names = [name for name in (stages or STAGES) if name in STAGES]
+        self.concurrency = max(1, concurrency)
+        self.master = master
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.pid = os.getpid()
+        self.results: Dict[str, Dict] = {name: self._result(name, PENDING) for name in self.stage_names}
+        # Kết quả từ master trước khi fork (bỏ các bước phải chạy trong worker)
+        for name, result in (inherited or {}).items():
+            if name in self.results and result['status'] == OK and not STAGES[name][1]:
+                self.results[name] = dict(result, inherited=True)
+        self.started_at = None
+        self.finished_at = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _result(name: str, status: str, seconds=None, error=None, attempts: int = 0) -> Dict:
+        return {'status': status, 'seconds': seconds, 'error': error, 'attempts': attempts,
+                'optional': STAGES[name][2]}
+
+    def _run_stage(self, app, name: str):
+        func = STAGES[name][0]
+        # Trong master chỉ thử một lần để không làm chậm việc fork; worker thử lại bước lỗi
+        attempts = 1 if self.master else 1 + max(0, self.retries)
+        for attempt in range(1, attempts + 1):
+            with self._lock:
+                self.results[name] = self._result(name, RUNNING, attempts=attempt)
+            started = time.perf_counter()
+            try:
+                func(app)
+                status, error = OK, None
+            except Exception as e:
+                status, error = FAILED, str(e)[:300]
+                logger.error(f"Warm-up bước '{name}' thất bại (lần {attempt}): {e}", exc_info=True)
+            seconds = round(time.perf_counter() - started, 3)
+            with self._lock:
+                self.results[name] = self._result(name, status, seconds, error, attempt)
+            logger.info(f"Warm-up bước '{name}': {status} sau {seconds}s (pid {self.pid})")
+            if status == OK or attempt == attempts:
+                return
+            time.sleep(self.retry_delay * 2 ** (attempt - 1))
+
+    def run(self, app):
+        """Chạy các bước chưa hoàn tất (đồng bộ); master bỏ qua các bước của worker"""
+        pending = [name for name in self.stage_names
+                   if self.results[name]['status'] != OK and not (self.master and STAGES[name][1])]
+        self.started_at = time.time()
+        if self.concurrency == 1 or len(pending) <= 1:
+            for name in pending:
+                self._run_stage(app, name)
+        else:
+            with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='warmup') as executor:
+                list(executor.map(lambda name: self._run_stage(app, name), pending))
+        self.finished_at = time.time()
+        return self.status()
+
+    def start(self, app):
+        """Chạy trong luồng nền, không chặn tiến trình"""
+        self._thread = threading.Thread(target=self.run, args=(app,), name='warmup', daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def _ready(results: Dict[str, Dict]) -> bool:
+        """Mọi bước bắt buộc đã xong; bước tùy chọn không chặn"""
+        return all(result['status'] == OK or (result['optional'] and result['status'] == FAILED)
+                   for result in results.values())
+
+    @property
+    def ready(self) -> bool:
+        return self._ready(self.results)
+
+    def status(self) -> Dict:
+        with self._lock:
+            results = {name: dict(result) for name, result in self.results.items()}
+        return {
+            'pid': self.pid,
+            'ready': self._ready(results),
+            'total_seconds': (round(self.finished_at - self.started_at, 3)
+                              if self.finished_at and self.started_at else None),
+            'stages': results,
+        }
+
+
+_runner: Optional[WarmupRunner] = None
+_runner_lock = threading.Lock()
+
+
+def start_warmup(app, background: bool = True, master: bool = False) -> Optional[WarmupRunner]:
+    """
+    Khởi động warm-up cho tiến trình hiện tại (gọi lại nhiều lần vẫn an toàn).
+
+    master=True khi gọi trong master gunicorn trước khi fork: chỉ chạy các bước
+    nạp mô hình. Sau khi fork, runner của master được thay bằng runner mới thừa
+    hưởng các bước đã xong và chạy các bước còn lại.
+    """
+    global _runner
+    if not WARMUP_ENABLED:
+        return None
+    if _runner is not None and _runner.pid == os.getpid():
+        return _runner
+    with _runner_lock:
+        if _runner is None or _runner.pid != os.getpid():
+            stages = [s.strip() for s in os.environ.get('WARMUP_STAGES', '').split(',') if s.strip()]
+            inherited = _runner.results if _runner is not None else None
+            _runner = WarmupRunner(stages=stages or None, inherited=inherited, master=master)
+            if background:
+                _runner.start(app)
+            else:
+                _runner.run(app)
+    return _runner
+
+
+def warmup_status() -> Dict:
+    """Trạng thái warm-up của tiến trình hiện tại"""
+    if not WARMUP_ENABLED:
+        return {'pid': os.getpid(), 'ready': True, 'stages': {}, 'disabled': True}
+    if _runner is None or _runner.pid != os.getpid():
+        return {'pid': os.getpid(), 'ready': False, 'stages': {}}
+    return _runner.status()